@@ -0,0 +1,192 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+# Cấu hình cache câu trả lời
+ANSWER_CACHE_TTL = 24 * 3600           # Giây, câu trả lời cũ hơn sẽ bị bỏ
+ANSWER_CACHE_MAX_ENTRIES = 2000        # Vượt quá sẽ xóa các mục ít dùng gần đây nhất
+ANSWER_SIMILARITY_THRESHOLD = 0.95     # Cosine tối thiểu để coi là cùng câu hỏi
+
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa câu hỏi: Unicode NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối"""
+    query = unicodedata.normalize('NFC', query).casefold()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip(" ?!.…")
+
+
+def _unit(vector) -> np.ndarray:
+    """Chuẩn hóa vector về độ dài 1 để so sánh cosine bằng tích vô hướng"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """Cache câu trả lời theo (câu hỏi, model, phiên bản index, phạm vi), lưu trong SQLite
+
+    Tìm theo câu hỏi đã chuẩn hóa trước, sau đó theo embedding gần trùng
+    (cosine >= similarity_threshold). Mục hết hạn TTL hoặc thuộc phiên bản
+    index cũ (đã thêm/xóa tài liệu) sẽ không bao giờ được trả về. Phạm vi
+    (các file được chọn) chỉ tách các mục, đổi phạm vi không xóa cache.
+    """
+
+    def __init__(self, path: str,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 similarity_threshold: float = ANSWER_SIMILARITY_THRESHOLD):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, query TEXT NOT NULL, model TEXT NOT NULL, "
+            "index_version TEXT NOT NULL, answer TEXT NOT NULL, sources TEXT NOT NULL, "
+            "embedding BLOB, created_at REAL NOT NULL, last_access REAL NOT NULL, "
+            "scope TEXT NOT NULL DEFAULT '')")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]
+        if 'scope' not in columns:
+            # Cache tạo trước khi có phạm vi tìm kiếm: mọi mục đều là phạm vi toàn bộ
+            self._conn.execute("ALTER TABLE answers ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.commit()
+        self._current_version: Optional[str] = None
+        # Embedding của các câu hỏi: key -> (model, index_version, scope, vector)
+        self._vectors: Dict[str, Tuple[str, str, str, np.ndarray]] = {}
+        for key, model, version, scope, blob in self._conn.execute(
+                "SELECT key, model, index_version, scope, embedding FROM answers "
+                "WHERE embedding IS NOT NULL"):
+            self._vectors[key] = (model, version, scope, np.frombuffer(blob, dtype=np.float32))
+
+    @staticmethod
+    def _scope(source_files: Optional[List[str]]) -> str:
+        """Phạm vi tìm kiếm dạng chuỗi ('' là toàn bộ tài liệu)"""
+        return json.dumps(sorted(set(source_files)), ensure_ascii=False) if source_files else ''
+
+    @staticmethod
+    def _make_key(normalized_query: str, model: str, index_version: str, scope: str = '') -> str:
+        parts = [normalized_query, model, index_version]
+        if scope:
+            parts.append(scope)
+        raw = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _delete(self, where: str, params: tuple = ()):
+        """Xóa các mục theo điều kiện, đồng bộ cả bản embedding trong RAM"""
+        keys = [row[0] for row in self._conn.execute(
+            f"SELECT key FROM answers WHERE {where}", params)]
+        if keys:
+            self._conn.execute(f"DELETE FROM answers WHERE {where}", params)
+            self._conn.commit()
+            for key in keys:
+                self._vectors.pop(key, None)
+
+    def _on_version(self, index_version: str):
+        """Index đã đổi (thêm/xóa tài liệu) - bỏ toàn bộ câu trả lời cũ"""
+        if index_version != self._current_version:
+            self._delete("index_version != ?", (index_version,))
+            self._current_version = index_version
+
+    def lookup(self, query: str, model: str, index_version: str,
+               query_embedding: Optional[List[float]] = None,
+               source_files: Optional[List[str]] = None) -> Optional[dict]:
+        """Tìm câu trả lời đã cache, trả về dict (answer, source_documents, match)
+
+        source_files: phạm vi tìm kiếm của câu hỏi (None: toàn bộ tài liệu).
+        """
+        with self._lock:
+            self._on_version(index_version)
+            self._delete("created_at < ?", (time.time() - self.ttl,))
+
+            normalized = normalize_query(query)
+            scope = self._scope(source_files)
+            key = self._make_key(normalized, model, index_version, scope)
+            match = "exact"
+            row = self._conn.execute(
+                "SELECT answer, sources FROM answers WHERE key = ?", (key,)).fetchone()
+
+            if row is None and query_embedding is not None and self._vectors:
+                # Tìm câu hỏi gần trùng theo embedding
+                candidates = [(k, v) for k, (m, ver, sc, v) in self._vectors.items()
+                              if m == model and ver == index_version and sc == scope]
+                if candidates:
+                    matrix = np.vstack([v for _, v in candidates])
+                    scores = matrix @ _unit(query_embedding)
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold:
+                        key = candidates[best][0]
+                        match = f"similar ({scores[best]:.3f})"
+                        row = self._conn.execute(
+                            "SELECT answer, sources FROM answers WHERE key = ?",
+                            (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            answer, sources = row
+            return {
+                'answer': answer,
+                'source_documents': [Document(page_content=s['page_content'],
+                                              metadata=s['metadata'])
+                                     for s in json.loads(sources)],
+                'match': match,
+            }
+
+    def store(self, query: str, model: str, index_version: str, answer: str,
+              source_documents: List[Document],
+              query_embedding: Optional[List[float]] = None,
+              source_files: Optional[List[str]] = None):
+        """Lưu câu trả lời, xóa bớt các mục ít dùng nhất nếu vượt giới hạn"""
+        with self._lock:
+            self._on_version(index_version)
+            normalized = normalize_query(query)
+            scope = self._scope(source_files)
+            key = self._make_key(normalized, model, index_version, scope)
+            vector = _unit(query_embedding) if query_embedding is not None else None
+            sources = json.dumps(
+                [{'page_content': d.page_content, 'metadata': d.metadata}
+                 for d in source_documents], ensure_ascii=False, default=str)
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, query, model, index_version, answer, "
+                "sources, embedding, created_at, last_access, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, normalized, model, index_version, answer, sources,
+                 vector.tobytes() if vector is not None else None, now, now, scope))
+            self._conn.commit()
+            if vector is not None:
+                self._vectors[key] = (model, index_version, scope, vector)
+
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                self._delete(
+                    "key IN (SELECT key FROM answers ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._delete("1 = 1")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'size': size,
+                    'max_entries': self.max_entries}
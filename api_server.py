@@ -0,0 +1,319 @@
+"""HTTP API trả lời câu hỏi (không cần Streamlit), xử lý nhiều request đồng thời
+
+Cách dùng:
+    python api_server.py                       # lắng nghe API_HOST:API_PORT (config.env)
+    python api_server.py --port 9000 --model fake   # LLM giả lập, không gọi mạng
+
+Endpoints:
+    POST /query   {"question": "...", "model": "gemini", "use_cache": true, "timeout_s": 30,
+                   "source_files": ["a.pdf"]}   # source_files: chỉ tìm trong các file này
+    GET  /health  trạng thái warm-up
+    GET  /stats   số request, hàng đợi, latency p50/p95
+    GET  /metrics thời gian từng giai đoạn ingest/truy vấn (định dạng Prometheus)
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from llm_rag import EVENT_DONE, EVENT_TOKEN, get_llm_backends, get_qa_chain, stream_answer
+from telemetry import export_prometheus
+from warmup import get_startup_timings, is_warm, start_warmup
+
+load_dotenv('config.env')
+
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '8000'))
+API_DEFAULT_MODEL = os.getenv('API_DEFAULT_MODEL', 'gemini')
+
+# Pool cho phần CPU (embedding câu hỏi, FAISS/BM25, rerank) - nhỏ, theo số core
+RETRIEVAL_WORKERS = int(os.getenv('API_RETRIEVAL_WORKERS', str(max(1, min(4, os.cpu_count() or 1)))))
+# Số lời gọi LLM chạy cùng lúc (chủ yếu chờ mạng nên lớn hơn)
+LLM_CONCURRENCY = int(os.getenv('API_LLM_CONCURRENCY', '16'))
+# Số request đang xử lý + đang chờ tối đa; vượt quá thì trả 503 ngay
+MAX_PENDING = int(os.getenv('API_MAX_PENDING', '64'))
+REQUEST_TIMEOUT_S = float(os.getenv('API_REQUEST_TIMEOUT_S', '60'))
+MAX_QUESTION_CHARS = 2000
+LATENCY_WINDOW = 1000  # Số request gần nhất dùng để tính p50/p95
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+class QueryService:
+    """Chạy retrieval và LLM trong hai pool giới hạn, có timeout và giới hạn hàng đợi
+
+    Mỗi request đi qua stream_answer như giao diện Streamlit (cùng cache,
+    cùng QA chain pool): bước đầu (cache + retrieval) chạy trong pool
+    retrieval, phần sinh câu trả lời chạy tiếp trong pool LLM, nên câu hỏi
+    chờ LLM không giữ chỗ của phần CPU.
+    """
+
+    def __init__(self, retrieval_workers: int = RETRIEVAL_WORKERS,
+                 llm_concurrency: int = LLM_CONCURRENCY, max_pending: int = MAX_PENDING,
+                 timeout_s: float = REQUEST_TIMEOUT_S):
+        self.retrieval_pool = ThreadPoolExecutor(retrieval_workers, thread_name_prefix="retrieval")
+        self.llm_pool = ThreadPoolExecutor(llm_concurrency, thread_name_prefix="llm")
+        self.retrieval_workers = retrieval_workers
+        self.llm_concurrency = llm_concurrency
+        self.max_pending = max_pending
+        self.timeout_s = timeout_s
+        self.pending = 0
+        self.counters = {'completed': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def try_acquire(self) -> bool:
+        """Nhận request nếu còn chỗ (chỉ gọi từ event loop nên không cần lock)"""
+        if self.pending >= self.max_pending:
+            self.counters['rejected'] += 1
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+    def _release_when_done(self, loop: asyncio.AbstractEventLoop, future: Future,
+                           close_events: bool = False):
+        """Request đã hết giờ nhưng thread vẫn chạy: trả chỗ khi thread xong
+
+        close_events: đóng generator stream_answer mà retrieve trả về (không
+        ai đọc tiếp), để kết thúc span và giải phóng tài nguyên của nó.
+        """
+        def done(future: Future):
+            if close_events and not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+            try:
+                loop.call_soon_threadsafe(self.release)
+            except RuntimeError:
+                pass  # Event loop đã đóng khi tắt server
+
+        future.add_done_callback(done)
+
+    @staticmethod
+    async def _wait(future: Future, deadline: float):
+        return await asyncio.wait_for(asyncio.wrap_future(future),
+                                      max(0.0, deadline - time.monotonic()))
+
+    async def answer(self, question: str, model_type: str, use_cache: bool = True,
+                     timeout_s: Optional[float] = None,
+                     source_files: Optional[List[str]] = None) -> dict:
+        """Trả lời một câu hỏi; quá thời gian thì raise asyncio.TimeoutError
+
+        Gọi sau try_acquire: chỗ được trả khi thread cuối cùng của request
+        xong (thread không hủy được khi hết giờ), nên pending luôn bằng số
+        việc thực sự còn chạy.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        deadline = time.monotonic() + (timeout_s or self.timeout_s)
+
+        def retrieve():
+            queued_s = time.perf_counter() - start
+            chain = get_qa_chain(model_type)
+            events = stream_answer(chain, question, model_type, use_cache, source_files)
+            _, sources = next(events)  # Tra cache + retrieval
+            return events, sources, queued_s
+
+        def generate(events):
+            parts, stats = [], {}
+            for event, payload in events:
+                if event == EVENT_TOKEN:
+                    parts.append(payload)
+                elif event == EVENT_DONE:
+                    stats = payload
+                if time.monotonic() > deadline:
+                    # Dừng gọi LLM, không chiếm pool sau khi request đã hết giờ
+                    events.close()
+                    raise asyncio.TimeoutError()
+            return "".join(parts), stats
+
+        release = True
+        try:
+            future = self.retrieval_pool.submit(retrieve)
+            try:
+                events, sources, queued_s = await self._wait(future, deadline)
+            except asyncio.TimeoutError:
+                if not future.cancel():
+                    release = False
+                    self._release_when_done(loop, future, close_events=True)
+                raise
+
+            future = self.llm_pool.submit(generate, events)
+            try:
+                answer, stats = await self._wait(future, deadline)
+            except asyncio.TimeoutError:
+                if future.cancel():
+                    events.close()
+                else:
+                    # generate tự dừng ở token kế tiếp; LLM bị treo vẫn giữ chỗ tới khi trả về
+                    release = False
+                    self._release_when_done(loop, future)
+                raise
+        finally:
+            if release:
+                self.release()
+
+        total_s = time.perf_counter() - start
+        self.latencies.append(total_s)
+        self.counters['completed'] += 1
+        timings = {key: round(value, 4) for key, value in stats.items()
+                   if key.endswith('_s') and value is not None}
+        timings.update(queue_s=round(queued_s, 4), server_s=round(total_s, 4))
+        return {
+            'answer': answer,
+            'model': model_type,
+            'cached': stats.get('cached'),
+            'context': stats.get('context'),
+            'trace_id': stats.get('trace_id'),
+            'timings': timings,
+            'sources': [{
+                'source_file': doc.metadata.get('source_file'),
+                'page': doc.metadata.get('page'),
+                'chunk_id': doc.metadata.get('chunk_id'),
+                'text': doc.page_content[:300],
+            } for doc in sources],
+        }
+
+    def stats(self) -> dict:
+        latencies = list(self.latencies)
+        return {
+            **self.counters,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'retrieval_workers': self.retrieval_workers,
+            'llm_concurrency': self.llm_concurrency,
+            'latency_p50_s': _percentile(latencies, 0.5),
+            'latency_p95_s': _percentile(latencies, 0.95),
+        }
+
+    def shutdown(self):
+        self.retrieval_pool.shutdown(wait=False, cancel_futures=True)
+        self.llm_pool.shutdown(wait=False, cancel_futures=True)
+
+
+SERVICE_KEY = web.AppKey("query_service", QueryService)
+
+
+def _error(status: int, message: str, **headers) -> web.Response:
+    return web.json_response({'error': message}, status=status, headers=headers or None)
+
+
+async def handle_query(request: web.Request) -> web.Response:
+    service: QueryService = request.app[SERVICE_KEY]
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error(400, "Body phải là JSON")
+    if not isinstance(body, dict):
+        return _error(400, "Body phải là JSON object")
+
+    question = str(body.get('question') or '').strip()
+    if not question:
+        return _error(400, "Thiếu 'question'")
+    if len(question) > MAX_QUESTION_CHARS:
+        return _error(400, f"Câu hỏi dài quá {MAX_QUESTION_CHARS} ký tự")
+    model_type = body.get('model') or API_DEFAULT_MODEL
+    if model_type not in get_llm_backends():
+        return _error(400, f"Model '{model_type}' không được hỗ trợ. Chọn: {', '.join(get_llm_backends())}")
+    source_files = body.get('source_files') or None
+    if source_files is not None and (not isinstance(source_files, list)
+                                     or not all(isinstance(f, str) for f in source_files)):
+        return _error(400, "'source_files' phải là danh sách tên file")
+    try:
+        timeout_s = min(float(body.get('timeout_s') or service.timeout_s), service.timeout_s)
+    except (TypeError, ValueError):
+        return _error(400, "'timeout_s' phải là số")
+
+    # Backpressure: từ chối ngay thay vì xếp hàng vô hạn (answer trả chỗ khi xong)
+    if not service.try_acquire():
+        return _error(503, "Server đang quá tải, thử lại sau", **{'Retry-After': '1'})
+    try:
+        result = await service.answer(question, model_type,
+                                      use_cache=bool(body.get('use_cache', True)),
+                                      timeout_s=timeout_s, source_files=source_files)
+        return web.json_response(result)
+    except asyncio.TimeoutError:
+        service.counters['timeouts'] += 1
+        return _error(504, f"Quá thời gian xử lý ({timeout_s:g}s)")
+    except ValueError as e:
+        # Thiếu API key, chưa có vector store...
+        service.counters['errors'] += 1
+        return _error(503, str(e))
+    except Exception as e:
+        service.counters['errors'] += 1
+        return _error(500, f"Lỗi xử lý: {e}")
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    startup = get_startup_timings()
+    return web.json_response({'status': 'ok' if is_warm() else 'warming', **startup})
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app[SERVICE_KEY].stats())
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=export_prometheus().encode('utf-8'),
+                        headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+
+def create_app(service: Optional[QueryService] = None) -> web.Application:
+    """Tạo aiohttp app; model embedding, index và QA chain mặc định được load nền"""
+    app = web.Application(client_max_size=64 * 1024)
+    app[SERVICE_KEY] = service or QueryService()
+    app.router.add_post('/query', handle_query)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/stats', handle_stats)
+    app.router.add_get('/metrics', handle_metrics)
+
+    async def on_startup(app):
+        start_warmup()
+
+    async def on_cleanup(app):
+        app[SERVICE_KEY].shutdown()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    global API_DEFAULT_MODEL
+    parser = argparse.ArgumentParser(description="HTTP API hỏi đáp trên các tài liệu đã xử lý")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--model", default=API_DEFAULT_MODEL,
+                        help=f"Model mặc định khi request không chỉ định ({', '.join(get_llm_backends())})")
+    parser.add_argument("--retrieval-workers", type=int, default=RETRIEVAL_WORKERS)
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_CONCURRENCY)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT_S,
+                        help="Thời gian tối đa của một request (giây)")
+    args = parser.parse_args()
+
+    API_DEFAULT_MODEL = args.model
+    service = QueryService(args.retrieval_workers, args.llm_concurrency,
+                           args.max_pending, args.timeout)
+    print(f"🚀 API: http://{args.host}:{args.port} (model mặc định: {args.model})")
+    web.run_app(create_app(service), host=args.host, port=args.port, print=None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,51 @@
+import time
+_import_start = time.perf_counter()
+
 import streamlit as st
 import sys
 import os
-import shutil
 
 # Thêm đường dẫn hiện tại vào sys.path để import được các module local
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from llm_rag import qa_chain, create_qa_chain
+    from llm_rag import (
+        get_qa_chain, get_chain_pool_info, stream_answer, get_answer_cache,
+        EVENT_SOURCES, EVENT_TOKEN, EVENT_DONE
+    )
     from pre_doc import (
         get_available_documents,
-        process_single_document,
-        get_default_vector_store,
-        process_all_documents,
+        get_combined_index_info,
+        get_dedup_report,
+        migrate_legacy_stores,
         DOCUMENTS_DIR
     )
+    from faiss_index import INDEX_TYPES, VECTOR_DTYPES
+    from shards import SEARCH_MODE, SEARCH_SHARDED, SHARD_SEARCH_WORKERS
+    from storage import COMBINED_VECTOR_DTYPE
+    from embeddings import get_loaded_models
+    from reranker import get_rerank_stats
+    from ingest import INGEST_WORKERS
+    from jobs import (
+        JOB_INGEST, JOB_REINDEX, JOB_DELETE, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE,
+        STATUS_FAILED, enqueue, list_jobs, retry_job, clear_finished, start_worker
+    )
+    from warmup import STARTUP_IMPORTS, get_startup_timings, is_warm, record_timing, start_warmup
+    from telemetry import (
+        export_prometheus, get_recent_errors, get_recent_spans, get_rss_mb, get_stage_stats,
+        reset as reset_telemetry
+    )
 except ImportError as e:
     st.error(f"Lỗi import: {e}")
     st.stop()
 
+# Model embedding, vector store và QA chain được load trong background thread;
+# UI hiển thị ngay, truy vấn đầu tiên sẽ chờ phần còn thiếu
+if start_warmup():
+    record_timing(STARTUP_IMPORTS, time.perf_counter() - _import_start)
+# Xử lý/xóa/rebuild tài liệu chạy trong worker nền, UI chỉ thêm job vào hàng đợi
+start_worker()
+
 st.set_page_config(
     page_title="Chatbot RAG Multi-Document",
     page_icon="🤖",
@@ -28,12 +55,150 @@ st.set_page_config(
 st.title("🤖 Chatbot RAG Multi-Document")
 st.markdown("---")
 
+JOB_KIND_LABELS = {
+    JOB_INGEST: "📥 Xử lý",
+    JOB_REINDEX: "🔄 Rebuild",
+    JOB_DELETE: "🗑️ Xóa",
+}
+JOB_STATUS_ICONS = {
+    STATUS_QUEUED: "⏳",
+    STATUS_RUNNING: "⚙️",
+    STATUS_DONE: "✅",
+    STATUS_FAILED: "❌",
+}
+
+
+def job_title(job):
+    """Tên ngắn của job để hiển thị (loại + file)"""
+    payload = job['payload']
+    if job['kind'] == JOB_INGEST:
+        names = [os.path.basename(p) for p in payload.get('paths', [])]
+        target = names[0] if len(names) == 1 else f"{len(names)} file"
+    elif job['kind'] == JOB_DELETE:
+        target = os.path.basename(payload.get('path', ''))
+    else:
+        target = f"{payload.get('index_type')}, {payload.get('vector_dtype')}"
+    return f"{JOB_STATUS_ICONS.get(job['status'], '')} {JOB_KIND_LABELS.get(job['kind'], job['kind'])}: {target}"
+
+
+def render_jobs():
+    """Hiển thị trạng thái, tiến độ và số lần thử của các job nền"""
+    jobs = list_jobs()
+    if not jobs:
+        return
+
+    st.markdown("**🧵 Job nền:**")
+    for job in jobs:
+        st.caption(job_title(job))
+        if job['status'] == STATUS_RUNNING:
+            st.progress(job['progress'], text=job['message'] or "Đang chạy...")
+        elif job['status'] == STATUS_DONE and job['message']:
+            st.caption(f"↳ {job['message']}")
+        if job['attempts'] > 1 or job['status'] == STATUS_FAILED:
+            st.caption(f"↳ Lần thử {job['attempts']}/{job['max_attempts']}")
+        if job['error'] and job['status'] != STATUS_DONE:
+            st.caption(f"↳ ⚠️ {job['error']}")
+        if job['status'] == STATUS_FAILED:
+            if st.button("🔁 Chạy lại", key=f"retry_job_{job['id']}"):
+                retry_job(job['id'])
+                st.rerun()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔄 Cập nhật trạng thái", key="refresh_jobs"):
+            st.rerun()
+    with col2:
+        if st.button("🧹 Xóa job đã xong", key="clear_jobs"):
+            clear_finished()
+            st.rerun()
+    st.markdown("---")
+
+
+def render_diagnostics():
+    """Bảng p50/p95 từng giai đoạn ingest/truy vấn, bộ nhớ và các lỗi gần nhất"""
+    rss_mb = get_rss_mb()
+    if rss_mb is not None:
+        st.metric("🧠 Bộ nhớ (RSS)", f"{rss_mb:.0f} MB")
+
+    stats = get_stage_stats()
+    if not stats:
+        st.info("📭 Chưa có số liệu. Hãy xử lý tài liệu hoặc đặt câu hỏi!")
+    else:
+        st.markdown("**⏱️ Thời gian từng giai đoạn:**")
+        st.dataframe([{
+            'Giai đoạn': stage,
+            'Số lần': values['count'],
+            'p50 (ms)': values['p50_ms'],
+            'p95 (ms)': values['p95_ms'],
+            'Gần nhất (ms)': values['last_ms'],
+            'Lỗi': values['errors'],
+            'Tổng': ", ".join(f"{key} {total:g}" for key, total in values['items'].items()),
+        } for stage, values in stats.items()], hide_index=True, use_container_width=True)
+
+    errors = get_recent_errors()
+    if errors:
+        with st.expander(f"⚠️ Lỗi gần nhất ({len(errors)})"):
+            for entry in errors:
+                st.markdown(f"**{entry['stage']}** - {time.strftime('%H:%M:%S', time.localtime(entry['time']))}")
+                st.code(entry['traceback'] or entry['error'])
+
+    spans = get_recent_spans(limit=30)
+    if spans:
+        with st.expander("🧾 Span gần nhất"):
+            for item in spans:
+                details = ", ".join(f"{key}={value}" for key, value in item.items()
+                                    if key not in ('stage', 'trace_id', 'ms', 'time', 'error'))
+                prefix = "⚠️ " if 'error' in item else ""
+                st.caption(f"{prefix}{item['stage']} {item['ms']:.1f}ms"
+                           + (f" [{item['trace_id']}]" if item['trace_id'] else "")
+                           + (f" - {details}" if details else ""))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔄 Cập nhật", key="refresh_diagnostics"):
+            st.rerun()
+    with col2:
+        if st.button("🧹 Xóa số liệu", key="reset_diagnostics"):
+            reset_telemetry()
+            st.rerun()
+    st.download_button("📥 Tải metrics (Prometheus)", export_prometheus(),
+                       file_name="metrics.prom", mime="text/plain")
+
+
+def render_sources(source_docs):
+    """Hiển thị nguồn tham khảo, nhóm theo file"""
+    if not source_docs:
+        return
+
+    with st.expander("📚 Nguồn tham khảo"):
+        # Nhóm theo file nguồn
+        sources_by_file = {}
+        for doc in source_docs[:10]:
+            source_file = doc.metadata.get('source_file', 'Unknown')
+            if source_file not in sources_by_file:
+                sources_by_file[source_file] = []
+            sources_by_file[source_file].append(doc)
+
+        # Hiển thị theo từng file
+        for file_name, docs in sources_by_file.items():
+            st.markdown(f"**📄 {file_name}** ({len(docs)} đoạn)")
+            for i, doc in enumerate(docs[:3]):  # Hiển thị tối đa 3 đoạn mỗi file
+                page_num = doc.metadata.get('page', 'N/A')
+                st.markdown(f"*Trang {page_num}:*")
+                other_files = [f for f in doc.metadata.get('source_files', []) if f != file_name]
+                if other_files:
+                    st.caption(f"Cũng có trong: {', '.join(other_files)}")
+                st.text(doc.page_content[:300] + "..." if len(doc.page_content) > 300 else doc.page_content)
+                if i < len(docs[:3]) - 1:
+                    st.markdown("---")
+
+
 # Sidebar để chọn model và quản lý tài liệu
 with st.sidebar:
     st.header("⚙️ Cấu hình System")
 
     # Tab để chọn giữa cấu hình và quản lý file
-    tab1, tab2 = st.tabs(["🔧 Model", "📚 Tài liệu"])
+    tab1, tab2, tab3 = st.tabs(["🔧 Model", "📚 Tài liệu", "📈 Chẩn đoán"])
     
     with tab1:
         model_choice = st.selectbox(
@@ -70,7 +235,53 @@ with st.sidebar:
             st.success("✅ Gemini API Key OK")
         else:
             st.error("❌ Gemini API Key Missing")
-    
+
+        # Thông tin các embedding model đã load trong process
+        loaded_models = get_loaded_models()
+        if loaded_models:
+            st.markdown("**🧠 Embedding Models:**")
+            for info in loaded_models:
+                memory = f", ~{info['memory_mb']} MB" if info['memory_mb'] is not None else ""
+                st.caption(f"{info['model_name']} ({info['backend']}, {info['device']}) - load {info['load_time_s']}s{memory}")
+                cache_info = info['query_cache']
+                st.caption(f"Cache embedding câu hỏi: {cache_info['size']}/{cache_info['max_size']}"
+                           f" - hit {cache_info['hits']}, miss {cache_info['misses']}")
+
+        # Thời gian khởi động từng giai đoạn
+        startup = get_startup_timings()
+        st.markdown("**🚀 Khởi động:**")
+        if not startup['done']:
+            st.caption("⏳ Đang tải model và index nền...")
+        for stage, seconds in startup['timings'].items():
+            error = startup['errors'].get(stage)
+            st.caption(f"{stage}: {seconds}s" + (f" - ⚠️ {error}" if error else ""))
+
+        # Rerank bằng cross-encoder (bật trong config.env)
+        rerank_stats = get_rerank_stats()
+        if rerank_stats['enabled']:
+            st.markdown("**🎯 Rerank:**")
+            if rerank_stats['load_error']:
+                st.caption(f"⚠️ Không load được {rerank_stats['model']}: {rerank_stats['load_error']}")
+            elif not rerank_stats['loaded']:
+                st.caption(f"⏳ Đang load {rerank_stats['model']}...")
+            st.caption(f"Rerank {rerank_stats['reranked']}/{rerank_stats['calls']} lần"
+                       f" - quá {rerank_stats['budget_ms']:.0f}ms: {rerank_stats['fallback_budget']}"
+                       f", bỏ qua khi bận: {rerank_stats['fallback_busy']}"
+                       f", gần nhất {rerank_stats['last_latency_ms']}ms")
+
+        # Các QA chain đang được dùng chung giữa các phiên
+        for info in get_chain_pool_info():
+            st.caption(f"🔗 {info['provider']}: {info['model']} (index {info['index_version']})")
+
+        # Cache câu trả lời
+        answer_cache_stats = get_answer_cache().stats()
+        st.markdown("**⚡ Cache câu trả lời:**")
+        st.caption(f"{answer_cache_stats['size']}/{answer_cache_stats['max_entries']} mục"
+                   f" - hit {answer_cache_stats['hits']}, miss {answer_cache_stats['misses']}")
+        if st.button("🧹 Xóa cache", key="clear_answer_cache"):
+            get_answer_cache().clear()
+            st.rerun()
+
     with tab2:
         st.subheader("📂 Quản lý Tài liệu")
         
@@ -94,6 +305,7 @@ with st.sidebar:
                 if st.button("🔄 Ghi đè file", key="overwrite"):
                     with open(file_path, "wb") as f:
                         f.write(uploaded_file.getvalue())
+                    enqueue(JOB_INGEST, {'paths': [file_path]})
                     st.success(f"✅ Đã cập nhật '{uploaded_file.name}'")
                     st.rerun()
             else:
@@ -101,76 +313,132 @@ with st.sidebar:
                     f.write(uploaded_file.getvalue())
                 st.success(f"✅ Đã upload '{uploaded_file.name}'")
                 
-                # Tự động xử lý file mới
-                with st.spinner("🔄 Đang xử lý file mới..."):
-                    try:
-                        vector_store = process_single_document(file_path)
-                        if vector_store:
-                            st.success("✅ Đã tạo vector store cho file mới!")
-                            st.rerun()
-                        else:
-                            st.error("❌ Không thể xử lý file!")
-                    except Exception as e:
-                        st.error(f"❌ Lỗi xử lý file: {e}")
+                # Tự động xử lý file mới trong worker nền
+                enqueue(JOB_INGEST, {'paths': [file_path]})
+                st.info("⏳ Đã thêm vào hàng đợi xử lý")
 
         st.markdown("---")
+
+        # Trạng thái các job xử lý/xóa/rebuild
+        render_jobs()
         
         # Hiển thị danh sách file hiện có
         st.subheader("📋 Tài liệu có sẵn")
         
         documents = get_available_documents()
+
+        # Vector store định dạng pickle cũ cần được migrate
+        legacy_docs = [d for d in documents if d['legacy_format']]
+        if legacy_docs:
+            st.warning(f"⚠️ {len(legacy_docs)} vector store dùng định dạng cũ (pickle)")
+            if st.button("📦 Migrate sang định dạng mới", key="migrate_stores"):
+                with st.spinner("📦 Đang migrate..."):
+                    for name, status in migrate_legacy_stores():
+                        st.caption(f"{name}: {status}")
+                st.rerun()
+
         if documents:
             for doc in documents:
                 with st.expander(f"📄 {doc['filename']} ({doc['size_mb']} MB)"):
                     st.write(f"**Hash:** {doc['hash']}")
-                    st.write(f"**Vector Store:** {'✅ Sẵn sàng' if doc['has_vector_store'] else '❌ Chưa xử lý'}")
+                    if doc['legacy_format']:
+                        st.write("**Vector Store:** 📦 Cần migrate")
+                    elif doc['stale_embedding']:
+                        st.write("**Vector Store:** ⚠️ Tạo bằng model embedding khác, cần xử lý lại")
+                    else:
+                        st.write(f"**Vector Store:** {'✅ Sẵn sàng' if doc['has_vector_store'] else '❌ Chưa xử lý'}")
                     
                     col1, col2 = st.columns(2)
                     with col1:
-                        if not doc['has_vector_store']:
+                        if not doc['has_vector_store'] and not doc['legacy_format']:
                             if st.button(f"🔄 Xử lý", key=f"process_{doc['hash']}"):
-                                with st.spinner("🔄 Đang xử lý..."):
-                                    try:
-                                        vector_store = process_single_document(doc['path'])
-                                        if vector_store:
-                                            st.success("✅ Đã xử lý!")
-                                            st.rerun()
-                                        else:
-                                            st.error("❌ Lỗi xử lý!")
-                                    except Exception as e:
-                                        st.error(f"❌ Lỗi: {e}")
+                                enqueue(JOB_INGEST, {'paths': [doc['path']]})
+                                st.rerun()
                     
                     with col2:
                         if st.button(f"🗑️ Xóa", key=f"delete_{doc['hash']}"):
-                            try:
-                                # Xóa file PDF
-                                if os.path.exists(doc['path']):
-                                    os.remove(doc['path'])
-                                
-                                # Xóa vector store
-                                if os.path.exists(doc['vector_store_path']):
-                                    shutil.rmtree(doc['vector_store_path'])
-                                
-                                st.success(f"✅ Đã xóa '{doc['filename']}'")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"❌ Lỗi xóa file: {e}")
+                            # Xóa file PDF, vector store và vectors trong combined store (nền)
+                            enqueue(JOB_DELETE, {'path': doc['path']})
+                            st.rerun()
             
-            # Button để rebuild toàn bộ hệ thống
             st.markdown("---")
+            ingest_workers = st.number_input(
+                "⚙️ Số worker xử lý song song:",
+                min_value=1,
+                max_value=max(os.cpu_count() or 1, INGEST_WORKERS),
+                value=INGEST_WORKERS,
+                help="Số process đọc và chia chunk PDF cùng lúc"
+            )
+
+            # Xử lý song song tất cả tài liệu chưa có vector store
+            pending_count = len([d for d in documents
+                                 if not d['has_vector_store'] and not d['legacy_format']])
+            if pending_count and st.button(f"⚡ Xử lý tất cả ({pending_count} file)", key="process_all"):
+                enqueue(JOB_INGEST, {
+                    'paths': [d['path'] for d in documents
+                              if not d['has_vector_store'] and not d['legacy_format']],
+                    'workers': int(ingest_workers)})
+                st.rerun()
+
+            # Thông tin index của combined store
+            index_info = get_combined_index_info()
+            if SEARCH_MODE == SEARCH_SHARDED:
+                st.caption(f"🧩 Sharded: mỗi tài liệu là một shard, tìm song song "
+                           f"({SHARD_SEARCH_WORKERS} thread) rồi gộp top-k")
+            elif index_info:
+                search_param = ""
+                if 'nprobe' in index_info:
+                    search_param = f", nprobe={index_info['nprobe']}"
+                elif 'ef_search' in index_info:
+                    search_param = f", efSearch={index_info['ef_search']}"
+                st.caption(f"🗂️ Index: {index_info.get('index_type')} ({index_info.get('ntotal', 0)} vectors{search_param}), "
+                           f"vectors {index_info.get('vector_dtype', 'float32')}")
+                report = index_info.get('recall_report')
+                if report:
+                    st.caption(
+                        f"🎯 Recall@{report['k']}: {report['recall_at_k']:.2%} | "
+                        f"{report['latency_ms']} ms/truy vấn (exact: {report['exact_latency_ms']} ms)")
+                quantization = index_info.get('quantization_report')
+                if quantization:
+                    with st.expander("📉 So sánh float32 / float16 / int8"):
+                        for dtype, entry in quantization.items():
+                            rescored = entry.get('rescored_recall_at_k')
+                            st.caption(
+                                f"{dtype}: {entry['memory_mb']} MB, recall {entry['recall_at_k']:.2%}"
+                                + (f" → {rescored:.2%} khi chấm lại" if rescored is not None else ""))
+
+            # Chunk trùng giữa các tài liệu chỉ lưu một lần
+            dedup_report = get_dedup_report()
+            if dedup_report.get('saved_chunks'):
+                st.caption(
+                    f"♻️ Dedup: {dedup_report['saved_chunks']} chunk trùng không lưu lại "
+                    f"(~{dedup_report['saved_mb']} MB), "
+                    f"{dedup_report['shared_chunks']} chunk dùng chung giữa các file")
+                for filename, stats in dedup_report['documents'].items():
+                    st.caption(f"📄 {filename}: {stats.get('exact', 0)} trùng"
+                               f", {stats.get('near', 0)} gần trùng")
+
+            index_type = st.selectbox(
+                "🗂️ Loại index khi rebuild:",
+                INDEX_TYPES,
+                index=0,
+                help="auto: chọn theo số lượng vector (flat → IVF → IVF-PQ)"
+            )
+            vector_dtype = st.selectbox(
+                "🧮 Định dạng vector khi rebuild:",
+                VECTOR_DTYPES,
+                index=VECTOR_DTYPES.index(COMBINED_VECTOR_DTYPE) if COMBINED_VECTOR_DTYPE in VECTOR_DTYPES else 0,
+                help="float16/int8: giảm 2-4 lần bộ nhớ, top ứng viên được chấm lại bằng float32"
+            )
+
+            # Button để rebuild toàn bộ hệ thống
             if st.button("🔄 Rebuild toàn bộ Vector Store", key="rebuild_all"):
-                with st.spinner("🔄 Đang rebuild toàn bộ hệ thống..."):
-                    try:
-                        combined_store = process_all_documents()
-                        if combined_store:
-                            st.success("✅ Đã rebuild toàn bộ hệ thống!")
-                            # Reset qa_chain để dùng vector store mới
-                            if 'current_model' in st.session_state:
-                                del st.session_state.current_model
-                        else:
-                            st.error("❌ Không thể rebuild hệ thống!")
-                    except Exception as e:
-                        st.error(f"❌ Lỗi rebuild: {e}")
+                # Truy vấn vẫn dùng index cũ tới khi bản mới build xong
+                enqueue(JOB_REINDEX, {
+                    'index_type': index_type,
+                    'vector_dtype': vector_dtype,
+                    'workers': int(ingest_workers)})
+                st.rerun()
         else:
             st.info("📭 Chưa có tài liệu nào. Hãy upload file PDF!")
         
@@ -178,11 +446,13 @@ with st.sidebar:
         processed_count = len([d for d in documents if d['has_vector_store']])
         st.markdown(f"**📊 Tổng quan:** {len(documents)} file, {processed_count} đã xử lý")
 
+    with tab3:
+        render_diagnostics()
+
 # Main interface
 st.subheader("🤖 Tra cứu Thông tin")
 
-# Hiển thị thông tin về tài liệu đang sử dụng
-documents = get_available_documents()
+# Hiển thị thông tin về tài liệu đang sử dụng (dùng lại danh sách đã lấy ở sidebar)
 processed_docs = [d for d in documents if d['has_vector_store']]
 
 if processed_docs:
@@ -191,6 +461,12 @@ if processed_docs:
         st.info(f"📖 Đang sử dụng: **{doc_names[0]}**")
     else:
         st.info(f"📚 Đang sử dụng: **{len(doc_names)} tài liệu** ({', '.join(doc_names[:3])}{'...' if len(doc_names) > 3 else ''})")
+    # Chỉ tìm trong một số tài liệu: truy vấn đi thẳng tới shard của các file này
+    selected_files = st.multiselect(
+        "📂 Chỉ tìm trong:",
+        doc_names,
+        help="Để trống để tìm trong tất cả tài liệu"
+    ) if len(doc_names) > 1 else []
 else:
     st.warning("⚠️ Chưa có tài liệu nào được xử lý. Hãy upload và xử lý file PDF trong sidebar!")
     st.stop()
@@ -209,48 +485,44 @@ with col2:
 
 if query and (search_button or st.session_state.get('auto_search', True)):
     try:
-        # Tạo lại qa_chain nếu người dùng thay đổi model
-        if 'current_model' not in st.session_state or st.session_state.current_model != model_choice:
-            with st.spinner("Đang khởi tạo model..."):
-                qa_chain = create_qa_chain(model_choice)
-                st.session_state.current_model = model_choice
+        # QA chain lấy từ pool dùng chung, tự tạo lại khi index thay đổi
+        spinner_text = "Đang khởi tạo model..." if is_warm() else "⏳ Đang chờ tải model và index..."
+        with st.spinner(spinner_text):
+            qa_chain = get_qa_chain(model_choice)
+
+        # Thực hiện truy vấn: nguồn hiện ngay khi retrieval xong, câu trả lời hiện dần
+        st.markdown("### 💡 **Câu trả lời:**")
+        answer_placeholder = st.empty()
+        timing_placeholder = st.empty()
+        sources_container = st.container()
 
-        # Thực hiện truy vấn
+        response = ""
         with st.spinner("Đang tìm kiếm thông tin..."):
-            if hasattr(qa_chain, 'invoke'):
-                result = qa_chain.invoke({"query": query})
-                response = result.get(
-                    'result', 'Không tìm thấy thông tin phù hợp.')
-                source_docs = result.get('source_documents', [])
-            else:
-                # Fallback cho phiên bản cũ
-                response = qa_chain.run(query)
-                source_docs = []
+            events = stream_answer(qa_chain, query, model_choice,
+                                   source_files=selected_files or None)
+            for event, payload in events:
+                if event == EVENT_SOURCES:
+                    with sources_container:
+                        render_sources(payload)
+                    break
 
-        # Hiển thị kết quả
-        st.markdown("### 💡 **Câu trả lời:**")
-        st.success(response)
-
-        # Hiển thị nguồn tham khảo nếu có
-        if source_docs:
-            with st.expander("📚 Nguồn tham khảo"):
-                # Nhóm theo file nguồn
-                sources_by_file = {}
-                for doc in source_docs[:10]:
-                    source_file = doc.metadata.get('source_file', 'Unknown')
-                    if source_file not in sources_by_file:
-                        sources_by_file[source_file] = []
-                    sources_by_file[source_file].append(doc)
-                
-                # Hiển thị theo từng file
-                for file_name, docs in sources_by_file.items():
-                    st.markdown(f"**📄 {file_name}** ({len(docs)} đoạn)")
-                    for i, doc in enumerate(docs[:3]):  # Hiển thị tối đa 3 đoạn mỗi file
-                        page_num = doc.metadata.get('page', 'N/A')
-                        st.markdown(f"*Trang {page_num}:*")
-                        st.text(doc.page_content[:300] + "..." if len(doc.page_content) > 300 else doc.page_content)
-                        if i < len(docs[:3]) - 1:
-                            st.markdown("---")
+        for event, payload in events:
+            if event == EVENT_TOKEN:
+                response += payload
+                answer_placeholder.success(response + " ▌")
+            elif event == EVENT_DONE:
+                answer_placeholder.success(response)
+                timing = (f"⏱️ Tìm kiếm {payload['retrieval_s']:.2f}s"
+                          f" · Token đầu tiên {payload['first_token_s']:.2f}s"
+                          f" · Tổng {payload['total_s']:.2f}s")
+                if payload['cached']:
+                    timing += f" · ⚡ Trả lời từ cache ({payload['cached']})"
+                context = payload['context']
+                if context:
+                    timing += (f" · 🧾 {context['prompt_tokens']} prompt tokens"
+                               f" ({context['context_chunks']}/{context['retrieved_chunks']} đoạn,"
+                               f" gộp {context['merged_chunks']}, trùng {context['duplicates_dropped']})")
+                timing_placeholder.caption(timing)
 
     except Exception as e:
         st.error(f"❌ Có lỗi xảy ra: {str(e)}")
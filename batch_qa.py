@@ -0,0 +1,246 @@
+"""Trả lời hàng loạt câu hỏi từ file JSONL/CSV (đánh giá offline)
+
+Cách dùng:
+    python batch_qa.py questions.jsonl answers.jsonl --model gemini
+    python batch_qa.py questions.csv answers.jsonl --concurrency 8 --rate 2
+    python batch_qa.py questions.jsonl answers.jsonl --model fake --no-cache
+
+File vào: JSONL (mỗi dòng {"id": ..., "question": ...}) hoặc CSV có cột
+"question" (cột "id" tùy chọn, mặc định là số thứ tự dòng). File ra là JSONL,
+ghi từng dòng ngay khi có kết quả; chạy lại cùng lệnh sẽ bỏ qua các câu đã
+trả lời thành công (câu bị lỗi được chạy lại).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Set
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embeddings import get_embeddings
+from llm_rag import (
+    answer_from_documents,
+    get_answer_cache,
+    get_llm_backends,
+    get_qa_chain,
+)
+from pre_doc import get_index_version
+
+BATCH_SIZE = 64          # Số câu hỏi embed + tìm kiếm mỗi lần
+LLM_CONCURRENCY = 4      # Số lời gọi LLM cùng lúc
+LLM_RATE_PER_S = 1.0     # Số lời gọi LLM tối đa mỗi giây (quota API)
+
+# Các giai đoạn được đo cho từng câu hỏi
+STAGE_EMBED = "embed_s"
+STAGE_SEARCH = "search_s"
+STAGE_LLM = "llm_s"
+
+
+class RateLimiter:
+    """Giới hạn số lời gọi mỗi giây (chia đều, dùng chung giữa các thread)"""
+
+    def __init__(self, rate_per_s: float):
+        self.interval = 1.0 / rate_per_s if rate_per_s > 0 else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def read_questions(path: str) -> List[dict]:
+    """Đọc câu hỏi từ JSONL hoặc CSV, trả về [{'id', 'question'}]
+
+    Dòng không có id dùng số thứ tự dòng; id trùng nhau báo ValueError vì
+    chạy tiếp sẽ bỏ sót câu hỏi.
+    """
+    questions = []
+    seen = {}
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, start=1):
+            question = str(row.get('question') or '').strip()
+            if not question:
+                continue
+            row_id = row.get('id')
+            question_id = str(number) if row_id is None or row_id == '' else str(row_id)
+            if question_id in seen:
+                raise ValueError(f"ID '{question_id}' bị trùng ở dòng {seen[question_id]} "
+                                 f"và dòng {number} của {path}")
+            seen[question_id] = number
+            questions.append({'id': question_id, 'question': question})
+    return questions
+
+
+def read_completed(path: str) -> Set[str]:
+    """ID các câu đã trả lời thành công trong file kết quả (để chạy tiếp)"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Dòng ghi dở khi bị dừng giữa chừng
+            if not record.get('error'):
+                completed.add(str(record['id']))
+    return completed
+
+
+def _sources(docs) -> List[dict]:
+    return [{'source_file': doc.metadata.get('source_file'),
+             'page': doc.metadata.get('page'),
+             'chunk_id': doc.metadata.get('chunk_id')} for doc in docs]
+
+
+def run_batch(questions: List[dict], output_path: str, model_type: str,
+              batch_size: int = BATCH_SIZE, concurrency: int = LLM_CONCURRENCY,
+              rate_per_s: float = LLM_RATE_PER_S, use_cache: bool = True) -> dict:
+    """Embed và tìm kiếm theo batch, gọi LLM song song (có giới hạn tốc độ), ghi JSONL
+
+    Trả về thống kê: số câu đã trả lời, lỗi, cache hit và tổng thời gian từng giai đoạn.
+    """
+    # Chưa có tài liệu nào đã xử lý thì get_qa_chain raise ValueError
+    qa_chain = get_qa_chain(model_type)
+    embeddings = get_embeddings()
+    cache = get_answer_cache()
+    limiter = RateLimiter(rate_per_s)
+    stats = {'answered': 0, 'failed': 0, 'cached': 0,
+             'timings': {STAGE_EMBED: 0.0, STAGE_SEARCH: 0.0, STAGE_LLM: 0.0}}
+
+    def generate(item: dict, docs, vector) -> dict:
+        limiter.acquire()
+        result = answer_from_documents(qa_chain, item['question'], model_type, docs,
+                                       query_embedding=vector, use_cache=use_cache)
+        return {'answer': result['result'], 'sources': _sources(result['source_documents']),
+                'context': result['context'], STAGE_LLM: result['timings']['llm_s']}
+
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Lần chạy trước bị dừng giữa dòng: bắt đầu dòng mới để không dính vào dòng hỏng
+        if out.tell() > 0:
+            with open(output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+
+        def write(record: dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            stats['failed' if record.get('error') else 'answered'] += 1
+
+        for offset in range(0, len(questions), batch_size):
+            batch = questions[offset:offset + batch_size]
+            texts = [item['question'] for item in batch]
+
+            # Embed cả batch một lần (câu hỏi đã gặp lấy từ cache)
+            start = time.perf_counter()
+            vectors = embeddings.embed_queries(texts)
+            embed_s = (time.perf_counter() - start) / len(batch)
+
+            # Câu đã có trong cache không cần tìm kiếm/gọi LLM
+            index_version = get_index_version()
+            pending, pending_vectors = [], []
+            for item, vector in zip(batch, vectors):
+                cached = (cache.lookup(item['question'], model_type, index_version, vector)
+                          if use_cache else None)
+                if cached is None:
+                    pending.append(item)
+                    pending_vectors.append(vector)
+                    continue
+                stats['cached'] += 1
+                write({**item, 'answer': cached['answer'], 'model': model_type,
+                       'sources': _sources(cached['source_documents']), 'cached': cached['match'],
+                       'timings': {STAGE_EMBED: round(embed_s, 4)}})
+            if not pending:
+                stats['timings'][STAGE_EMBED] += embed_s * len(batch)
+                continue
+
+            # Một lần search FAISS cho cả batch
+            start = time.perf_counter()
+            results = qa_chain.retriever.retrieve_batch(
+                [item['question'] for item in pending], pending_vectors)
+            search_s = (time.perf_counter() - start) / len(pending)
+
+            futures = {executor.submit(generate, item, docs, vector): item
+                       for item, docs, vector in zip(pending, results, pending_vectors)}
+            for future in as_completed(futures):
+                item = futures[future]
+                timings = {STAGE_EMBED: round(embed_s, 4), STAGE_SEARCH: round(search_s, 4)}
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    write({**item, 'model': model_type, 'error': str(e) or type(e).__name__,
+                           'timings': timings})
+                    continue
+                timings[STAGE_LLM] = round(answer.pop(STAGE_LLM), 4)
+                stats['timings'][STAGE_LLM] += timings[STAGE_LLM]
+                write({**item, **answer, 'model': model_type, 'cached': None, 'timings': timings})
+
+            stats['timings'][STAGE_EMBED] += embed_s * len(batch)
+            stats['timings'][STAGE_SEARCH] += search_s * len(pending)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trả lời hàng loạt câu hỏi từ file JSONL/CSV")
+    parser.add_argument("input", help="File câu hỏi (.jsonl hoặc .csv, cột 'question', 'id' tùy chọn)")
+    parser.add_argument("output", help="File kết quả JSONL (ghi tiếp nếu đã có)")
+    parser.add_argument("--model", default="gemini",
+                        help=f"Backend LLM ({', '.join(get_llm_backends())})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Số câu hỏi embed + tìm kiếm mỗi lần")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY,
+                        help="Số lời gọi LLM cùng lúc")
+    parser.add_argument("--rate", type=float, default=LLM_RATE_PER_S,
+                        help="Số lời gọi LLM tối đa mỗi giây (0 = không giới hạn)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Không dùng/ghi cache câu trả lời")
+    args = parser.parse_args()
+
+    try:
+        questions = read_questions(args.input)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    completed = read_completed(args.output)
+    remaining = [item for item in questions if item['id'] not in completed]
+    print(f"📋 {len(questions)} câu hỏi, {len(questions) - len(remaining)} đã có kết quả, "
+          f"còn {len(remaining)}")
+    if not remaining:
+        return 0
+
+    start = time.perf_counter()
+    try:
+        stats = run_batch(remaining, args.output, args.model, args.batch_size,
+                          args.concurrency, args.rate, use_cache=not args.no_cache)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    elapsed = time.perf_counter() - start
+
+    timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stats['timings'].items())
+    print(f"{'❌' if stats['failed'] else '✅'} {stats['answered']} trả lời "
+          f"({stats['cached']} từ cache), {stats['failed']} lỗi trong {elapsed:.1f}s "
+          f"({stats['answered'] / elapsed:.2f} câu/s)")
+    print(f"⏱️ {timings}")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
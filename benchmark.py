@@ -0,0 +1,374 @@
+"""Benchmark ingest + retrieval trên corpus PDF tổng hợp (chạy offline, tái lập được)
+
+Cách dùng:
+    python benchmark.py                                   # model embedding thật, 20/100/400 trang
+    python benchmark.py --embeddings fake --sizes 50,500  # không cần model, chỉ đo pipeline
+    python benchmark.py --fixtures documents/             # thêm các PDF có sẵn vào corpus
+    python benchmark.py --embedding-backend onnx          # so sánh ONNX int8 với sentence-transformers
+    python benchmark.py --output bench.json --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json    # exit 1 nếu chậm/kém hơn baseline
+
+Đo cho từng kích thước corpus: pages/s khi parse + chia chunk, chunks/s khi
+embed, thời gian build index (FAISS + BM25), lưu và load store, latency
+p50/p99 của truy vấn (retrieval + gộp context + LLM giả lập không độ trễ)
+và recall@k của index so với exact search trên chính các câu hỏi đó.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import faiss
+import numpy as np
+try:
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+except ImportError:
+    # Fallback cho phiên bản cũ
+    from langchain.vectorstores import FAISS
+    from langchain.docstore.in_memory import InMemoryDocstore
+
+from chunking import CHUNK_OVERLAP, CHUNK_SIZE, load_and_split
+from embeddings import EMBEDDING_BACKEND, get_embedding_backends, get_embedding_tag, get_embeddings
+from faiss_index import (
+    INDEX_AUTO,
+    INDEX_FLAT,
+    INDEX_TYPES,
+    RECALL_K,
+    VECTOR_DTYPES,
+    VECTOR_FLOAT32,
+    RescoringIndex,
+    build_index,
+)
+from hybrid_retriever import HYBRID_FETCH_K, RETRIEVAL_K, HybridRetriever
+from ingest import EMBED_BATCH_SIZE
+from llm_rag import answer_from_documents
+from storage import build_sparse_index, load_sparse_index, load_store, save_store
+
+SEED = 42
+DEFAULT_SIZES = [20, 100, 400]      # Tổng số trang của corpus tổng hợp
+DOCUMENT_PAGES = [1, 5, 20, 50]     # Kích thước các file PDF tổng hợp (lặp vòng)
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+N_QUERIES = 200
+FAKE_EMBEDDING_SIZE = 384           # Bằng số chiều của MiniLM
+
+# Ngưỡng gate: chậm hơn/kém hơn baseline quá tỷ lệ này thì coi là regression
+DEFAULT_TOLERANCE = 0.2
+RECALL_TOLERANCE = 0.02             # Recall được so theo hiệu tuyệt đối
+# Metric -> (True nếu càng cao càng tốt, chênh lệch tuyệt đối tối thiểu để tính)
+GATED_METRICS = {
+    'pages_per_s': (True, 0.0),
+    'chunks_per_s': (True, 0.0),
+    'build_s': (False, 0.05),
+    'load_s': (False, 0.05),
+    'query_p50_ms': (False, 1.0),
+    'query_p99_ms': (False, 2.0),
+    'recall_at_k': (True, RECALL_TOLERANCE),
+}
+# Throughput chỉ được so khi giai đoạn tương ứng chạy đủ lâu để đo ổn định
+THROUGHPUT_STAGES = {'pages_per_s': 'parse_s', 'chunks_per_s': 'embed_s'}
+MIN_STAGE_SECONDS = 0.2
+
+# Từ vựng tiếng Việt không dấu (font chuẩn của PDF không có glyph có dấu)
+VOCABULARY = (
+    "he thong quan tri co so du lieu bang khoa chinh khoa ngoai truy van chi muc "
+    "giao dich khoi phuc sao luu nguoi dung quyen han bao mat mang may chu ung dung "
+    "du an bao cao thiet ke kien truc phan mem kiem thu trien khai van hanh hieu nang "
+    "bo nho luu tru tep tin thu muc tai lieu chuong muc dieu khoan quy dinh huong dan "
+    "sinh vien giang vien mon hoc hoc ky diem so ket qua danh gia tieu chi yeu cau"
+).split()
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, pages: int, seed: int):
+    """Ghi PDF nhiều trang với text ngẫu nhiên (theo seed) - không cần thư viện tạo PDF"""
+    rng = random.Random(seed)
+    streams = []
+    for page in range(pages):
+        lines = []
+        for line in range(LINES_PER_PAGE):
+            words = [rng.choice(VOCABULARY) for _ in range(WORDS_PER_LINE)]
+            # Thỉnh thoảng xuống đoạn để splitter có ranh giới tự nhiên
+            end = "." if line % 8 == 7 else ""
+            lines.append(f"({_pdf_escape(' '.join(words) + end)}) '")
+        streams.append("BT /F1 9 Tf 36 800 Td 11 TL " + " ".join(lines) + " ET")
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(pages)), pages),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, stream in enumerate(streams):
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode('latin-1')
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    body += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+             f"startxref\n{xref}\n%%EOF\n").encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def make_corpus(directory: str, total_pages: int, seed: int = SEED) -> List[str]:
+    """Tạo các PDF có số trang khác nhau cho tới khi đủ total_pages"""
+    os.makedirs(directory, exist_ok=True)
+    paths, pages_left, i = [], total_pages, 0
+    while pages_left > 0:
+        pages = min(DOCUMENT_PAGES[i % len(DOCUMENT_PAGES)], pages_left)
+        path = os.path.join(directory, f"synthetic_{i:03d}_{pages}p.pdf")
+        write_synthetic_pdf(path, pages, seed + i)
+        paths.append(path)
+        pages_left -= pages
+        i += 1
+    return paths
+
+
+def make_queries(chunks, n_queries: int, seed: int = SEED) -> List[str]:
+    """Câu hỏi lấy từ một đoạn ngẫu nhiên của chunk (giống người hỏi về nội dung có trong tài liệu)"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        words = rng.choice(chunks).page_content.split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3) if samples else 0.0
+
+
+def _stub_chain(retriever):
+    """QA chain với LLM giả lập trả lời ngay (chỉ đo phần của hệ thống)"""
+    from langchain.chains import RetrievalQA
+    from langchain_community.llms.fake import FakeListLLM
+    return RetrievalQA.from_chain_type(
+        llm=FakeListLLM(responses=["Câu trả lời giả lập."]),
+        chain_type="stuff", retriever=retriever, return_source_documents=True)
+
+
+def run_size(pdf_paths: List[str], embeddings, work_dir: str, index_type: str,
+             vector_dtype: str, n_queries: int, k: int = RECALL_K) -> Dict[str, object]:
+    """Chạy toàn bộ pipeline trên một corpus và trả về các metric"""
+    result: Dict[str, object] = {'documents': len(pdf_paths)}
+
+    # Parse + chia chunk
+    start = time.perf_counter()
+    chunks = []
+    for path in pdf_paths:
+        chunks.extend(load_and_split(path))
+    parse_s = time.perf_counter() - start
+    pages = len({(doc.metadata.get('source_file'), doc.metadata.get('page')) for doc in chunks})
+    result.update(pages=pages, chunks=len(chunks), parse_s=round(parse_s, 4),
+                  pages_per_s=round(pages / parse_s, 2))
+
+    # Embed theo batch như pipeline ingest
+    texts = [doc.page_content for doc in chunks]
+    start = time.perf_counter()
+    vectors = []
+    for offset in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(embeddings.embed_documents(texts[offset:offset + EMBED_BATCH_SIZE]))
+    embed_s = time.perf_counter() - start
+    vectors = np.asarray(vectors, dtype=np.float32)
+    result.update(embed_s=round(embed_s, 4), chunks_per_s=round(len(chunks) / embed_s, 2))
+
+    # Build index FAISS + BM25
+    ids = [str(i) for i in range(len(chunks))]
+    start = time.perf_counter()
+    index, params = build_index(vectors, index_type, vector_dtype=vector_dtype)
+    if params['vector_dtype'] != VECTOR_FLOAT32 and params['index_type'] != INDEX_FLAT:
+        index = RescoringIndex(index, vectors)
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    sparse_index = build_sparse_index(ids, chunks)
+    bm25_build_s = time.perf_counter() - start
+    result.update(index_type=params['index_type'], vector_dtype=params['vector_dtype'],
+                  build_s=round(build_s, 4), bm25_build_s=round(bm25_build_s, 4))
+
+    # Lưu rồi load lại (memory-mapped như lúc app chạy)
+    store = FAISS(embeddings, index, InMemoryDocstore(dict(zip(ids, chunks))),
+                  dict(enumerate(ids)))
+    store_path = os.path.join(work_dir, "store")
+    start = time.perf_counter()
+    save_store(store, store_path, sparse_index, params['vector_dtype'])
+    save_s = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded = load_store(store_path, embeddings, mmap=True)
+    loaded_sparse = load_sparse_index(store_path)
+    load_s = time.perf_counter() - start
+    result.update(save_s=round(save_s, 4), load_s=round(load_s, 4))
+
+    # Truy vấn: retrieval (embed câu hỏi + FAISS + BM25) rồi context + LLM giả lập
+    retriever = HybridRetriever(index_getter=lambda: (loaded, loaded_sparse))
+    chain = _stub_chain(retriever)
+    queries = make_queries(chunks, n_queries)
+    retrieval_samples, query_samples = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.get_relevant_documents(query)
+        retrieved = time.perf_counter()
+        answer_from_documents(chain, query, "fake", docs, use_cache=False)
+        retrieval_samples.append(retrieved - start)
+        query_samples.append(time.perf_counter() - start)
+    result.update(
+        retrieval_p50_ms=_percentile_ms(retrieval_samples, 50),
+        retrieval_p99_ms=_percentile_ms(retrieval_samples, 99),
+        query_p50_ms=_percentile_ms(query_samples, 50),
+        query_p99_ms=_percentile_ms(query_samples, 99))
+
+    # recall@k của index đã load so với exact search, trên chính các câu hỏi
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(query_vectors, k)
+    _, found = loaded.index.search(query_vectors, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    result.update(recall_at_k=round(hits / (len(queries) * k), 4), k=k)
+    return result
+
+
+def compare_to_baseline(results: dict, baseline: dict,
+                        tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Danh sách regression so với baseline (rỗng nếu đạt)"""
+    regressions = []
+    if baseline.get('config') != results['config']:
+        print("⚠️ Cấu hình khác baseline - kết quả so sánh chỉ mang tính tham khảo")
+    for size, metrics in results['runs'].items():
+        base = baseline.get('runs', {}).get(size)
+        if base is None:
+            continue
+        for metric, (higher_is_better, min_delta) in GATED_METRICS.items():
+            if metric not in metrics or metric not in base:
+                continue
+            stage = THROUGHPUT_STAGES.get(metric)
+            if stage and max(metrics.get(stage, 0), base.get(stage, 0)) < MIN_STAGE_SECONDS:
+                continue
+            current, previous = metrics[metric], base[metric]
+            delta = (previous - current) if higher_is_better else (current - previous)
+            if metric == 'recall_at_k':
+                worse = delta > min_delta
+            else:
+                worse = delta > min_delta and delta > tolerance * abs(previous)
+            if worse:
+                regressions.append(f"{size}: {metric} {previous} → {current}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest + retrieval trên corpus PDF tổng hợp")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Các kích thước corpus (tổng số trang), cách nhau bởi dấu phẩy")
+    parser.add_argument("--fixtures", help="Thư mục PDF có sẵn, chạy thêm một lượt trên các file này")
+    parser.add_argument("--embeddings", choices=["model", "fake"], default="model",
+                        help="model: embedding thật; fake: vector giả lập (không cần tải model)")
+    parser.add_argument("--embedding-backend", choices=get_embedding_backends(), default=EMBEDDING_BACKEND,
+                        help="Backend chạy model embedding (khi --embeddings model)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_AUTO)
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=VECTOR_FLOAT32)
+    parser.add_argument("--queries", type=int, default=N_QUERIES, help="Số câu hỏi mỗi corpus")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="So sánh với kết quả đã lưu, exit 1 nếu có regression")
+    parser.add_argument("--save-baseline", help="Lưu kết quả làm baseline mới")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Tỷ lệ chậm/kém hơn baseline được chấp nhận (mặc định 0.2)")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục làm việc (PDF, store)")
+    args = parser.parse_args()
+    if args.fixtures and not os.path.isdir(args.fixtures):
+        parser.error(f"Không tìm thấy thư mục fixtures: {args.fixtures}")
+
+    if args.embeddings == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        embeddings = DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE)
+    else:
+        embeddings = get_embeddings(backend=args.embedding_backend)
+
+    results = {
+        'config': {
+            'embeddings': args.embeddings, 'index_type': args.index_type,
+            'embedding_model': (get_embedding_tag(backend=args.embedding_backend)
+                                if args.embeddings == "model" else None),
+            'vector_dtype': args.vector_dtype, 'queries': args.queries, 'seed': SEED,
+            'chunk_size': CHUNK_SIZE, 'chunk_overlap': CHUNK_OVERLAP,
+            'retrieval_k': RETRIEVAL_K, 'hybrid_fetch_k': HYBRID_FETCH_K,
+        },
+        'environment': {
+            'python': platform.python_version(), 'faiss': faiss.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+        },
+        'runs': {},
+    }
+
+    work_root = tempfile.mkdtemp(prefix="rag_bench_")
+    try:
+        corpora = [(f"{pages}p", make_corpus(os.path.join(work_root, f"pdf_{pages}"), pages))
+                   for pages in (int(size) for size in args.sizes.split(",") if size.strip())]
+        if args.fixtures:
+            fixtures = sorted(os.path.join(args.fixtures, name)
+                              for name in os.listdir(args.fixtures) if name.lower().endswith('.pdf'))
+            if fixtures:
+                corpora.append(("fixtures", fixtures))
+
+        # Chạy thử một lần để import/khởi tạo lười không tính vào corpus đầu tiên
+        if corpora and corpora[0][1]:
+            embeddings.embed_documents([chunk.page_content
+                                        for chunk in load_and_split(corpora[0][1][0])])
+
+        for name, paths in corpora:
+            run_dir = os.path.join(work_root, f"run_{name}")
+            os.makedirs(run_dir, exist_ok=True)
+            metrics = run_size(paths, embeddings, run_dir, args.index_type,
+                               args.vector_dtype, args.queries)
+            results['runs'][name] = metrics
+            print(f"📊 {name}: {metrics['pages']} trang, {metrics['chunks']} chunk | "
+                  f"parse {metrics['pages_per_s']} trang/s | embed {metrics['chunks_per_s']} chunk/s | "
+                  f"build {metrics['build_s']}s ({metrics['index_type']}) | load {metrics['load_s']}s | "
+                  f"query p50 {metrics['query_p50_ms']}ms p99 {metrics['query_p99_ms']}ms | "
+                  f"recall@{metrics['k']} {metrics['recall_at_k']:.2%}")
+    finally:
+        if args.keep:
+            print(f"📁 Thư mục làm việc: {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regression so với baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("✅ Không có regression so với baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
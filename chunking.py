@@ -0,0 +1,116 @@
+import os
+from typing import Iterator, List, Optional
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+
+# Cấu hình chia chunk
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", "! ", "? ", " ", ""]
+MIN_CHUNK_CHARS = 50  # Bỏ qua các chunk gần như rỗng
+
+
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Tạo text splitter với cấu hình chung của hệ thống"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=CHUNK_SEPARATORS,
+        length_function=len,
+    )
+
+
+def _enhance_chunk(doc: Document, filename: str, chunk_id: int) -> Optional[Document]:
+    """Thêm metadata cho một chunk, trả về None nếu chunk gần như rỗng"""
+    # Filter out empty chunks
+    if len(doc.page_content.strip()) < MIN_CHUNK_CHARS:
+        return None
+
+    # Enhance metadata
+    doc.metadata.update({
+        'source_file': filename,
+        'chunk_id': chunk_id,
+        'chunk_length': len(doc.page_content), })
+    return doc
+
+
+def enhance_chunks(docs: List[Document], filename: str) -> List[Document]:
+    """Lọc chunk rỗng và thêm metadata (source_file, chunk_id, chunk_length)"""
+    enhanced_docs = []
+
+    for i, doc in enumerate(docs):
+        doc = _enhance_chunk(doc, filename, i)
+        if doc is not None:
+            enhanced_docs.append(doc)
+
+    return enhanced_docs
+
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[Document]:
+    """Đọc PDF từng trang một (metadata giống PyPDFLoader: source, page)
+
+    PyPDFLoader.load() tạo Document cho mọi trang trước khi trả về; ở đây
+    pypdf chỉ trích xuất text của trang đang được duyệt.
+    """
+    import pypdf
+
+    with open(pdf_path, 'rb') as f:
+        reader = pypdf.PdfReader(f)
+        for page_number, page in enumerate(reader.pages):
+            yield Document(
+                page_content=page.extract_text(),
+                metadata={'source': pdf_path, 'page': page_number})
+
+
+def iter_chunks(pdf_path: str) -> Iterator[Document]:
+    """Chia chunk theo từng trang, trả về dần các chunk đã có metadata
+
+    Splitter vốn chia độc lập từng trang nên kết quả (kể cả chunk_id) giống
+    hệt load_and_split, nhưng bộ nhớ không phụ thuộc số trang.
+    """
+    text_splitter = create_text_splitter()
+    filename = os.path.basename(pdf_path)
+    chunk_id = 0
+
+    for page in iter_pdf_pages(pdf_path):
+        for doc in text_splitter.split_documents([page]):
+            doc = _enhance_chunk(doc, filename, chunk_id)
+            chunk_id += 1
+            if doc is not None:
+                yield doc
+
+
+def iter_chunk_batches(pdf_path: str, batch_size: int) -> Iterator[List[Document]]:
+    """Gom các chunk của iter_chunks thành từng batch tối đa batch_size"""
+    batch = []
+    for doc in iter_chunks(pdf_path):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_and_split(pdf_path: str) -> List[Document]:
+    """Đọc PDF và chia thành các chunk đã có metadata
+
+    Hàm top-level, không phụ thuộc state của module khác nên chạy được
+    trong process pool.
+    """
+    # Import khi cần: document_loaders kéo theo rất nhiều module
+    try:
+        from langchain_community.document_loaders import PyPDFLoader
+    except ImportError:
+        # Fallback cho phiên bản cũ
+        from langchain.document_loaders import PyPDFLoader
+
+    loader = PyPDFLoader(pdf_path)
+    documents = loader.load()
+
+    if not documents:
+        raise ValueError(f"Không thể đọc nội dung từ file: {pdf_path}")
+
+    docs = create_text_splitter().split_documents(documents)
+    return enhance_chunks(docs, os.path.basename(pdf_path))
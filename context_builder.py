@@ -0,0 +1,171 @@
+import re
+import math
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from chunking import CHUNK_OVERLAP
+
+# Ngân sách token cho phần context (tài liệu) theo từng model, chừa chỗ cho
+# câu hỏi, template và câu trả lời (OpenAI instruct: 4097 token tổng, trả lời 500)
+CONTEXT_TOKEN_BUDGETS = {
+    "openai": 2500,
+    "gemini": 6000,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 2500
+
+# Ước lượng khi không có tiktoken: tiếng Việt có dấu ~3 ký tự mỗi token
+CHARS_PER_TOKEN = 3.0
+
+# Chunk có tỷ lệ cụm 3 từ đã nằm trong một chunk được giữ từ ngưỡng này bị coi là bản lặp
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+MIN_OVERLAP_CHARS = 10  # Phần trùng ngắn hơn thì không coi là overlap của splitter
+
+_encoder = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Đếm token: dùng tiktoken nếu đã cài, không thì ước lượng theo số ký tự"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def get_context_budget(model_type: str) -> int:
+    """Ngân sách token của context cho model"""
+    return CONTEXT_TOKEN_BUDGETS.get(model_type, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def _merge_texts(first: str, second: str) -> str:
+    """Nối hai chunk liền kề, bỏ phần overlap do text splitter lặp lại"""
+    max_overlap = min(len(first), len(second), CHUNK_OVERLAP * 2)
+    for size in range(max_overlap, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def merge_adjacent_chunks(docs: List[Document]) -> List[Document]:
+    """Gộp các chunk liền kề (cùng file, cùng trang, chunk_id liên tiếp)
+
+    Chunk gộp nằm ở vị trí của chunk có thứ hạng cao nhất trong nhóm;
+    metadata giữ chunk_id đầu tiên và thêm 'chunk_ids'. Document gốc trong
+    docstore không bị sửa.
+    """
+    groups: Dict[Tuple[str, object], List[Tuple[int, Document]]] = {}
+    passthrough: List[Tuple[int, Document]] = []
+    for rank, doc in enumerate(docs):
+        chunk_id = doc.metadata.get('chunk_id')
+        if chunk_id is None:
+            passthrough.append((rank, doc))
+            continue
+        key = (doc.metadata.get('source_file'), doc.metadata.get('page'))
+        groups.setdefault(key, []).append((rank, doc))
+
+    merged: List[Tuple[int, Document]] = list(passthrough)
+    for members in groups.values():
+        members.sort(key=lambda item: item[1].metadata['chunk_id'])
+        run = [members[0]]
+        for item in members[1:]:
+            if item[1].metadata['chunk_id'] == run[-1][1].metadata['chunk_id'] + 1:
+                run.append(item)
+            elif item[1].metadata['chunk_id'] == run[-1][1].metadata['chunk_id']:
+                continue  # Cùng chunk xuất hiện hai lần
+            else:
+                merged.append(_merge_run(run))
+                run = [item]
+        merged.append(_merge_run(run))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged]
+
+
+def _merge_run(run: List[Tuple[int, Document]]) -> Tuple[int, Document]:
+    """Gộp một dãy chunk liên tiếp thành một Document"""
+    best_rank = min(rank for rank, _ in run)
+    if len(run) == 1:
+        return best_rank, run[0][1]
+
+    text = run[0][1].page_content
+    for _, doc in run[1:]:
+        text = _merge_texts(text, doc.page_content)
+    metadata = dict(run[0][1].metadata)
+    metadata['chunk_ids'] = [doc.metadata['chunk_id'] for _, doc in run]
+    metadata['chunk_length'] = len(text)
+    return best_rank, Document(page_content=text, metadata=metadata)
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def drop_near_duplicates(docs: List[Document],
+                         threshold: float = DUPLICATE_THRESHOLD) -> List[Document]:
+    """Bỏ các chunk gần trùng với chunk xếp hạng cao hơn (vd. nhiều bản của cùng tài liệu)
+
+    Đo bằng tỷ lệ cụm từ của chunk đã có trong chunk được giữ, nên chunk nằm
+    gọn trong một chunk đã gộp cũng bị bỏ.
+    """
+    kept: List[Document] = []
+    kept_shingles: List[set] = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        is_duplicate = any(
+            len(shingles & other) / max(1, len(shingles)) >= threshold
+            for other in kept_shingles)
+        if not is_duplicate:
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def pack_documents(docs: List[Document], budget: int) -> Tuple[List[Document], int]:
+    """Lấy các chunk theo thứ hạng cho tới khi hết ngân sách token
+
+    Chunk không vừa thì bỏ qua (chunk sau có thể vẫn vừa); nếu ngay chunk
+    đầu tiên đã vượt ngân sách thì cắt bớt để prompt luôn có context.
+    """
+    packed, used = [], 0
+    for doc in docs:
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens <= budget:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            ratio = budget / max(1, tokens)
+            text = doc.page_content[:int(len(doc.page_content) * ratio)]
+            packed.append(Document(page_content=text, metadata=dict(doc.metadata, truncated=True)))
+            used += estimate_tokens(text)
+    return packed, used
+
+
+def build_context(docs: List[Document], model_type: str,
+                  budget: Optional[int] = None) -> Tuple[List[Document], dict]:
+    """Gộp chunk liền kề, bỏ chunk gần trùng rồi xếp vào ngân sách token của model
+
+    Trả về (documents đưa vào prompt, thống kê).
+    """
+    budget = budget or get_context_budget(model_type)
+    merged = merge_adjacent_chunks(docs)
+    unique = drop_near_duplicates(merged)
+    packed, context_tokens = pack_documents(unique, budget)
+    return packed, {
+        'retrieved_chunks': len(docs),
+        'merged_chunks': len(docs) - len(merged),
+        'duplicates_dropped': len(merged) - len(unique),
+        'dropped_for_budget': len(unique) - len(packed),
+        'context_chunks': len(packed),
+        'context_tokens': context_tokens,
+        'budget_tokens': budget,
+    }
@@ -0,0 +1,208 @@
+import os
+import re
+import zlib
+import hashlib
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv('config.env')
+
+# MinHash: NUM_PERM hàm hash, chia thành LSH_BANDS dải để tìm ứng viên nhanh
+NUM_PERM = 64
+LSH_BANDS = 16                    # 16 dải x 4 hàng
+SHINGLE_SIZE = 3                  # Cụm 3 từ
+NEAR_DUPLICATE_THRESHOLD = 0.9    # Jaccard ước lượng tối thiểu để coi là gần trùng
+# Gộp cả chunk gần trùng (tắt mặc định): bản sửa đổi chỉ khác vài số/câu sẽ
+# không được embed và index, câu trả lời trích dẫn nội dung cũ
+NEAR_DEDUP_ENABLED = os.getenv('NEAR_DEDUP_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa để so sánh: Unicode NFC, chữ thường, gộp khoảng trắng"""
+    text = unicodedata.normalize('NFC', text).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def content_hash(text: str) -> str:
+    """Hash nội dung đã chuẩn hóa (chunk trùng hoàn toàn có cùng hash)"""
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """Chữ ký MinHash (NUM_PERM số uint32) trên tập cụm SHINGLE_SIZE từ"""
+    words = re.findall(r"\w+", normalize_text(text))
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE])
+                    for i in range(len(words) - SHINGLE_SIZE + 1)}
+    # crc32 ổn định giữa các process (khác hash() của Python)
+    hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64)
+    # (a*x + b) mod p cho mọi hàm hash cùng lúc; phép nhân tràn uint64 vẫn
+    # cho hoán vị giả ngẫu nhiên đủ dùng
+    permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) % _MERSENNE_PRIME
+    return (permuted.min(axis=0) & _MAX_HASH).astype(np.uint32)
+
+
+def estimate_similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Jaccard ước lượng = tỷ lệ vị trí chữ ký trùng nhau"""
+    return float(np.mean(sig_a == sig_b))
+
+
+class DedupIndex:
+    """Chỉ mục phát hiện chunk trùng/gần trùng trong combined store
+
+    Mỗi chunk được lưu một lần; các document khác có chunk giống hệt (cùng
+    hash) hoặc gần giống (MinHash >= ngưỡng, chỉ khi near=True) chỉ tham
+    chiếu tới ID đó. refs đếm số lần mỗi document dùng từng ID để chỉ xóa
+    vector khi không còn ai dùng.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 near: bool = NEAR_DEDUP_ENABLED):
+        self.threshold = threshold
+        self.near = near
+        self.hashes: Dict[str, str] = {}             # content hash -> id
+        self.id_hashes: Dict[str, str] = {}          # id -> content hash
+        self.signatures: Dict[str, np.ndarray] = {}  # id -> chữ ký MinHash
+        self.sizes: Dict[str, int] = {}              # id -> số byte text
+        self.buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+        self.refs: Dict[str, Dict[str, int]] = {}    # id -> {store_key: số lần dùng}
+
+    def __len__(self) -> int:
+        return len(self.id_hashes)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.id_hashes
+
+    def _bands(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        rows = NUM_PERM // LSH_BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(LSH_BANDS)]
+
+    def find_duplicate(self, text: str,
+                       signature: Optional[np.ndarray] = None) -> Tuple[Optional[str], str]:
+        """Tìm chunk đã có trùng với text, trả về (id, 'exact' | 'near') hoặc (None, '')"""
+        existing = self.hashes.get(content_hash(text))
+        if existing is not None:
+            return existing, 'exact'
+        if not self.near:
+            return None, ''
+
+        signature = minhash_signature(text) if signature is None else signature
+        candidates = set()
+        for band in self._bands(signature):
+            candidates |= self.buckets.get(band, set())
+        best_id, best_score = None, self.threshold
+        for candidate in candidates:
+            score = estimate_similarity(signature, self.signatures[candidate])
+            if score >= best_score:
+                best_id, best_score = candidate, score
+        return (best_id, 'near') if best_id is not None else (None, '')
+
+    def _register(self, doc_id: str, text_hash: str, signature: np.ndarray, size: int):
+        self.hashes.setdefault(text_hash, doc_id)
+        self.id_hashes[doc_id] = text_hash
+        self.signatures[doc_id] = signature
+        self.sizes[doc_id] = size
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, set()).add(doc_id)
+        self.refs.setdefault(doc_id, {})
+
+    def add(self, doc_id: str, text: str, store_key: str,
+            signature: Optional[np.ndarray] = None):
+        """Đăng ký một chunk mới được lưu trong combined store"""
+        signature = minhash_signature(text) if signature is None else signature
+        self._register(doc_id, content_hash(text), signature, len(text.encode('utf-8')))
+        self.add_reference(doc_id, store_key)
+
+    def add_reference(self, doc_id: str, store_key: str):
+        """Document store_key dùng (lại) chunk doc_id"""
+        refs = self.refs.setdefault(doc_id, {})
+        refs[store_key] = refs.get(store_key, 0) + 1
+
+    def release(self, doc_ids: Iterable[str], store_key: str) -> List[str]:
+        """Bỏ tham chiếu của store_key, trả về các ID không còn document nào dùng"""
+        orphaned = []
+        for doc_id in dict.fromkeys(doc_ids):
+            refs = self.refs.get(doc_id)
+            if refs is None:
+                continue
+            refs.pop(store_key, None)
+            if not refs:
+                orphaned.append(doc_id)
+                self._forget(doc_id)
+        return orphaned
+
+    def _forget(self, doc_id: str):
+        self.refs.pop(doc_id, None)
+        self.sizes.pop(doc_id, None)
+        text_hash = self.id_hashes.pop(doc_id, None)
+        if text_hash is not None and self.hashes.get(text_hash) == doc_id:
+            del self.hashes[text_hash]
+        signature = self.signatures.pop(doc_id, None)
+        if signature is not None:
+            for band in self._bands(signature):
+                bucket = self.buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(doc_id)
+                    if not bucket:
+                        del self.buckets[band]
+
+    def save(self, path: str):
+        """Lưu hash, chữ ký và kích thước (refs dựng lại từ manifest của combined store)"""
+        ids = list(self.id_hashes)
+        signatures = (np.stack([self.signatures[i] for i in ids]) if ids
+                      else np.zeros((0, NUM_PERM), dtype=np.uint32))
+        with open(path, 'wb') as f:
+            np.savez(f, ids=np.array(ids, dtype=str),
+                     hashes=np.array([self.id_hashes[i] for i in ids], dtype=str),
+                     signatures=signatures,
+                     sizes=np.array([self.sizes[i] for i in ids], dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: str, documents: Dict[str, dict]) -> Optional["DedupIndex"]:
+        """Đọc chỉ mục đã lưu; documents: manifest combined (store_key -> {'ids'})"""
+        try:
+            data = np.load(path, allow_pickle=False)
+            rows = zip(data['ids'], data['hashes'], data['signatures'], data['sizes'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+        index = cls()
+        for doc_id, text_hash, signature, size in rows:
+            index._register(str(doc_id), str(text_hash), signature, int(size))
+        for store_key, entry in documents.items():
+            for doc_id in entry['ids']:
+                if doc_id in index:
+                    index.add_reference(doc_id, store_key)
+        return index
+
+    def report(self, dim: int = 0) -> dict:
+        """Số chunk đang lưu, số chunk dùng chung và phần không phải lưu lại
+
+        dim: số chiều vector (float32) để ước lượng dung lượng tiết kiệm.
+        """
+        saved_chunks = saved_bytes = shared = 0
+        for doc_id, refs in self.refs.items():
+            copies = sum(refs.values()) - 1
+            if len(refs) > 1:
+                shared += 1
+            if copies > 0:
+                saved_chunks += copies
+                saved_bytes += copies * (dim * 4 + self.sizes.get(doc_id, 0))
+        return {
+            'stored_chunks': len(self.id_hashes),
+            'shared_chunks': shared,
+            'saved_chunks': saved_chunks,
+            'saved_mb': round(saved_bytes / (1024 * 1024), 2),
+        }
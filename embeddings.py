@@ -0,0 +1,251 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.schema.embeddings import Embeddings
+
+load_dotenv('config.env')
+
+EMBEDDING_BACKEND_SENTENCE_TRANSFORMERS = "sentence_transformers"
+EMBEDDING_BACKEND_ONNX = "onnx"
+
+# Cấu hình model embedding mặc định
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', EMBEDDING_BACKEND_SENTENCE_TRANSFORMERS)
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL', "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE', "cpu")
+# Số câu mỗi lần chạy model (khác EMBED_BATCH_SIZE: số chunk gom lại trong pipeline ingest)
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', '0'))  # 0: mặc định của runtime
+# Đổi khi thay trọng số model mà vẫn giữ tên, để các store cũ được embed lại
+EMBEDDING_MODEL_VERSION = os.getenv('EMBEDDING_MODEL_VERSION', '')
+
+# ONNX Runtime: model được export (và lượng tử hóa int8 động) một lần vào thư mục này
+ONNX_MODELS_DIR = os.getenv('ONNX_MODELS_DIR', "onnx_models")
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', 'true').lower() in ('1', 'true', 'yes')
+ONNX_MAX_SEQ_LENGTH = 256
+
+# Store tạo trước khi có tag embedding đều dùng model mặc định qua sentence-transformers
+LEGACY_EMBEDDING_TAG = "all-MiniLM-L6-v2"
+
+# Số câu hỏi gần nhất được giữ embedding trong cache
+QUERY_CACHE_SIZE = 1024
+
+# Registry dùng chung toàn process: (backend, model_name, device) -> embeddings
+_registry: Dict[Tuple[str, str, str], "CachedQueryEmbeddings"] = {}
+_registry_stats: Dict[Tuple[str, str, str], dict] = {}
+_registry_lock = threading.Lock()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Bọc embeddings, cache kết quả embed_query theo LRU
+
+    Câu hỏi lặp lại không phải chạy lại model; embed_documents đi thẳng
+    xuống model gốc.
+    """
+
+    def __init__(self, base: Embeddings, max_size: int = QUERY_CACHE_SIZE,
+                 tag: Optional[str] = None):
+        self.base = base
+        self.max_size = max_size
+        self.tag = tag  # Ghi vào store để phát hiện vectors của model khác
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return vector
+
+        vector = self.base.embed_query(text)
+        with self._lock:
+            self.misses += 1
+            self._cache[text] = vector
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """embed_query cho nhiều câu hỏi: tra cache từng câu, câu chưa có được embed cùng lúc"""
+        vectors: List[Optional[List[float]]] = []
+        with self._lock:
+            for text in texts:
+                vector = self._cache.get(text)
+                if vector is not None:
+                    self._cache.move_to_end(text)
+                    self.hits += 1
+                vectors.append(vector)
+
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors
+        computed = dict(zip(missing, embed_queries(self.base, missing)))
+        with self._lock:
+            for text, vector in computed.items():
+                self.misses += 1
+                self._cache[text] = vector
+                if len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return [vector if vector is not None else computed[text]
+                for text, vector in zip(texts, vectors)]
+
+    def cache_info(self) -> dict:
+        """Thống kê cache (hits, misses, size)"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._cache), 'max_size': self.max_size}
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed nhiều câu hỏi theo kiểu câu hỏi (không phải embed_documents)
+
+    Dùng embed_queries theo batch nếu embeddings có, không thì gọi
+    embed_query từng câu (model có encoder câu hỏi riêng vẫn đúng).
+    """
+    embed_batch = getattr(embeddings, 'embed_queries', None)
+    if embed_batch is not None:
+        return embed_batch(list(texts))
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def _get_rss_mb() -> Optional[float]:
+    """Lấy bộ nhớ resident hiện tại của process (MB), None nếu không đo được"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        # Không có psutil: dùng peak RSS (xấp xỉ khi model làm tăng peak)
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về bytes
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except (ImportError, OSError):
+        return None
+
+
+def _create_sentence_transformers(model_name: str, device: str) -> Embeddings:
+    """sentence-transformers (PyTorch)"""
+    # Import khi load model lần đầu (kéo theo sentence-transformers/torch)
+    try:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+    except ImportError:
+        # Fallback cho phiên bản cũ
+        from langchain.embeddings import HuggingFaceEmbeddings
+
+    if EMBEDDING_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': device},
+        encode_kwargs={'batch_size': EMBEDDING_BATCH_SIZE}
+    )
+
+
+def _create_onnx(model_name: str, device: str) -> Embeddings:
+    """ONNX Runtime trên CPU, mặc định lượng tử hóa int8 động (export lần đầu)"""
+    from onnx_embeddings import OnnxEmbeddings, export_onnx_model
+
+    model_dir = os.path.join(ONNX_MODELS_DIR, model_name.replace('/', '__'))
+    try:
+        # Export cần torch/transformers/onnx, chạy cần onnxruntime (import khi dùng)
+        model_file = export_onnx_model(model_name, model_dir, quantize=ONNX_QUANTIZE)
+        return OnnxEmbeddings(model_file, batch_size=EMBEDDING_BATCH_SIZE,
+                              threads=EMBEDDING_THREADS, max_seq_length=ONNX_MAX_SEQ_LENGTH)
+    except ImportError as e:
+        raise ImportError(
+            f"Backend onnx thiếu thư viện {e.name or e}: pip install -r requirements-onnx.txt") from e
+
+
+# Các backend embedding: tên -> hàm tạo (model_name, device) -> Embeddings
+_embedding_backends: Dict[str, Callable[[str, str], Embeddings]] = {
+    EMBEDDING_BACKEND_SENTENCE_TRANSFORMERS: _create_sentence_transformers,
+    EMBEDDING_BACKEND_ONNX: _create_onnx,
+}
+
+
+def get_embedding_backends() -> List[str]:
+    """Tên các backend embedding đang hỗ trợ"""
+    return list(_embedding_backends)
+
+
+def get_embedding_tag(model_name: str = EMBEDDING_MODEL_NAME,
+                      backend: str = EMBEDDING_BACKEND) -> str:
+    """Tag của không gian vector: chỉ tìm kiếm store có cùng tag với model đang dùng
+
+    Mọi backend khác sentence-transformers đều có tag riêng: ONNX luôn mean
+    pooling + chuẩn hóa L2 với max_seq_length của ONNX_MAX_SEQ_LENGTH, không
+    đọc cấu hình pooling của model nên vectors có thể khác dù cùng trọng số.
+    """
+    tag = model_name
+    if backend == EMBEDDING_BACKEND_ONNX and ONNX_QUANTIZE:
+        tag += "+int8"
+    elif backend != EMBEDDING_BACKEND_SENTENCE_TRANSFORMERS:
+        tag += f"+{backend}"
+    if EMBEDDING_MODEL_VERSION:
+        tag += f"@{EMBEDDING_MODEL_VERSION}"
+    return tag
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL_NAME,
+                   device: str = EMBEDDING_DEVICE,
+                   backend: str = EMBEDDING_BACKEND) -> CachedQueryEmbeddings:
+    """Lấy embeddings dùng chung, chỉ load model lần đầu tiên được gọi"""
+    key = (backend, model_name, device)
+    embeddings = _registry.get(key)
+    if embeddings is not None:
+        return embeddings
+
+    with _registry_lock:
+        # Kiểm tra lại sau khi có lock (thread khác có thể đã load xong)
+        embeddings = _registry.get(key)
+        if embeddings is not None:
+            return embeddings
+
+        factory = _embedding_backends.get(backend)
+        if factory is None:
+            raise ValueError(
+                f"Backend embedding '{backend}' không được hỗ trợ. "
+                f"Chọn: {', '.join(_embedding_backends)}")
+
+        rss_before = _get_rss_mb()
+        start = time.perf_counter()
+        embeddings = CachedQueryEmbeddings(factory(model_name, device),
+                                           tag=get_embedding_tag(model_name, backend))
+        load_time = time.perf_counter() - start
+        rss_after = _get_rss_mb()
+
+        stats = {
+            'model_name': model_name,
+            'device': device,
+            'backend': backend,
+            'tag': embeddings.tag,
+            'load_time_s': round(load_time, 3),
+            'memory_mb': (round(rss_after - rss_before, 1)
+                          if rss_before is not None and rss_after is not None
+                          else None),
+        }
+        _registry[key] = embeddings
+        _registry_stats[key] = stats
+
+    return embeddings
+
+
+def get_loaded_models() -> List[dict]:
+    """Danh sách các model đã load cùng thời gian load và bộ nhớ"""
+    with _registry_lock:
+        return [dict(stats, query_cache=_registry[key].cache_info())
+                for key, stats in _registry_stats.items()]
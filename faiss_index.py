@@ -0,0 +1,443 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Các loại index hỗ trợ
+INDEX_AUTO = "auto"
+INDEX_FLAT = "flat"    # Exact search (quét toàn bộ)
+INDEX_IVF = "ivf"      # IVF-Flat: chia cụm bằng centroids đã train
+INDEX_HNSW = "hnsw"    # Đồ thị HNSW, không hỗ trợ xóa vector
+INDEX_IVF_PQ = "ivfpq"  # IVF + Product Quantization, tiết kiệm bộ nhớ
+INDEX_TYPES = [INDEX_AUTO, INDEX_FLAT, INDEX_IVF, INDEX_HNSW, INDEX_IVF_PQ]
+
+# Định dạng lưu vectors (cấu hình theo từng store)
+VECTOR_FLOAT32 = "float32"
+VECTOR_FLOAT16 = "float16"   # Một nửa bộ nhớ, sai số không đáng kể
+VECTOR_INT8 = "int8"         # Scalar quantization 8 bit/chiều (min/max theo từng chiều)
+VECTOR_DTYPES = [VECTOR_FLOAT32, VECTOR_FLOAT16, VECTOR_INT8]
+RESCORE_MULTIPLIER = 4       # Lấy k*4 ứng viên trên vectors nén rồi chấm lại bằng float32
+
+# Ngưỡng chọn index tự động theo số vector
+FLAT_MAX_VECTORS = 50_000
+IVF_MAX_VECTORS = 1_000_000
+
+# Tham số mặc định
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_NBITS = 8
+MIN_POINTS_PER_CENTROID = 39  # FAISS cảnh báo khi train ít hơn mức này
+MAX_TRAIN_POINTS_PER_CENTROID = 256
+
+# Số vector quét mỗi lần khi tìm kiếm trên vectors memory-mapped
+MMAP_SEARCH_BLOCK = 65536
+
+# Báo cáo recall
+RECALL_QUERIES = 200
+RECALL_K = 10
+
+
+def choose_index_type(n_vectors: int) -> str:
+    """Chọn loại index theo kích thước corpus"""
+    if n_vectors < FLAT_MAX_VECTORS:
+        return INDEX_FLAT
+    if n_vectors < IVF_MAX_VECTORS:
+        return INDEX_IVF
+    return INDEX_IVF_PQ
+
+
+def _default_nlist(n_vectors: int) -> int:
+    """Số centroids ~ 4*sqrt(N), đủ điểm train cho mỗi centroid"""
+    nlist = int(4 * np.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def _default_pq_m(dimension: int) -> int:
+    """Số sub-quantizer PQ: ~8 chiều mỗi sub-vector, phải chia hết số chiều"""
+    for m in (dimension // 8, 64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if m >= 1 and dimension % m == 0:
+            return m
+    return 1
+
+
+def _train_sample(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Lấy mẫu ngẫu nhiên để train centroids (không cần toàn bộ corpus)"""
+    max_points = nlist * MAX_TRAIN_POINTS_PER_CENTROID
+    if len(vectors) <= max_points:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[rng.choice(len(vectors), max_points, replace=False)]
+
+
+def unwrap_index(index):
+    """Index FAISS bên dưới (bỏ lớp RescoringIndex nếu có)"""
+    return getattr(index, 'base_index', index)
+
+
+def get_index_type(index) -> str:
+    """Xác định loại index từ object FAISS"""
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    if isinstance(index, faiss.IndexIVFPQ):
+        return INDEX_IVF_PQ
+    if isinstance(index, faiss.IndexIVF):
+        return INDEX_IVF
+    return INDEX_FLAT
+
+
+def get_vector_dtype(index) -> str:
+    """Định dạng vectors của index IVF/HNSW (index flat luôn giữ float32 trong RAM)"""
+    index = unwrap_index(index)
+    sq = None
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        sq = index.sq
+    elif isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        if isinstance(storage, faiss.IndexScalarQuantizer):
+            sq = storage.sq
+    if sq is None:
+        return VECTOR_FLOAT32
+    return VECTOR_FLOAT16 if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else VECTOR_INT8
+
+
+def _sq_type(vector_dtype: str) -> int:
+    return (faiss.ScalarQuantizer.QT_fp16 if vector_dtype == VECTOR_FLOAT16
+            else faiss.ScalarQuantizer.QT_8bit)
+
+
+def quantize_vectors(vectors: np.ndarray,
+                     vector_dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Nén vectors float32 để lưu, trả về (codes, quantizer)
+
+    int8: mỗi chiều được chia đều 256 mức giữa min và max của chiều đó,
+    codes là uint8 và quantizer là mảng [vmin, vdiff] (2 x d).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vector_dtype == VECTOR_FLOAT16:
+        return vectors.astype(np.float16), None
+    if vector_dtype == VECTOR_INT8:
+        if len(vectors):
+            vmin, vmax = vectors.min(axis=0), vectors.max(axis=0)
+        else:
+            vmin = vmax = np.zeros(vectors.shape[1], dtype=np.float32)
+        vdiff = np.maximum(vmax - vmin, 1e-12)
+        codes = np.rint((vectors - vmin) / vdiff * 255)
+        return (np.clip(codes, 0, 255).astype(np.uint8),
+                np.stack([vmin, vdiff]).astype(np.float32))
+    return vectors, None
+
+
+def dequantize_vectors(codes: np.ndarray, quantizer: Optional[np.ndarray] = None) -> np.ndarray:
+    """Giải nén codes (float16 / uint8 / float32) về float32"""
+    if quantizer is not None:
+        return quantizer[0] + np.asarray(codes, dtype=np.float32) * (quantizer[1] / 255)
+    return np.asarray(codes, dtype=np.float32)
+
+
+def supports_remove(index) -> bool:
+    """Index có xóa vector mà vẫn giữ thứ tự vị trí (như LangChain FAISS.delete cần)"""
+    return get_index_type(index) == INDEX_FLAT
+
+
+def apply_search_params(index, params: dict):
+    """Áp dụng tham số tìm kiếm (nprobe / efSearch) đã lưu cho index"""
+    index_type = get_index_type(index)
+    index = unwrap_index(index)
+    if index_type in (INDEX_IVF, INDEX_IVF_PQ) and params.get('nprobe'):
+        faiss.extract_index_ivf(index).nprobe = int(params['nprobe'])
+    elif index_type == INDEX_HNSW and params.get('ef_search'):
+        index.hnsw.efSearch = int(params['ef_search'])
+
+
+def get_index_params(index) -> dict:
+    """Mô tả loại index và các tham số đang dùng (để lưu lại cùng store)"""
+    index_type = get_index_type(index)
+    index = unwrap_index(index)
+    params = {'index_type': index_type, 'dimension': index.d, 'ntotal': index.ntotal}
+    if index_type in (INDEX_IVF, INDEX_IVF_PQ):
+        ivf = faiss.extract_index_ivf(index)
+        params.update({'nlist': ivf.nlist, 'nprobe': ivf.nprobe})
+        if index_type == INDEX_IVF_PQ:
+            params.update({'pq_m': index.pq.M, 'pq_nbits': index.pq.nbits})
+    elif index_type == INDEX_HNSW:
+        params.update({'hnsw_m': index.hnsw.nb_neighbors(1),
+                       'ef_search': index.hnsw.efSearch})
+    return params
+
+
+def build_index(vectors: np.ndarray, index_type: str = INDEX_AUTO,
+                nprobe: int = DEFAULT_NPROBE,
+                ef_search: int = DEFAULT_EF_SEARCH,
+                vector_dtype: str = VECTOR_FLOAT32) -> Tuple[faiss.Index, dict]:
+    """Tạo index FAISS từ ma trận vectors (float32, shape N x d)
+
+    Trả về (index, params). Nếu corpus quá nhỏ để train loại index được
+    chọn thì dùng flat và ghi lại trong params['fallback_from'].
+    vector_dtype float16/int8: IVF/HNSW dùng scalar quantizer của FAISS;
+    index flat vẫn float32 trong RAM và chỉ được nén khi lưu (save_store).
+    IVF-PQ đã nén bằng PQ nên bỏ qua vector_dtype.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dimension = vectors.shape
+    requested = index_type
+    if index_type == INDEX_AUTO:
+        index_type = choose_index_type(n_vectors)
+
+    nlist = _default_nlist(n_vectors)
+    if index_type in (INDEX_IVF, INDEX_IVF_PQ) and nlist < 2:
+        index_type = INDEX_FLAT
+    if index_type == INDEX_IVF_PQ and n_vectors < (1 << PQ_NBITS) * MIN_POINTS_PER_CENTROID:
+        index_type = INDEX_FLAT
+    if index_type == INDEX_IVF_PQ:
+        vector_dtype = VECTOR_FLOAT32
+    quantized = vector_dtype != VECTOR_FLOAT32
+
+    start = time.perf_counter()
+    if index_type == INDEX_IVF:
+        quantizer = faiss.IndexFlatL2(dimension)
+        if quantized:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, _sq_type(vector_dtype))
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        index.train(_train_sample(vectors, nlist))
+        index.nprobe = min(nprobe, nlist)
+    elif index_type == INDEX_IVF_PQ:
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer, dimension, nlist, _default_pq_m(dimension), PQ_NBITS)
+        index.train(_train_sample(vectors, nlist))
+        index.nprobe = min(nprobe, nlist)
+    elif index_type == INDEX_HNSW:
+        if quantized:
+            index = faiss.IndexHNSWSQ(dimension, _sq_type(vector_dtype), HNSW_M)
+            index.train(_train_sample(vectors, nlist))  # min/max của scalar quantizer
+        else:
+            index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = ef_search
+    else:
+        index = faiss.IndexFlatL2(dimension)
+
+    index.add(vectors)
+
+    params = get_index_params(index)
+    params['build_time_s'] = round(time.perf_counter() - start, 3)
+    params['vector_dtype'] = vector_dtype
+    if requested not in (INDEX_AUTO, index_type):
+        params['fallback_from'] = requested
+    return index, params
+
+
+def recall_report(index, vectors: np.ndarray, k: int = RECALL_K,
+                  n_queries: int = RECALL_QUERIES, seed: int = 0) -> dict:
+    """So sánh index với exact search: recall@k và latency mỗi truy vấn
+
+    Truy vấn là các vector lấy mẫu từ chính corpus; ground truth tính bằng
+    IndexFlatL2 trên cùng vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return {}
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+
+    def timed_search(target) -> Tuple[np.ndarray, float]:
+        labels = []
+        start = time.perf_counter()
+        for query in queries:
+            _, ids = target.search(query.reshape(1, -1), k)
+            labels.append(ids[0])
+        return np.array(labels), (time.perf_counter() - start) / len(queries)
+
+    exact_ids, exact_latency = timed_search(exact)
+    approx_ids, approx_latency = timed_search(index)
+
+    hits = [len(set(a) & set(e)) for a, e in zip(approx_ids, exact_ids)]
+    return {
+        'k': k,
+        'queries': len(queries),
+        'recall_at_k': round(float(np.mean(hits)) / k, 4),
+        'latency_ms': round(approx_latency * 1000, 3),
+        'exact_latency_ms': round(exact_latency * 1000, 3),
+    }
+
+
+def _vector_bytes(vector_dtype: str) -> int:
+    return {VECTOR_FLOAT16: 2, VECTOR_INT8: 1}.get(vector_dtype, 4)
+
+
+def quantization_report(vectors: np.ndarray, k: int = RECALL_K,
+                        n_queries: int = RECALL_QUERIES, seed: int = 0) -> Dict[str, dict]:
+    """So sánh float32 / float16 / int8 trên cùng corpus: bộ nhớ vectors và recall@k
+
+    Tìm kiếm flat trên vectors đã nén, có và không có bước chấm lại bằng
+    float32. Ground truth là exact search float32; truy vấn lấy mẫu từ corpus.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return {}
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, exact_ids = exact.search(queries, k)
+
+    def measure(index) -> Tuple[float, float]:
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        latency = (time.perf_counter() - start) / len(queries)
+        hits = [len(set(a) & set(e)) for a, e in zip(ids, exact_ids)]
+        return round(float(np.mean(hits)) / k, 4), round(latency * 1000, 3)
+
+    report = {}
+    for vector_dtype in VECTOR_DTYPES:
+        codes, quantizer = quantize_vectors(vectors, vector_dtype)
+        flat = MmapFlatIndex(codes, quantizer=quantizer)
+        recall, latency = measure(flat)
+        entry = {
+            'memory_mb': round(len(vectors) * vectors.shape[1] * _vector_bytes(vector_dtype)
+                               / (1024 * 1024), 3),
+            'recall_at_k': recall,
+            'latency_ms': latency,
+        }
+        if vector_dtype != VECTOR_FLOAT32:
+            entry['rescored_recall_at_k'], entry['rescored_latency_ms'] = measure(
+                RescoringIndex(flat, vectors))
+        report[vector_dtype] = entry
+    return report
+
+
+def collect_vectors(indexes: List[faiss.Index]) -> Optional[np.ndarray]:
+    """Ghép vectors từ các index flat (vector store riêng của từng document)"""
+    parts = [index.reconstruct_n(0, index.ntotal) for index in indexes if index.ntotal]
+    if not parts:
+        return None
+    return np.vstack(parts).astype(np.float32)
+
+
+class MmapFlatIndex:
+    """Index flat (L2) chỉ đọc trên vectors memory-mapped từ file .npy
+
+    Vectors không được copy vào RAM: các process cùng đọc một file dùng
+    chung page cache, và chỉ các trang thực sự được quét mới nằm trong bộ
+    nhớ. Dùng cho đường truy vấn; muốn thêm/xóa vector cần load index thường.
+    vectors có thể là float16 hoặc codes uint8 (kèm quantizer), được giải
+    nén theo từng block khi quét.
+    """
+
+    def __init__(self, vectors: np.ndarray, norms: Optional[np.ndarray] = None,
+                 quantizer: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.norms = norms
+        self.quantizer = quantizer
+        self.ntotal = int(vectors.shape[0])
+        self.d = int(vectors.shape[1])
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Tìm k vector gần nhất theo khoảng cách L2 bình phương (như IndexFlatL2)"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        n_queries = queries.shape[0]
+        best_dist = np.full((n_queries, k), np.inf, dtype=np.float32)
+        best_ids = np.full((n_queries, k), -1, dtype=np.int64)
+        query_norms = (queries ** 2).sum(axis=1, keepdims=True)
+
+        for start in range(0, self.ntotal, MMAP_SEARCH_BLOCK):
+            block = dequantize_vectors(self.vectors[start:start + MMAP_SEARCH_BLOCK], self.quantizer)
+            if self.norms is not None:
+                block_norms = np.asarray(self.norms[start:start + len(block)], dtype=np.float32)
+            else:
+                block_norms = (block ** 2).sum(axis=1)
+            dist = query_norms - 2 * queries @ block.T + block_norms[None, :]
+
+            # Gộp top-k của block với top-k hiện tại
+            ids = np.broadcast_to(np.arange(start, start + len(block)), dist.shape)
+            all_dist = np.concatenate([best_dist, dist], axis=1)
+            all_ids = np.concatenate([best_ids, ids], axis=1)
+            top = np.argpartition(all_dist, k - 1, axis=1)[:, :k] if all_dist.shape[1] > k \
+                else np.argsort(all_dist, axis=1)
+            best_dist = np.take_along_axis(all_dist, top, axis=1)
+            best_ids = np.take_along_axis(all_ids, top, axis=1)
+
+        order = np.argsort(best_dist, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_ids[np.isinf(best_dist)] = -1
+        return np.maximum(best_dist, 0).astype(np.float32), best_ids
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        return dequantize_vectors(self.vectors[key], self.quantizer)
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return dequantize_vectors(self.vectors[start:start + n], self.quantizer)
+
+    def _read_only(self, *args, **kwargs):
+        raise RuntimeError("MmapFlatIndex chỉ đọc - hãy load store với mmap=False để sửa")
+
+    add = remove_ids = merge_from = train = _read_only
+
+
+class RescoringIndex:
+    """Tìm trên index vectors nén rồi chấm lại các ứng viên bằng vectors float32 gốc
+
+    Lấy k * multiplier ứng viên từ base_index (float16/int8), tính lại
+    khoảng cách L2 chính xác với vectors gốc và giữ k kết quả tốt nhất.
+    originals thường được memory-map nên chỉ các ứng viên được đọc từ disk.
+    """
+
+    def __init__(self, base_index, originals: np.ndarray, multiplier: int = RESCORE_MULTIPLIER):
+        self.base_index = base_index
+        self.originals = originals
+        self.multiplier = multiplier
+
+    @property
+    def ntotal(self) -> int:
+        return self.base_index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.base_index.d
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        n_candidates = min(self.ntotal, k * self.multiplier)
+        best_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if n_candidates == 0:
+            return best_dist, best_ids
+
+        _, candidates = self.base_index.search(queries, n_candidates)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = np.sort(ids[ids >= 0])  # Đọc file gốc theo thứ tự vị trí
+            if not len(ids):
+                continue
+            dist = ((np.asarray(self.originals[ids], dtype=np.float32) - query) ** 2).sum(axis=1)
+            top = np.argsort(dist)[:k]
+            best_dist[row, :len(top)] = dist[top]
+            best_ids[row, :len(top)] = ids[top]
+        return best_dist, best_ids
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        return np.array(self.originals[key], dtype=np.float32)
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return np.array(self.originals[start:start + n], dtype=np.float32)
+
+    def _read_only(self, *args, **kwargs):
+        raise RuntimeError("RescoringIndex chỉ đọc - store nén được sửa qua bản float32")
+
+    add = remove_ids = merge_from = train = _read_only
+
+
+def read_index_mmap(index_path: str):
+    """Đọc index FAISS, memory-map inverted lists nếu là IVF (HNSW đọc bình thường)"""
+    return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
@@ -0,0 +1,159 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+
+from embeddings import embed_queries, get_embeddings
+from reranker import RERANK_CANDIDATES, RERANK_LATENCY_BUDGET_MS, rerank_documents
+from shards import ShardSet
+from sparse_index import SparseIndex
+from telemetry import span
+
+# Cấu hình retrieval
+RETRIEVAL_K = 6        # Số chunk đưa vào prompt
+HYBRID_FETCH_K = 20    # Số ứng viên lấy từ mỗi nhánh (dense, BM25) trước khi gộp
+RRF_K = 60             # Hằng số của Reciprocal Rank Fusion
+DENSE_WEIGHT = 1.0
+SPARSE_WEIGHT = 1.0
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[str]],
+                           weights: Optional[Sequence[float]] = None,
+                           rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Gộp nhiều danh sách ID đã xếp hạng: điểm = tổng weight / (rrf_k + hạng)
+
+    Chỉ dùng thứ hạng nên không cần chuẩn hóa khoảng cách L2 với điểm BM25.
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever kết hợp FAISS (dense) và BM25 (sparse) bằng Reciprocal Rank Fusion
+
+    BM25 bắt được mã số, số điều khoản và từ tiếng Việt mà MiniLM embed kém;
+    nhờ vậy lấy ít chunk hơn mà vẫn đủ ngữ cảnh. Nếu chưa có index BM25 thì
+    chỉ dùng kết quả dense. index_getter trả về cặp (vector store, BM25) đang
+    phục vụ, lấy một lần mỗi truy vấn nên không bị lẫn hai phiên bản index khi
+    combined store được thay giữa chừng. rerank=True: lấy rerank_candidates ứng viên rồi
+    chấm lại bằng cross-encoder, giữ k chunk tốt nhất.
+
+    shard_getter trả về các shard (vector store riêng của từng document):
+    truy vấn giới hạn trong một số file, hoặc mọi truy vấn khi sharded=True,
+    được tìm song song trên các shard rồi gộp top-k trước khi RRF.
+    """
+
+    index_getter: Callable[[], Tuple[Any, Optional[SparseIndex]]]
+    shard_getter: Optional[Callable[[], ShardSet]] = None
+    sharded: bool = False
+    k: int = RETRIEVAL_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+    dense_weight: float = DENSE_WEIGHT
+    sparse_weight: float = SPARSE_WEIGHT
+    rerank: bool = False
+    rerank_candidates: int = RERANK_CANDIDATES
+    rerank_budget_ms: float = RERANK_LATENCY_BUDGET_MS
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _dense_ids(self, store, vectors: np.ndarray, fetch_k: int) -> List[List[str]]:
+        """ID các chunk gần nhất của từng vector câu hỏi (một lần search trên index FAISS)"""
+        ntotal = store.index.ntotal
+        if ntotal == 0:
+            return [[] for _ in range(len(vectors))]
+        with span("query.faiss_search", queries=len(vectors)):
+            _, positions = store.index.search(vectors, min(fetch_k, ntotal))
+        return [[store.index_to_docstore_id[int(i)] for i in row if i != -1]
+                for row in positions]
+
+    def _n_results(self) -> Tuple[int, int]:
+        """(số chunk cần trả về trước rerank, số ứng viên lấy từ mỗi nhánh)"""
+        # Khi rerank thì lấy dư ứng viên để cross-encoder chọn lại
+        n_results = max(self.k, self.rerank_candidates) if self.rerank else self.k
+        return n_results, max(self.fetch_k, n_results)
+
+    def _rank_documents(self, store, sparse_index: Optional[SparseIndex], query: str,
+                        dense_ids: List[str], n_results: int, fetch_k: int) -> List[Document]:
+        """Gộp kết quả dense với BM25, đọc chunk từ docstore rồi rerank (nếu bật)"""
+        sparse_ids = None
+        if sparse_index is not None and len(sparse_index) > 0:
+            with span("query.bm25"):
+                sparse_ids = [doc_id for doc_id, _ in sparse_index.search(query, fetch_k)]
+        return self._fuse_documents(query, dense_ids, sparse_ids, n_results,
+                                    store.docstore.search)
+
+    def _fuse_documents(self, query: str, dense_ids: list, sparse_ids: Optional[list],
+                        n_results: int, lookup: Callable[[Any], Any]) -> List[Document]:
+        """RRF hai danh sách ID (sparse_ids None: chỉ dense), đọc chunk qua lookup rồi rerank"""
+        if sparse_ids is None:
+            ranked_ids = dense_ids[:n_results]
+        else:
+            fused = reciprocal_rank_fusion(
+                [dense_ids, sparse_ids], [self.dense_weight, self.sparse_weight], self.rrf_k)
+            ranked_ids = [doc_id for doc_id, _ in fused[:n_results]]
+
+        docs = []
+        for doc_id in ranked_ids:
+            doc = lookup(doc_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+
+        if self.rerank:
+            with span("query.rerank", chunks=len(docs)):
+                return rerank_documents(query, docs, self.k, self.rerank_budget_ms)
+        return docs
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.sharded:
+            return self._search_shards([query], None, None)[0]
+        n_results, fetch_k = self._n_results()
+        store, sparse_index = self.index_getter()
+        if store is None:
+            return []
+        vector = np.array([store._embed_query(query)], dtype=np.float32)
+        dense_ids = self._dense_ids(store, vector, fetch_k)[0]
+        return self._rank_documents(store, sparse_index, query, dense_ids, n_results, fetch_k)
+
+    def retrieve_batch(self, queries: List[str],
+                       query_vectors: Optional[Sequence[Sequence[float]]] = None,
+                       source_files: Optional[Sequence[str]] = None) -> List[List[Document]]:
+        """Tìm kiếm cho nhiều câu hỏi: một lần search FAISS cho cả batch
+
+        query_vectors: embedding đã tính sẵn (cùng thứ tự với queries); không
+        truyền thì embed các câu hỏi (qua cache câu hỏi) một lần cho cả batch. Mọi câu hỏi dùng cùng một phiên bản index.
+        source_files: chỉ tìm trong các file này (qua shard của từng file).
+        """
+        if self.sharded or source_files:
+            return self._search_shards(queries, query_vectors, source_files)
+        store, sparse_index = self.index_getter()
+        if store is None or not queries:
+            return [[] for _ in queries]
+        if query_vectors is None:
+            query_vectors = embed_queries(store.embeddings, list(queries))
+        n_results, fetch_k = self._n_results()
+        dense_ids = self._dense_ids(store, np.asarray(query_vectors, dtype=np.float32), fetch_k)
+        return [self._rank_documents(store, sparse_index, query, ids, n_results, fetch_k)
+                for query, ids in zip(queries, dense_ids)]
+
+    def _search_shards(self, queries: List[str],
+                       query_vectors: Optional[Sequence[Sequence[float]]],
+                       source_files: Optional[Sequence[str]]) -> List[List[Document]]:
+        """Tìm song song trên các shard (của các file được chọn), gộp top-k rồi RRF"""
+        shards = self.shard_getter() if self.shard_getter is not None else None
+        if not shards or not queries:
+            return [[] for _ in queries]
+        if query_vectors is None:
+            query_vectors = get_embeddings().embed_queries(list(queries))
+        n_results, fetch_k = self._n_results()
+        merged = shards.search(list(queries), np.asarray(query_vectors, dtype=np.float32),
+                               fetch_k, source_files)
+        return [self._fuse_documents(query, dense_ids, sparse_ids or None, n_results, shards.lookup)
+                for query, (dense_ids, sparse_ids) in zip(queries, merged)]
@@ -0,0 +1,185 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+try:
+    from langchain_community.vectorstores import FAISS
+except ImportError:
+    # Fallback cho phiên bản cũ
+    from langchain.vectorstores import FAISS
+
+from chunking import load_and_split
+from embeddings import get_embeddings
+from storage import DOCUMENT_VECTOR_DTYPE, save_store
+from telemetry import record, span
+
+# Cấu hình pipeline xử lý nhiều tài liệu
+INGEST_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+EMBED_BATCH_SIZE = 256  # Số chunk (có thể từ nhiều file) mỗi lần gọi embedding
+
+# Các giai đoạn của pipeline
+STAGE_PARSE = "parse"
+STAGE_EMBED = "embed"
+STAGE_WRITE = "write"
+
+# callback(stage, done, total) - luôn được gọi từ thread gọi ingest_documents
+ProgressCallback = Callable[[str, int, int], None]
+
+
+def _write_document(item: dict, embeddings) -> FAISS:
+    """Tạo và lưu vector store của một document từ vectors đã tính sẵn"""
+    chunks = item['chunks']
+    vector_store = FAISS.from_embeddings(
+        list(zip([c.page_content for c in chunks], item['vectors'])),
+        embeddings,
+        metadatas=[c.metadata for c in chunks],
+    )
+    save_store(vector_store, item['vector_store_path'], vector_dtype=DOCUMENT_VECTOR_DTYPE)
+    return vector_store
+
+
+def _writer_loop(write_queue: queue.Queue, embeddings, stats: dict,
+                 on_document_written: Optional[Callable[[str, FAISS], None]]):
+    """Writer duy nhất: lần lượt ghi từng vector store ra disk"""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        try:
+            start = time.perf_counter()
+            with span("ingest.write", file=os.path.basename(item['pdf_path']),
+                      chunks=len(item['chunks'])):
+                vector_store = _write_document(item, embeddings)
+                if on_document_written is not None:
+                    on_document_written(
+                        os.path.basename(item['vector_store_path']), vector_store)
+            stats['timings'][STAGE_WRITE] += time.perf_counter() - start
+            stats['written'].append(item['pdf_path'])
+        except Exception as e:
+            stats['failed'][item['pdf_path']] = f"{STAGE_WRITE}: {e}"
+
+
+def ingest_documents(jobs: List[Tuple[str, str]],
+                     workers: int = INGEST_WORKERS,
+                     batch_size: int = EMBED_BATCH_SIZE,
+                     progress_callback: Optional[ProgressCallback] = None,
+                     on_document_written: Optional[Callable[[str, FAISS], None]] = None) -> dict:
+    """Xử lý nhiều PDF theo pipeline: parse song song -> embed theo batch -> ghi
+
+    jobs: danh sách (pdf_path, vector_store_path). Parse + split chạy trong
+    process pool, chunk của nhiều file được gom thành batch cố định để
+    embedding, và một writer thread duy nhất ghi các vector store.
+    """
+    stats = {
+        'documents': len(jobs),
+        'chunks': 0,
+        'written': [],
+        'failed': {},
+        'timings': {STAGE_PARSE: 0.0, STAGE_EMBED: 0.0, STAGE_WRITE: 0.0},
+    }
+    if not jobs:
+        return stats
+
+    embeddings = get_embeddings()
+    write_queue: queue.Queue = queue.Queue()
+    writer = threading.Thread(
+        target=_writer_loop,
+        args=(write_queue, embeddings, stats, on_document_written),
+        daemon=True)
+    writer.start()
+
+    pending: Dict[str, dict] = {}      # pdf_path -> chunks, vectors, số chunk còn lại
+    buffer: List[Tuple[str, int]] = []  # (pdf_path, vị trí chunk) chờ embedding
+    progress = {STAGE_PARSE: 0, STAGE_EMBED: 0}
+
+    def report(stage: str, done: int, total: int):
+        if progress_callback is not None:
+            progress_callback(stage, done, total)
+
+    def report_written():
+        report(STAGE_WRITE, len(stats['written']) + len(stats['failed']), len(jobs))
+
+    def embed_batch(batch: List[Tuple[str, int]]):
+        start = time.perf_counter()
+        texts = [pending[path]['chunks'][pos].page_content for path, pos in batch]
+        with span("ingest.embed", chunks=len(texts)):
+            vectors = embeddings.embed_documents(texts)
+        stats['timings'][STAGE_EMBED] += time.perf_counter() - start
+
+        for (path, pos), vector in zip(batch, vectors):
+            item = pending[path]
+            item['vectors'][pos] = vector
+            item['remaining'] -= 1
+            if item['remaining'] == 0:
+                # Document đã embed xong - chuyển cho writer
+                write_queue.put(pending.pop(path))
+
+        progress[STAGE_EMBED] += len(batch)
+        report(STAGE_EMBED, progress[STAGE_EMBED], stats['chunks'])
+        report_written()
+
+    def on_parsed(pdf_path: str, vector_store_path: str, chunks: list):
+        progress[STAGE_PARSE] += 1
+        report(STAGE_PARSE, progress[STAGE_PARSE], len(jobs))
+        if not chunks:
+            stats['failed'].setdefault(pdf_path, f"{STAGE_PARSE}: không có nội dung")
+            return
+
+        stats['chunks'] += len(chunks)
+        pending[pdf_path] = {
+            'pdf_path': pdf_path,
+            'vector_store_path': vector_store_path,
+            'chunks': chunks,
+            'vectors': [None] * len(chunks),
+            'remaining': len(chunks),
+        }
+        buffer.extend((pdf_path, pos) for pos in range(len(chunks)))
+
+        while len(buffer) >= batch_size:
+            batch = buffer[:batch_size]
+            del buffer[:batch_size]
+            embed_batch(batch)
+
+    parse_start = time.perf_counter()
+    if workers <= 1:
+        # Không dùng process pool (debug hoặc máy yếu)
+        for pdf_path, vector_store_path in jobs:
+            try:
+                chunks = load_and_split(pdf_path)
+            except Exception as e:
+                stats['failed'][pdf_path] = f"{STAGE_PARSE}: {e}"
+                chunks = []
+            on_parsed(pdf_path, vector_store_path, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(load_and_split, pdf_path): (pdf_path, vector_store_path)
+                for pdf_path, vector_store_path in jobs
+            }
+            for future in as_completed(futures):
+                pdf_path, vector_store_path = futures[future]
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    stats['failed'][pdf_path] = f"{STAGE_PARSE}: {e}"
+                    chunks = []
+                on_parsed(pdf_path, vector_store_path, chunks)
+    # Thời gian parse tính cả phần embedding chạy xen kẽ, trừ lại cho đúng
+    stats['timings'][STAGE_PARSE] = (time.perf_counter() - parse_start
+                                     - stats['timings'][STAGE_EMBED])
+    record("ingest.parse", stats['timings'][STAGE_PARSE],
+           documents=len(jobs), chunks=stats['chunks'])
+
+    if buffer:
+        embed_batch(buffer[:])
+        buffer.clear()
+
+    # Chờ writer ghi xong, vẫn cập nhật tiến độ từ thread hiện tại
+    write_queue.put(None)
+    while writer.is_alive():
+        writer.join(timeout=0.2)
+        report_written()
+
+    return stats
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Optional
+
+from ingest import INGEST_WORKERS, STAGE_EMBED, STAGE_PARSE, STAGE_WRITE, ingest_documents
+from pre_doc import (
+    COMBINED_INDEX_TYPE,
+    STREAMING_MIN_SIZE_MB,
+    VECTOR_STORES_DIR,
+    add_to_combined_store,
+    delete_document,
+    discard_stale_stores,
+    get_available_documents,
+    process_all_documents,
+    process_single_document,
+    sync_combined_store,
+)
+from storage import COMBINED_VECTOR_DTYPE
+from telemetry import get_last_error
+
+# Hàng đợi job lưu trên disk: không mất khi refresh trang hay khởi động lại app
+JOBS_DB_PATH = os.path.join(VECTOR_STORES_DIR, "jobs.sqlite")
+
+# Các loại job
+JOB_INGEST = "ingest"      # Xử lý PDF chưa có vector store rồi thêm vào combined store
+JOB_REINDEX = "reindex"    # Build lại combined store (loại index, định dạng vector)
+JOB_DELETE = "delete"      # Xóa PDF, vector store riêng và vectors trong combined store
+
+# Trạng thái job
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+MAX_ATTEMPTS = 3             # Số lần chạy tối đa (kể cả lần đầu)
+RETRY_BACKOFF_S = 5.0        # Chờ 5s, 10s, ... trước khi chạy lại job lỗi
+POLL_INTERVAL_S = 1.0        # Worker kiểm tra hàng đợi khi không được đánh thức
+PROGRESS_INTERVAL_S = 0.5    # Ghi tiến độ vào DB tối đa 2 lần/giây
+
+# Thứ tự các giai đoạn ingest để quy đổi ra tiến độ chung 0..1
+_STAGES = [STAGE_PARSE, STAGE_EMBED, STAGE_WRITE]
+
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connect() -> sqlite3.Connection:
+    """Mở kết nối tới DB hàng đợi (tạo bảng nếu chưa có)"""
+    os.makedirs(VECTOR_STORES_DIR, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+        "progress REAL NOT NULL DEFAULT 0, message TEXT, error TEXT, "
+        "created_at REAL NOT NULL, available_at REAL NOT NULL, "
+        "started_at REAL, finished_at REAL)")
+    return conn
+
+
+def _row_to_job(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Thêm job vào hàng đợi, trả về ID
+
+    Job giống hệt (cùng loại, cùng payload) đang chờ thì không thêm lại.
+    """
+    payload_json = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE kind = ? AND payload = ? AND status = ?",
+            (kind, payload_json, STATUS_QUEUED)).fetchone()
+        if row is not None:
+            job_id = row['id']
+        else:
+            now = time.time()
+            job_id = conn.execute(
+                "INSERT INTO jobs (kind, payload, status, max_attempts, created_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, payload_json, STATUS_QUEUED, max_attempts, now, now)).lastrowid
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    _wakeup.set()
+    return job_id
+
+
+def claim_next() -> Optional[dict]:
+    """Lấy job cũ nhất đã tới lượt chạy và đánh dấu đang chạy"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? AND available_at <= ? ORDER BY id LIMIT 1",
+            (STATUS_QUEUED, now)).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, progress = 0, "
+            "message = NULL, started_at = ?, finished_at = NULL WHERE id = ?",
+            (STATUS_RUNNING, now, row['id']))
+        conn.execute("COMMIT")
+        job = _row_to_job(row)
+        job.update(status=STATUS_RUNNING, attempts=job['attempts'] + 1, started_at=now)
+        return job
+    finally:
+        conn.close()
+
+
+def update_progress(job_id: int, progress: float, message: Optional[str] = None):
+    """Cập nhật tiến độ (0..1) và mô tả giai đoạn của job đang chạy"""
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                     (min(1.0, max(0.0, progress)), message, job_id))
+    finally:
+        conn.close()
+
+
+def complete(job_id: int, message: Optional[str] = None):
+    """Đánh dấu job chạy xong"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, progress = 1, message = ?, error = NULL, "
+            "finished_at = ? WHERE id = ?",
+            (STATUS_DONE, message, time.time(), job_id))
+    finally:
+        conn.close()
+
+
+def fail(job_id: int, error: str):
+    """Ghi lỗi của job: còn lượt thì đưa lại vào hàng đợi (chờ backoff), hết lượt thì failed"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?",
+                           (job_id,)).fetchone()
+        now = time.time()
+        if row is not None and row['attempts'] < row['max_attempts']:
+            delay = RETRY_BACKOFF_S * (2 ** (row['attempts'] - 1))
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ? WHERE id = ?",
+                (STATUS_QUEUED, error, now + delay, job_id))
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (STATUS_FAILED, error, now, job_id))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def retry_job(job_id: int):
+    """Chạy lại job đã thất bại (đặt lại số lần thử)"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = 0, progress = 0, available_at = ?, "
+            "finished_at = NULL WHERE id = ? AND status = ?",
+            (STATUS_QUEUED, time.time(), job_id, STATUS_FAILED))
+    finally:
+        conn.close()
+    _wakeup.set()
+
+
+def clear_finished():
+    """Xóa các job đã xong hoặc thất bại khỏi danh sách"""
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?)", (STATUS_DONE, STATUS_FAILED))
+    finally:
+        conn.close()
+
+
+def list_jobs(limit: int = 20) -> List[dict]:
+    """Các job gần nhất (mới nhất trước)"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_job(row) for row in rows]
+
+
+def has_active_jobs() -> bool:
+    """Còn job đang chờ hoặc đang chạy không"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                           (STATUS_QUEUED, STATUS_RUNNING)).fetchone()
+    finally:
+        conn.close()
+    return row[0] > 0
+
+
+def _requeue_interrupted():
+    """Job đang chạy khi app bị tắt được đưa lại vào hàng đợi (tính là một lần thử)"""
+    conn = _connect()
+    try:
+        for row in conn.execute("SELECT id FROM jobs WHERE status = ?",
+                                (STATUS_RUNNING,)).fetchall():
+            fail(row['id'], "Bị gián đoạn (app khởi động lại)")
+    finally:
+        conn.close()
+
+
+class _ProgressReporter:
+    """Quy đổi tiến độ từng giai đoạn ingest ra tiến độ chung và ghi định kỳ vào DB"""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.last_write = 0.0
+
+    def __call__(self, stage: str, done: int, total: int):
+        now = time.monotonic()
+        if now - self.last_write < PROGRESS_INTERVAL_S and done < total:
+            return
+        self.last_write = now
+        fraction = done / total if total else 1.0
+        progress = (_STAGES.index(stage) + fraction) / len(_STAGES) if stage in _STAGES else fraction
+        update_progress(self.job_id, progress, f"{stage}: {done}/{total}")
+
+
+def _run_ingest(job: dict) -> str:
+    """Xử lý các PDF trong payload chưa có vector store (file đã xử lý ở lần thử trước được bỏ qua)"""
+    paths = set(job['payload']['paths'])
+    documents = [doc for doc in get_available_documents()
+                 if doc['path'] in paths and not doc['has_vector_store']
+                 and not doc['legacy_format']]
+    # Store tạo bằng model embedding khác được xóa rồi embed lại
+    discard_stale_stores(documents)
+
+    failed = {}
+    for doc in documents:
+        if doc['size_mb'] >= STREAMING_MIN_SIZE_MB:
+            # File rất lớn đi đường streaming (từng batch chunk)
+            update_progress(job['id'], 0.0, f"streaming: {doc['filename']}")
+            if process_single_document(doc['path']) is None:
+                failed[doc['path']] = get_last_error("ingest.document") or "không thể xử lý"
+
+    jobs = [(doc['path'], doc['vector_store_path'])
+            for doc in documents if doc['size_mb'] < STREAMING_MIN_SIZE_MB]
+    stats = ingest_documents(
+        jobs,
+        workers=job['payload'].get('workers', INGEST_WORKERS),
+        progress_callback=_ProgressReporter(job['id']),
+        on_document_written=add_to_combined_store)
+    failed.update(stats['failed'])
+
+    # Đảm bảo combined store khớp với danh sách tài liệu (vd. file bị ghi đè)
+    sync_combined_store(get_available_documents())
+    if failed:
+        raise RuntimeError("; ".join(f"{os.path.basename(path)}: {error}"
+                                     for path, error in failed.items()))
+    return f"{len(documents)} file, {stats['chunks']} chunk"
+
+
+def _run_reindex(job: dict) -> str:
+    """Build lại combined store với loại index và định dạng vector đã chọn"""
+    payload = job['payload']
+    combined_store = process_all_documents(
+        rebuild=True,
+        workers=payload.get('workers', INGEST_WORKERS),
+        progress_callback=_ProgressReporter(job['id']),
+        index_type=payload.get('index_type', COMBINED_INDEX_TYPE),
+        vector_dtype=payload.get('vector_dtype', COMBINED_VECTOR_DTYPE))
+    if combined_store is None and get_available_documents():
+        raise RuntimeError("Không thể rebuild combined store")
+    return f"{combined_store.index.ntotal if combined_store else 0} vectors"
+
+
+def _run_delete(job: dict) -> str:
+    """Xóa một tài liệu (job lặp lại sau khi đã xóa xong thì không làm gì)"""
+    path = job['payload']['path']
+    for doc in get_available_documents():
+        if doc['path'] == path:
+            delete_document(doc)
+            break
+    # Chạy lại lần xóa khỏi combined store nếu lần trên lỗi
+    sync_combined_store(get_available_documents())
+    return os.path.basename(path)
+
+
+_HANDLERS = {
+    JOB_INGEST: _run_ingest,
+    JOB_REINDEX: _run_reindex,
+    JOB_DELETE: _run_delete,
+}
+
+
+def run_job(job: dict):
+    """Chạy một job đã claim; lỗi thì ghi lại để thử lại sau"""
+    try:
+        message = _HANDLERS[job['kind']](job)
+    except Exception as e:
+        fail(job['id'], str(e) or type(e).__name__)
+    else:
+        complete(job['id'], message)
+
+
+def _worker_loop():
+    """Lần lượt chạy các job trong hàng đợi (mỗi lúc một job)
+
+    Parse PDF chạy trong process pool của ingest; combined store mới chỉ được
+    đưa vào phục vụ truy vấn khi đã ghi xong (thay nguyên khối).
+    """
+    # Chờ warm-up load xong index để không xử lý trùng tài liệu lúc khởi động
+    from warmup import wait_until_warm
+    wait_until_warm()
+
+    while True:
+        job = claim_next()
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL_S)
+            _wakeup.clear()
+            continue
+        run_job(job)
+
+
+def start_worker() -> bool:
+    """Chạy worker nền trong process của app (chỉ lần gọi đầu tiên có tác dụng)
+
+    Trả về True nếu lần gọi này khởi động thread.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return False
+        _requeue_interrupted()
+        _thread = threading.Thread(target=_worker_loop, name="job-worker", daemon=True)
+        _thread.start()
+        return True
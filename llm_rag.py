@@ -1,89 +1,385 @@
 import os
+import time
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-from langchain.chains import RetrievalQA
-from langchain.llms import OpenAI
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-except ImportError:
-    print("⚠️ langchain-google-genai not installed. Install with: pip install langchain-google-genai")
-    ChatGoogleGenerativeAI = None
 
-from pre_doc import vector_store
+from answer_cache import AnswerCache
+from context_builder import build_context, estimate_tokens
+from embeddings import get_embeddings
+from pre_doc import VECTOR_STORES_DIR, get_index_version, get_live_index, get_shards
+from shards import SEARCH_MODE, SEARCH_SHARDED
+from telemetry import new_trace_id, record, span
 
 # Load environment variables
 load_dotenv('config.env')
 
+# Cache câu trả lời lưu trên disk, dùng chung cho mọi phiên
+ANSWER_CACHE_PATH = os.path.join(VECTOR_STORES_DIR, "answer_cache.sqlite")
 
-def create_qa_chain(model_type="openai"):
-    """Tạo QA chain với các API model khác nhau"""
-
-    if model_type == "openai":
-        # Sử dụng OpenAI API
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key or api_key == 'your_openai_api_key_here':
-            raise ValueError(
-                "Vui lòng cấu hình OPENAI_API_KEY trong file config.env")
-
-        llm = OpenAI(
-            temperature=0.7,
-            openai_api_key=api_key,
-            max_tokens=500
-        )
-
-    elif model_type == "gemini":
-        # Sử dụng Gemini API
-        if ChatGoogleGenerativeAI is None:
-            raise ImportError(
-                "Cần cài đặt: pip install langchain-google-genai")
-
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key or api_key == 'your_gemini_api_key_here':
-            raise ValueError(
-                "Vui lòng cấu hình GEMINI_API_KEY trong file config.env")
-
-        # Thử các model Gemini theo thứ tự ưu tiên
-        gemini_models = [
-            "gemini-2.0-flash-exp",
-            "gemini-1.5-flash",
-            "gemini-1.5-pro",
-            "gemini-pro"
-        ]
-
-        llm = None
-        last_error = None
-
-        for model_name in gemini_models:
-            try:
-                llm = ChatGoogleGenerativeAI(
-                    model=model_name,
-                    google_api_key=api_key,
-                    temperature=0.7,
-                    convert_system_message_to_human=True
-                )
-                break
-            except Exception as e:
-                last_error = e
-                continue
-
-        if llm is None:
-            raise ValueError(
-                f"❌ Không thể khởi tạo bất kỳ model Gemini nào. Lỗi cuối: {last_error}")
-
-    else:
+# Các sự kiện của stream_answer
+EVENT_SOURCES = "sources"
+EVENT_TOKEN = "token"
+EVENT_DONE = "done"
+
+# LLM giả (không gọi mạng) để benchmark/kiểm thử: trả lời cố định sau độ trễ giả lập
+FAKE_LLM_RESPONSE = os.getenv(
+    'FAKE_LLM_RESPONSE', "Đây là câu trả lời giả lập dựa trên các tài liệu được cung cấp.")
+FAKE_LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '200'))
+
+_answer_cache = None
+
+# Pool QA chain dùng chung: provider -> {'key': (provider, model, index_version), 'llm', 'chain'}
+_chain_pool: Dict[str, dict] = {}
+_chain_pool_lock = threading.Lock()
+# Model đã khởi tạo thành công của từng provider (Gemini thử nhiều model)
+_working_models: Dict[str, str] = {}
+
+
+def _create_openai_llm() -> Tuple[object, str]:
+    """OpenAI (completion model)"""
+    # Sử dụng OpenAI API
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key or api_key == 'your_openai_api_key_here':
+        raise ValueError(
+            "Vui lòng cấu hình OPENAI_API_KEY trong file config.env")
+
+    from langchain.llms import OpenAI
+
+    llm = OpenAI(
+        temperature=0.7,
+        openai_api_key=api_key,
+        max_tokens=500
+    )
+    return llm, llm.model_name
+
+
+def _create_gemini_llm() -> Tuple[object, str]:
+    """Google Gemini, thử lần lượt các model"""
+    # Sử dụng Gemini API
+    try:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+    except ImportError:
+        raise ImportError(
+            "Cần cài đặt: pip install langchain-google-genai")
+
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key or api_key == 'your_gemini_api_key_here':
+        raise ValueError(
+            "Vui lòng cấu hình GEMINI_API_KEY trong file config.env")
+
+    # Thử các model Gemini theo thứ tự ưu tiên, model đã thành công lần trước thử đầu tiên
+    gemini_models = [
+        "gemini-2.0-flash-exp",
+        "gemini-1.5-flash",
+        "gemini-1.5-pro",
+        "gemini-pro"
+    ]
+    working_model = _working_models.get("gemini")
+    if working_model in gemini_models:
+        gemini_models.remove(working_model)
+        gemini_models.insert(0, working_model)
+
+    last_error = None
+
+    for model_name in gemini_models:
+        try:
+            llm = ChatGoogleGenerativeAI(
+                model=model_name,
+                google_api_key=api_key,
+                temperature=0.7,
+                convert_system_message_to_human=True
+            )
+            _working_models["gemini"] = model_name
+            return llm, model_name
+        except Exception as e:
+            last_error = e
+            continue
+
+    raise ValueError(
+        f"❌ Không thể khởi tạo bất kỳ model Gemini nào. Lỗi cuối: {last_error}")
+
+
+def _create_fake_llm() -> Tuple[object, str]:
+    """LLM giả lập: stream FAKE_LLM_RESPONSE trong khoảng FAKE_LLM_LATENCY_MS, không cần mạng"""
+    from langchain_community.llms.fake import FakeStreamingListLLM
+
+    llm = FakeStreamingListLLM(
+        responses=[FAKE_LLM_RESPONSE],
+        sleep=FAKE_LLM_LATENCY_MS / 1000 / max(1, len(FAKE_LLM_RESPONSE)))
+    return llm, "fake"
+
+
+# Các backend LLM: provider -> hàm tạo (llm, tên model)
+_llm_backends: Dict[str, Callable[[], Tuple[object, str]]] = {
+    "openai": _create_openai_llm,
+    "gemini": _create_gemini_llm,
+    "fake": _create_fake_llm,
+}
+
+
+def register_llm_backend(model_type: str, factory: Callable[[], Tuple[object, str]]):
+    """Thêm (hoặc thay) backend LLM; factory trả về (llm, tên model)"""
+    with _chain_pool_lock:
+        _llm_backends[model_type] = factory
+        _chain_pool.pop(model_type, None)
+
+
+def get_llm_backends() -> List[str]:
+    """Tên các backend LLM đang hỗ trợ"""
+    return list(_llm_backends)
+
+
+def _create_llm(model_type: str) -> Tuple[object, str]:
+    """Tạo LLM client theo provider, trả về (llm, tên model)
+
+    Thư viện của từng provider chỉ được import khi tạo client.
+    """
+    factory = _llm_backends.get(model_type)
+    if factory is None:
+        raise ValueError(
+            f"Model type '{model_type}' không được hỗ trợ. Chọn: {', '.join(_llm_backends)}")
+    return factory()
+
+
+def create_qa_chain(model_type="openai", llm=None):
+    """Tạo QA chain với các API model khác nhau (truyền llm để dùng lại client có sẵn)"""
+
+    if llm is None:
+        llm, _ = _create_llm(model_type)
+
+    # Retriever lấy cặp (vector store, BM25) hoặc danh sách shard đang phục
+    # vụ ở mỗi truy vấn nên thấy ngay index mới khi job nền thay index
+    sharded = SEARCH_MODE == SEARCH_SHARDED
+    has_index = len(get_shards()) > 0 if sharded else get_live_index()[0] is not None
+    if not has_index:
         raise ValueError(
-            f"Model type '{model_type}' không được hỗ trợ. Chọn: 'openai' hoặc 'gemini'")
+            "Chưa có vector store nào. Vui lòng upload và xử lý tài liệu PDF")
 
     # Tạo QA chain
+    from langchain.chains import RetrievalQA
+    from hybrid_retriever import RETRIEVAL_K, HybridRetriever
+    from reranker import RERANK_ENABLED, RERANK_TOP_N
+
+    # Dense + BM25 gộp bằng RRF: ít chunk hơn nhưng sát câu hỏi hơn;
+    # bật rerank thì cross-encoder chọn lại top-N từ nhiều ứng viên hơn
+    retriever = HybridRetriever(
+        index_getter=get_live_index,
+        shard_getter=get_shards,
+        sharded=sharded,
+        k=RERANK_TOP_N if RERANK_ENABLED else RETRIEVAL_K,
+        rerank=RERANK_ENABLED)
+
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=vector_store.as_retriever(search_kwargs={"k": 10}),
+        retriever=retriever,
         return_source_documents=True
     )
 
     return qa_chain
 
 
+def get_qa_chain(model_type: str):
+    """Lấy QA chain từ pool dùng chung cho mọi phiên
+
+    Pool giữ một chain cho mỗi provider, key (provider, model, phiên bản
+    index). LLM client được tạo một lần; chain chỉ tạo lại khi index thay
+    đổi (thêm/xóa tài liệu, rebuild).
+    """
+    index_version = get_index_version()
+    with _chain_pool_lock:
+        entry = _chain_pool.get(model_type)
+        if entry is not None and entry['key'][2] == index_version:
+            return entry['chain']
+
+        if entry is not None:
+            llm, model_name = entry['llm'], entry['key'][1]
+        else:
+            llm, model_name = _create_llm(model_type)
+
+        chain = create_qa_chain(model_type, llm=llm)
+        _chain_pool[model_type] = {
+            'key': (model_type, model_name, index_version),
+            'llm': llm,
+            'chain': chain,
+        }
+        return chain
+
+
+def get_chain_pool_info() -> List[dict]:
+    """Các chain đang có trong pool (provider, model, phiên bản index)"""
+    with _chain_pool_lock:
+        return [dict(zip(('provider', 'model', 'index_version'), entry['key']))
+                for entry in _chain_pool.values()]
+
+
+def get_answer_cache() -> AnswerCache:
+    """Cache câu trả lời dùng chung (tạo khi cần lần đầu)"""
+    global _answer_cache
+    if _answer_cache is None:
+        os.makedirs(VECTOR_STORES_DIR, exist_ok=True)
+        _answer_cache = AnswerCache(ANSWER_CACHE_PATH)
+    return _answer_cache
+
+
+def _stream_llm(qa_chain, query: str, source_docs: List, context_stats: dict) -> Iterator[str]:
+    """Ghép prompt giống StuffDocumentsChain rồi stream từng đoạn text từ LLM
+
+    Ghi số token của prompt vào context_stats['prompt_tokens'].
+    """
+    combine_chain = qa_chain.combine_documents_chain
+    inputs = combine_chain._get_inputs(source_docs, question=query)
+    prompt = combine_chain.llm_chain.prompt.format_prompt(**inputs)
+    context_stats['prompt_tokens'] = estimate_tokens(prompt.to_string())
+
+    for chunk in combine_chain.llm_chain.llm.stream(prompt):
+        # OpenAI (LLM) trả về str, Gemini (chat model) trả về AIMessageChunk
+        text = getattr(chunk, 'content', chunk)
+        if text:
+            yield text
+
+
+def stream_answer(qa_chain, query: str, model_type: str, use_cache: bool = True,
+                  source_files: Optional[List[str]] = None) -> Iterator[Tuple[str, object]]:
+    """Trả lời câu hỏi dạng streaming, trả về dần các sự kiện (event, payload)
+
+    - EVENT_SOURCES: danh sách Document ngay khi retrieval xong
+    - EVENT_TOKEN: từng đoạn text do LLM sinh ra
+    - EVENT_DONE: thời gian từng giai đoạn (retrieval, first_token, total),
+      trạng thái cache, thống kê context (số chunk, prompt tokens) và trace_id
+
+    Retrieval và prompt dùng lại retriever/prompt của RetrievalQA, chỉ phần
+    gọi LLM chuyển sang llm.stream(). Câu trả lời được tra/ghi qua cache như
+    answer_query (use_cache=False để bỏ qua cache, vd. khi benchmark).
+    source_files: chỉ tìm trong các file này (None: tất cả tài liệu).
+
+    Mỗi giai đoạn được ghi vào telemetry với cùng trace_id; span không bao
+    quanh yield vì các bước của generator có thể chạy ở các thread khác nhau.
+    """
+    start = time.perf_counter()
+    trace_id = new_trace_id()
+    cache = get_answer_cache()
+    index_version = get_index_version()
+    with span("query.embed", trace_id):
+        query_embedding = get_embeddings().embed_query(query)
+
+    cached = None
+    if use_cache:
+        with span("query.cache_lookup", trace_id) as lookup_span:
+            cached = cache.lookup(query, model_type, index_version, query_embedding,
+                                  source_files)
+            lookup_span.set(hits=int(cached is not None))
+    if cached is not None:
+        yield EVENT_SOURCES, cached['source_documents']
+        elapsed = time.perf_counter() - start
+        yield EVENT_TOKEN, cached['answer']
+        record("query", elapsed, trace_id=trace_id, model=model_type, cached=cached['match'])
+        yield EVENT_DONE, {'retrieval_s': 0.0, 'first_token_s': elapsed, 'total_s': elapsed,
+                           'cached': cached['match'], 'context': None, 'trace_id': trace_id}
+        return
+
+    # Retrieval (embedding câu hỏi đã nằm trong cache LRU), rồi gộp chunk
+    # liền kề/trùng lặp và xếp vào ngân sách token của model
+    with span("query.retrieve", trace_id) as retrieve_span:
+        if source_files:
+            retrieved_docs = qa_chain.retriever.retrieve_batch(
+                [query], [query_embedding], source_files)[0]
+        else:
+            retrieved_docs = qa_chain.retriever.get_relevant_documents(query)
+        retrieve_span.set(chunks=len(retrieved_docs))
+    with span("query.context", trace_id) as context_span:
+        source_docs, context_stats = build_context(retrieved_docs, model_type)
+        context_span.set(chunks=context_stats['context_chunks'],
+                         context_tokens=context_stats['context_tokens'])
+    retrieval_s = time.perf_counter() - start
+    yield EVENT_SOURCES, source_docs
+
+    parts = []
+    first_token_s = None
+    llm_start = time.perf_counter()
+    try:
+        for text in _stream_llm(qa_chain, query, source_docs, context_stats):
+            if first_token_s is None:
+                first_token_s = time.perf_counter() - start
+                record("query.first_token", time.perf_counter() - llm_start,
+                       trace_id=trace_id, model=model_type)
+            parts.append(text)
+            yield EVENT_TOKEN, text
+    except Exception as e:
+        record("query.llm", time.perf_counter() - llm_start, error=e,
+               trace_id=trace_id, model=model_type)
+        raise
+
+    response = "".join(parts) or 'Không tìm thấy thông tin phù hợp.'
+    record("query.llm", time.perf_counter() - llm_start, trace_id=trace_id, model=model_type,
+           prompt_tokens=context_stats.get('prompt_tokens', 0),
+           output_tokens=estimate_tokens(response))
+    if not parts:
+        yield EVENT_TOKEN, response
+    total_s = time.perf_counter() - start
+
+    if use_cache:
+        cache.store(query, model_type, index_version, response, source_docs, query_embedding,
+                    source_files)
+    record("query", total_s, trace_id=trace_id, model=model_type)
+    yield EVENT_DONE, {'retrieval_s': retrieval_s,
+                       'first_token_s': first_token_s if first_token_s is not None else total_s,
+                       'total_s': total_s, 'cached': None, 'context': context_stats,
+                       'trace_id': trace_id}
+
+
+def answer_query(qa_chain, query: str, model_type: str, use_cache: bool = True,
+                 source_files: Optional[List[str]] = None) -> dict:
+    """Trả lời câu hỏi (không streaming) qua cache rồi mới tới QA chain
+
+    Key cache gồm câu hỏi (hoặc câu hỏi gần trùng theo embedding), model và
+    phiên bản index, nên câu trả lời cũ tự mất hiệu lực khi tài liệu thay đổi.
+    Embedding của câu hỏi được cache LRU nên retriever không phải tính lại.
+    """
+    result = {'result': '', 'source_documents': [], 'cached': None, 'timings': {},
+              'context': None, 'trace_id': None}
+    for event, payload in stream_answer(qa_chain, query, model_type, use_cache, source_files):
+        if event == EVENT_SOURCES:
+            result['source_documents'] = payload
+        elif event == EVENT_TOKEN:
+            result['result'] += payload
+        else:
+            result['cached'] = payload.pop('cached')
+            result['context'] = payload.pop('context')
+            result['trace_id'] = payload.pop('trace_id')
+            result['timings'] = payload
+    return result
+
+
+def answer_from_documents(qa_chain, query: str, model_type: str, retrieved_docs: List,
+                          query_embedding: Optional[List[float]] = None,
+                          use_cache: bool = True) -> dict:
+    """Trả lời từ các chunk đã tìm sẵn (vd. tìm kiếm theo batch), bỏ qua bước retrieval
+
+    Gộp context và gọi LLM như stream_answer; câu trả lời được ghi vào cache
+    khi có query_embedding.
+    """
+    start = time.perf_counter()
+    trace_id = new_trace_id()
+    index_version = get_index_version()
+    with span("query.context", trace_id) as context_span:
+        source_docs, context_stats = build_context(retrieved_docs, model_type)
+        context_span.set(chunks=context_stats['context_chunks'],
+                         context_tokens=context_stats['context_tokens'])
+    with span("query.llm", trace_id, model=model_type) as llm_span:
+        response = "".join(_stream_llm(qa_chain, query, source_docs, context_stats))
+        llm_span.set(prompt_tokens=context_stats.get('prompt_tokens', 0),
+                     output_tokens=estimate_tokens(response))
+    response = response or 'Không tìm thấy thông tin phù hợp.'
+
+    if use_cache and query_embedding is not None:
+        get_answer_cache().store(query, model_type, index_version, response,
+                                 source_docs, query_embedding)
+    return {'result': response, 'source_documents': source_docs, 'context': context_stats,
+            'timings': {'llm_s': time.perf_counter() - start}}
+
+
 def initialize_default_chain():
     """Khởi tạo chain mặc định, thử OpenAI trước, nếu không có thì Gemini"""
 
@@ -91,7 +387,7 @@ def initialize_default_chain():
     try:
         gemini_key = os.getenv('GEMINI_API_KEY')
         if gemini_key and gemini_key != 'your_gemini_api_key_here':
-            return create_qa_chain("gemini")
+            return get_qa_chain("gemini")
     except Exception as e:
         pass
 
@@ -99,16 +395,10 @@ def initialize_default_chain():
     try:
         openai_key = os.getenv('OPENAI_API_KEY')
         if openai_key and openai_key != 'your_openai_api_key_here':
-            return create_qa_chain("openai")
+            return get_qa_chain("openai")
     except Exception as e:
         pass
 
     raise ValueError(
         "❌ Không có API key hợp lệ. Vui lòng cấu hình OPENAI_API_KEY hoặc GEMINI_API_KEY")
 
-
-# Khởi tạo qa_chain mặc định
-try:
-    qa_chain = initialize_default_chain()
-except Exception as e:
-    qa_chain = None
@@ -0,0 +1,49 @@
+"""Chuyển các vector store định dạng pickle cũ (index.pkl) sang định dạng mới
+
+Cách dùng:
+    python migrate_stores.py                  # migrate mọi store trong vector_stores/
+    python migrate_stores.py --dry-run        # chỉ liệt kê các store cần migrate
+    python migrate_stores.py --keep-pickle    # giữ lại index.pkl sau khi migrate
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embeddings import get_embeddings
+from storage import migrate_vector_stores
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate vector stores pickle sang định dạng SQLite + numpy")
+    parser.add_argument("--dir", default="vector_stores",
+                        help="Thư mục chứa các vector store (mặc định: vector_stores)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Chỉ liệt kê, không thay đổi gì")
+    parser.add_argument("--keep-pickle", action="store_true",
+                        help="Giữ lại index.pkl sau khi migrate")
+    args = parser.parse_args()
+
+    # Dry run không cần load model embedding
+    embeddings = None if args.dry_run else get_embeddings()
+    results = migrate_vector_stores(
+        args.dir, embeddings, keep_pickle=args.keep_pickle, dry_run=args.dry_run)
+
+    if not results:
+        print("✅ Không có vector store nào cần migrate")
+        return 0
+
+    failed = 0
+    for name, status in results:
+        print(f"📦 {name}: {status}")
+        failed += status.startswith("Lỗi")
+
+    # Combined store sẽ được đồng bộ lại ở lần khởi động app tiếp theo
+    print(f"\n{'❌' if failed else '✅'} {len(results) - failed}/{len(results)} store đã xử lý")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import os
+import threading
+from typing import List
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ONNX_OPSET = 14
+
+
+def _hub_name(model_name: str) -> str:
+    """Tên trên HuggingFace Hub (tên ngắn kiểu sentence-transformers được thêm namespace)"""
+    return model_name if '/' in model_name or os.path.isdir(model_name) \
+        else f"sentence-transformers/{model_name}"
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = True) -> str:
+    """Export model transformer sang ONNX (kèm tokenizer), lượng tử hóa int8 động nếu quantize
+
+    Chỉ cần torch + transformers khi export; lần sau chỉ load file .onnx.
+    Trả về đường dẫn file model dùng để chạy.
+    """
+    model_file = os.path.join(output_dir, ONNX_INT8_MODEL_FILE if quantize else ONNX_MODEL_FILE)
+    if os.path.exists(model_file):
+        return model_file
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_file = os.path.join(output_dir, ONNX_MODEL_FILE)
+    if not os.path.exists(fp32_file):
+        tokenizer = AutoTokenizer.from_pretrained(_hub_name(model_name))
+        model = AutoModel.from_pretrained(_hub_name(model_name)).eval()
+        sample = tokenizer(["xin chào"], return_tensors="pt")
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids')
+                       if name in sample]
+        axes = {0: 'batch', 1: 'sequence'}
+        tmp_file = f"{fp32_file}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in input_names), tmp_file,
+                input_names=input_names, output_names=['last_hidden_state'],
+                dynamic_axes={**{name: axes for name in input_names}, 'last_hidden_state': axes},
+                opset_version=ONNX_OPSET)
+        tokenizer.save_pretrained(output_dir)
+        os.replace(tmp_file, fp32_file)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_file = f"{model_file}.tmp"
+        quantize_dynamic(fp32_file, tmp_file, weight_type=QuantType.QInt8)
+        os.replace(tmp_file, model_file)
+    return model_file
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embedding chạy bằng ONNX Runtime trên CPU
+
+    Mean pooling theo attention mask rồi chuẩn hóa L2, giống pipeline
+    sentence-transformers của các model MiniLM/mpnet.
+    """
+
+    def __init__(self, model_file: str, batch_size: int = 32, threads: int = 0,
+                 max_seq_length: int = 256):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_file, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(model_file))
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self._tokenizer_lock = threading.Lock()  # Tokenizer nhanh không an toàn khi dùng chung thread
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(texts, padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors="np")
+        inputs = {name: encoded[name].astype(np.int64)
+                  for name in self.input_names if name in encoded}
+        if 'token_type_ids' in self.input_names and 'token_type_ids' not in inputs:
+            inputs['token_type_ids'] = np.zeros_like(inputs['input_ids'])
+        hidden = self.session.run(None, inputs)[0]
+
+        mask = encoded['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Gom các đoạn dài gần bằng nhau vào cùng batch để ít padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            batch = self._embed([texts[i] for i in positions])
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[positions] = batch
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # Câu hỏi và chunk đi qua cùng pipeline nên embed theo batch được
+        return self.embed_documents(texts)
@@ -1,24 +1,99 @@
 import os
+import json
 import hashlib
 import glob
-from typing import List, Optional
+import shutil
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
 try:
-    from langchain_community.document_loaders import PyPDFLoader
     from langchain_community.vectorstores import FAISS
-    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from langchain_community.vectorstores.faiss import dependable_faiss_import
+    from langchain_community.docstore.in_memory import InMemoryDocstore
 except ImportError:
     # Fallback cho phiên bản cũ
-    from langchain.document_loaders import PyPDFLoader
     from langchain.vectorstores import FAISS
-    from langchain.embeddings import HuggingFaceEmbeddings
+    from langchain.vectorstores.faiss import dependable_faiss_import
+    from langchain.docstore.in_memory import InMemoryDocstore
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
+from chunking import iter_chunk_batches
+from dedup import NEAR_DEDUP_ENABLED, DedupIndex, minhash_signature
+from embeddings import LEGACY_EMBEDDING_TAG, get_embedding_tag, get_embeddings
+from faiss_index import (
+    INDEX_AUTO,
+    INDEX_FLAT,
+    VECTOR_FLOAT32,
+    RescoringIndex,
+    apply_search_params,
+    build_index,
+    choose_index_type,
+    collect_vectors,
+    get_index_params,
+    get_index_type,
+    quantization_report,
+    recall_report,
+    supports_remove,
+)
+from shards import SEARCH_MODE, SEARCH_SHARDED, ShardSet
+from sparse_index import BM25Index, SparseIndex
+from storage import (
+    COMBINED_VECTOR_DTYPE,
+    DOCUMENT_VECTOR_DTYPE,
+    build_sparse_index,
+    get_store_embedding,
+    has_mmap_layout,
+    is_legacy_store,
+    load_sparse_index,
+    load_store,
+    migrate_vector_stores,
+    save_sparse_index,
+    save_store,
+)
+from ingest import EMBED_BATCH_SIZE, INGEST_WORKERS, ProgressCallback, ingest_documents
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
 # Cấu hình thư mục
 DOCUMENTS_DIR = "documents"
 VECTOR_STORES_DIR = "vector_stores"
 
+# Manifest lưu hash của từng file PDF (key: path, kiểm tra bằng size + mtime)
+MANIFEST_PATH = os.path.join(VECTOR_STORES_DIR, "documents_manifest.json")
+HASH_CHUNK_SIZE = 1024 * 1024  # Đọc file theo từng khối 1MB khi hash
+
+# File lớn hơn ngưỡng này được xử lý streaming từng trang thay vì qua process pool
+STREAMING_MIN_SIZE_MB = 50
+
+_manifest_lock = threading.Lock()
+
+# Combined store được lưu sẵn, kèm manifest các document (và IDs) đã chứa
+COMBINED_STORE_DIR = os.path.join(VECTOR_STORES_DIR, "_combined")
+COMBINED_MANIFEST_FILE = "combined_manifest.json"
+DEDUP_INDEX_FILE = "dedup_index.npz"  # Hash + chữ ký MinHash của các chunk trong combined store
+
+# Thêm/xóa/build làm trên bản sao rồi mới đưa vào phục vụ (_publish), nên
+# truy vấn đang chạy không bao giờ thấy combined store đang sửa dở
+_combined_lock = threading.RLock()  # Mỗi lúc chỉ một thao tác ghi combined store
+_combined_store: Optional[FAISS] = None
+_combined_documents: Dict[str, dict] = {}
+_combined_index_info: dict = {}
+_combined_dedup: Optional[DedupIndex] = None  # Chunk trùng giữa các document chỉ lưu một lần
+_live_index: Tuple[Optional[FAISS], Optional[SparseIndex]] = (None, None)  # Cặp đang phục vụ truy vấn
+# Vector store riêng của từng document dùng làm shard: tìm trong một số file
+# được chọn, hoặc mọi truy vấn khi SEARCH_MODE=sharded (không dùng combined store)
+_shards = ShardSet(lambda store_key: _load_shard(store_key))
+
+# Vector store mặc định, chỉ load khi cần lần đầu (không load lúc import)
+_default_store: Optional[FAISS] = None
+_default_store_loaded = False
+_default_store_lock = threading.Lock()
+
+# Loại index của combined store: 'auto' chọn theo kích thước corpus
+COMBINED_INDEX_TYPE = INDEX_AUTO
+
 
 def create_directories():
     """Tạo các thư mục cần thiết"""
@@ -27,27 +102,102 @@ def create_directories():
 
 
 def get_file_hash(file_path: str) -> str:
-    """Tạo hash để identify file duy nhất"""
+    """Tạo hash để identify file duy nhất (đọc theo từng khối, không load cả file)"""
+    md5 = hashlib.md5()
     with open(file_path, 'rb') as f:
-        file_hash = hashlib.md5(f.read()).hexdigest()
-    return file_hash[:8]  # Lấy 8 ký tự đầu
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()[:8]  # Lấy 8 ký tự đầu
+
+
+def _load_manifest() -> Dict[str, dict]:
+    """Đọc manifest từ disk, trả về dict rỗng nếu chưa có hoặc bị hỏng"""
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest: Dict[str, dict]):
+    """Ghi manifest ra disk (ghi file tạm rồi rename để tránh file dở dang)"""
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = f"{MANIFEST_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _manifest_entry(file_path: str, manifest: Dict[str, dict]) -> dict:
+    """Lấy entry của file từ manifest, chỉ hash lại khi size/mtime thay đổi"""
+    stat = os.stat(file_path)
+    key = os.path.normpath(file_path)
+    entry = manifest.get(key)
+    if (entry is None or entry.get('size') != stat.st_size
+            or entry.get('mtime_ns') != stat.st_mtime_ns):
+        entry = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': get_file_hash(file_path),
+        }
+        manifest[key] = entry
+    return entry
+
+
+def get_cached_file_hash(file_path: str) -> str:
+    """Lấy hash của file qua manifest (chỉ hash lại nếu file đã thay đổi)"""
+    with _manifest_lock:
+        manifest = _load_manifest()
+        before = dict(manifest)
+        entry = _manifest_entry(file_path, manifest)
+        if manifest != before:
+            _save_manifest(manifest)
+    return entry['hash']
 
 
 def get_available_documents() -> List[dict]:
-    """Lấy danh sách tất cả documents có sẵn"""
+    """Lấy danh sách tất cả documents có sẵn
+
+    Chỉ stat các file PDF và tra manifest; file nào thay đổi (size/mtime)
+    mới được hash lại, nên có thể gọi nhiều lần trong mỗi lần rerun.
+    """
     create_directories()
     documents = []
 
-    pdf_files = glob.glob(os.path.join(DOCUMENTS_DIR, "*.pdf"))
-    for pdf_file in pdf_files:
+    pdf_files = sorted(glob.glob(os.path.join(DOCUMENTS_DIR, "*.pdf")))
+
+    with _manifest_lock:
+        manifest = _load_manifest()
+        before = dict(manifest)
+        entries = {}
+        for pdf_file in pdf_files:
+            try:
+                entries[pdf_file] = _manifest_entry(pdf_file, manifest)
+            except OSError:
+                # File bị xóa trong lúc đang liệt kê
+                continue
+
+        # Loại bỏ các file không còn tồn tại khỏi manifest
+        current_keys = {os.path.normpath(p) for p in entries}
+        for key in list(manifest):
+            if key not in current_keys:
+                del manifest[key]
+
+        if manifest != before:
+            _save_manifest(manifest)
+
+    for pdf_file, entry in entries.items():
         filename = os.path.basename(pdf_file)
-        file_size = os.path.getsize(pdf_file) / (1024 * 1024)  # MB
-        file_hash = get_file_hash(pdf_file)
+        file_size = entry['size'] / (1024 * 1024)  # MB
+        file_hash = entry['hash']
 
         # Kiểm tra xem có vector store không
         vector_store_path = os.path.join(
             VECTOR_STORES_DIR, f"{filename}_{file_hash}")
-        has_vector_store = os.path.exists(vector_store_path)
+        has_vector_store = has_mmap_layout(vector_store_path)
+        # Store tạo bằng model embedding khác: coi như chưa xử lý để embed lại
+        stale_embedding = has_vector_store and not is_compatible_store(vector_store_path)
 
         documents.append({
             'filename': filename,
@@ -55,140 +205,694 @@ def get_available_documents() -> List[dict]:
             'size_mb': round(file_size, 2),
             'hash': file_hash,
             'vector_store_path': vector_store_path,
-            'has_vector_store': has_vector_store
+            'has_vector_store': has_vector_store and not stale_embedding,
+            'stale_embedding': stale_embedding,
+            'legacy_format': is_legacy_store(vector_store_path)
         })
 
     return documents
 
 
-def process_single_document(pdf_path: str) -> Optional[FAISS]:
-    """Xử lý một document duy nhất"""
-    try:
-        # Load PDF
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
-
-        if not documents:
-            raise ValueError(f"Không thể đọc nội dung từ file: {pdf_path}")
-
-        # Text splitting với metadata
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=150,
-            separators=["\n\n", "\n", ". ", "! ", "? ", " ", ""],
-            length_function=len,
-        )
-        docs = text_splitter.split_documents(documents)
-
-        # Thêm metadata cho từng chunk
-        enhanced_docs = []
-        filename = os.path.basename(pdf_path)
-
-        for i, doc in enumerate(docs):
-            # Filter out empty chunks
-            if len(doc.page_content.strip()) < 50:
-                continue
+def is_compatible_store(path: str) -> bool:
+    """Store được tạo bằng đúng model embedding đang dùng (store chưa có tag: model mặc định cũ)"""
+    return (get_store_embedding(path) or LEGACY_EMBEDDING_TAG) == get_embedding_tag()
+
 
-            # Enhance metadata
-            doc.metadata.update({
-                'source_file': filename,
-                'chunk_id': i,
-                'chunk_length': len(doc.page_content), })
-            enhanced_docs.append(doc)
+def discard_stale_stores(documents: List[dict]) -> List[str]:
+    """Xóa vector store riêng tạo bằng model embedding khác để embed lại, trả về các file bị xóa
 
-        # Tạo embeddings
-        embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
+    Truy vấn đang đọc store cũ (memory-mapped) vẫn đọc được tới khi xong.
+    """
+    discarded = []
+    for doc in documents:
+        if doc.get('stale_embedding'):
+            shutil.rmtree(doc['vector_store_path'], ignore_errors=True)
+            doc['stale_embedding'] = False
+            discarded.append(doc['filename'])
+    return discarded
 
-        # Tạo vector store
-        vector_store = FAISS.from_documents(enhanced_docs, embeddings)
 
-        # Lưu với tên unique
-        file_hash = get_file_hash(pdf_path)
-        vector_store_path = os.path.join(
-            VECTOR_STORES_DIR, f"{filename}_{file_hash}")
-        vector_store.save_local(vector_store_path)
+def process_single_document(pdf_path: str,
+                            batch_size: int = EMBED_BATCH_SIZE) -> Optional[FAISS]:
+    """Xử lý một document duy nhất
+
+    Đọc PDF từng trang, chia chunk dần và embed/thêm vào index theo batch
+    tối đa batch_size chunk, nên bộ nhớ đỉnh không tăng theo số trang.
+    """
+    filename = os.path.basename(pdf_path)
+    try:
+        with span("ingest.document", file=filename) as document_span:
+            # Lấy embeddings dùng chung (model chỉ load một lần mỗi process)
+            embeddings = get_embeddings()
+
+            # Tạo vector store theo từng batch chunk
+            vector_store = None
+            for batch in iter_chunk_batches(pdf_path, batch_size):
+                texts = [doc.page_content for doc in batch]
+                with span("ingest.embed", file=filename, chunks=len(texts)):
+                    text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+                metadatas = [doc.metadata for doc in batch]
+                if vector_store is None:
+                    vector_store = FAISS.from_embeddings(
+                        text_embeddings, embeddings, metadatas=metadatas)
+                else:
+                    vector_store.add_embeddings(text_embeddings, metadatas=metadatas)
+
+            if vector_store is None:
+                raise ValueError(f"Không thể đọc nội dung từ file: {pdf_path}")
+            document_span.set(chunks=vector_store.index.ntotal)
+
+            # Lưu với tên unique
+            file_hash = get_cached_file_hash(pdf_path)
+            vector_store_path = os.path.join(
+                VECTOR_STORES_DIR, f"{filename}_{file_hash}")
+            with span("ingest.save", file=filename):
+                save_store(vector_store, vector_store_path, vector_dtype=DOCUMENT_VECTOR_DTYPE)
+
+        # Chỉ thêm vectors của file mới vào combined store
+        add_to_combined_store(os.path.basename(vector_store_path), vector_store)
 
         return vector_store
 
-    except Exception as e:
+    except Exception:
+        # Lỗi đã được ghi vào span "ingest.document" (tab Chẩn đoán / /metrics)
+        logger.exception("Không thể xử lý %s", filename)
         return None
 
 
-def load_vector_store(vector_store_path: str) -> Optional[FAISS]:
-    """Load một vector store cụ thể"""
+def load_vector_store(vector_store_path: str, mmap: bool = True) -> Optional[FAISS]:
+    """Load một vector store cụ thể
+
+    mmap=True: vectors được memory-map và chunk đọc lazy từ SQLite (chỉ đọc).
+    mmap=False: load toàn bộ vào RAM để thêm/xóa được.
+    """
+    # Store pickle cũ không được load tự động (unpickle không an toàn),
+    # cần chạy: python migrate_stores.py
+    if not has_mmap_layout(vector_store_path):
+        return None
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        vector_store = FAISS.load_local(
-            vector_store_path, embeddings, allow_dangerous_deserialization=True)
-        return vector_store
-    except Exception as e:
+        with span("store.load", store=os.path.basename(vector_store_path), mmap=mmap) as load_span:
+            store = load_store(vector_store_path, get_embeddings(), mmap=mmap)
+            load_span.set(chunks=store.index.ntotal)
+            return store
+    except Exception:
+        logger.exception("Không thể load vector store %s", vector_store_path)
         return None
 
 
-def combine_vector_stores(documents: List[dict]) -> Optional[FAISS]:
-    """Kết hợp nhiều vector stores thành một"""
+def get_store_key(doc_info: dict) -> str:
+    """Tên định danh vector store của một document (<filename>_<hash>)"""
+    return os.path.basename(doc_info['vector_store_path'])
+
+
+def _load_combined_manifest() -> Tuple[Dict[str, dict], dict]:
+    """Đọc danh sách document và thông tin index của combined store"""
+    try:
+        with open(os.path.join(COMBINED_STORE_DIR, COMBINED_MANIFEST_FILE),
+                  'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest.get('documents', {}), manifest.get('index', {})
+    except (OSError, ValueError):
+        return {}, {}
+
+
+def _save_combined_store(store: FAISS, documents: Dict[str, dict], index_info: dict,
+                         sparse_index: Optional[BM25Index] = None,
+                         dedup_index: Optional[DedupIndex] = None):
+    """Lưu combined store cùng manifest, index BM25 và index dedup (ghi ra thư mục tạm rồi đổi tên)"""
+    tmp_dir = f"{COMBINED_STORE_DIR}.tmp"
+    old_dir = f"{COMBINED_STORE_DIR}.old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    # Lưu cả tham số index (nprobe/efSearch...) để áp dụng lại khi load
+    index_info.update(get_index_params(store.index))
+    index_info.setdefault('vector_dtype', COMBINED_VECTOR_DTYPE)
+
+    with span("combined.save", chunks=store.index.ntotal):
+        save_store(store, tmp_dir, sparse_index, index_info['vector_dtype'])
+        if dedup_index is not None:
+            dedup_index.save(os.path.join(tmp_dir, DEDUP_INDEX_FILE))
+        with open(os.path.join(tmp_dir, COMBINED_MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'documents': documents, 'index': index_info},
+                      f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(COMBINED_STORE_DIR):
+        os.replace(COMBINED_STORE_DIR, old_dir)
+    os.replace(tmp_dir, COMBINED_STORE_DIR)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _publish(store: Optional[FAISS], documents: Dict[str, dict], index_info: dict,
+             sparse_index: Optional[SparseIndex], dedup_index: Optional[DedupIndex]):
+    """Đưa trạng thái mới của combined store vào phục vụ truy vấn
+
+    Truy vấn đang chạy vẫn dùng trọn vẹn bản cũ; truy vấn mới lấy bản mới
+    qua get_live_index() (thay bằng một phép gán). Store nén được phục vụ
+    từ bản memory-mapped vừa lưu: chỉ còn codes (float16/int8) được quét,
+    bản float32 trong RAM chỉ tồn tại trong lúc thêm/xóa. BM25 cũng vậy:
+    truy vấn đọc posting lists từ file vừa lưu, bản trong RAM được bỏ.
+    """
+    global _combined_store, _combined_documents, _combined_index_info
+    global _combined_dedup, _live_index
+    if store is not None and index_info.get('vector_dtype', VECTOR_FLOAT32) != VECTOR_FLOAT32:
+        mapped = load_vector_store(COMBINED_STORE_DIR, mmap=True)
+        if mapped is not None:
+            apply_search_params(mapped.index, index_info)
+            store = mapped
+    if store is not None and isinstance(sparse_index, BM25Index):
+        sparse_index = load_sparse_index(COMBINED_STORE_DIR) or sparse_index
+
+    with _combined_lock:
+        _combined_documents = documents
+        _combined_index_info = index_info
+        _combined_dedup = dedup_index
+        _combined_store = store
+        _live_index = (store, sparse_index)
+
+
+def _empty_store_like(store: FAISS) -> FAISS:
+    """Tạo một FAISS store rỗng cùng số chiều với store cho trước"""
+    faiss = dependable_faiss_import()
+    return FAISS(get_embeddings(), faiss.IndexFlatL2(store.index.d),
+                 InMemoryDocstore(), {})
+
+
+def _document_sparse_index(store_key: str, ids: List[str], docs: List[Document]) -> BM25Index:
+    """Index BM25 (trong RAM) của một document: đọc file đã lưu, store cũ chưa có thì tạo và lưu lại"""
+    path = os.path.join(VECTOR_STORES_DIR, store_key)
+    sparse_index = load_sparse_index(path, mmap=False)
+    if sparse_index is None:
+        sparse_index = build_sparse_index(ids, docs)
+        if os.path.isdir(path):
+            save_sparse_index(sparse_index, path)
+    return sparse_index
+
+
+def _load_shard(store_key: str) -> Optional[Tuple[FAISS, SparseIndex]]:
+    """Shard của một document: vector store riêng (memory-mapped) và BM25 của nó"""
+    path = os.path.join(VECTOR_STORES_DIR, store_key)
+    if not is_compatible_store(path):
+        return None
+    store = load_vector_store(path, mmap=True)
+    if store is None:
+        return None
+    sparse_index = load_sparse_index(path)
+    if sparse_index is None:
+        ids = [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+        sparse_index = _document_sparse_index(
+            store_key, ids, [store.docstore.search(id_) for id_ in ids])
+        sparse_index = load_sparse_index(path) or sparse_index
+    return store, sparse_index
+
+
+def _set_shards(store_keys):
+    """Đưa danh sách shard mới vào phục vụ (shard đã load được giữ lại)"""
+    global _shards
+    with _combined_lock:
+        if set(store_keys) != set(_shards.keys()):
+            _shards = _shards.with_keys(store_keys)
+
+
+def _add_source_file(doc: Optional[Document], filename: Optional[str]):
+    """Ghi thêm file nguồn vào chunk được nhiều document dùng chung ('source_files')"""
+    if not isinstance(doc, Document) or not filename:
+        return
+    files = doc.metadata.get('source_files') or [doc.metadata.get('source_file')]
+    if filename not in files:
+        doc.metadata['source_files'] = files + [filename]
+
+
+def _remove_source_file(doc: Optional[Document], filename: str):
+    """Bỏ file nguồn đã bị xóa khỏi chunk dùng chung"""
+    if not isinstance(doc, Document) or 'source_files' not in doc.metadata:
+        return
+    files = [f for f in doc.metadata['source_files'] if f != filename]
+    if doc.metadata.get('source_file') == filename and files:
+        doc.metadata['source_file'] = files[0]
+    if len(files) > 1:
+        doc.metadata['source_files'] = files
+    else:
+        del doc.metadata['source_files']
+
+
+def _dedup_document(dedup: DedupIndex, store_key: str, ids: List[str], docs: List[Document],
+                    lookup: Callable[[str], Optional[Document]]) -> Tuple[List[int], List[str], dict]:
+    """Tách chunk của một document thành chunk mới và chunk trùng với chunk đã lưu
+
+    Chunk trùng (giống hệt, hoặc gần giống nếu bật NEAR_DEDUP_ENABLED) không
+    được thêm vào combined store: document chỉ tham chiếu ID đã có và file
+    nguồn được ghi vào 'source_files' của chunk đó. Trả về (vị trí các chunk mới, IDs document dùng, thống kê).
+    """
+    positions, used_ids = [], []
+    stats = {'exact': 0, 'near': 0}
+    for position, (id_, doc) in enumerate(zip(ids, docs)):
+        signature = minhash_signature(doc.page_content)
+        duplicate_id, kind = dedup.find_duplicate(doc.page_content, signature)
+        if duplicate_id is None:
+            dedup.add(id_, doc.page_content, store_key, signature)
+            positions.append(position)
+            used_ids.append(id_)
+            continue
+
+        dedup.add_reference(duplicate_id, store_key)
+        _add_source_file(lookup(duplicate_id), doc.metadata.get('source_file'))
+        used_ids.append(duplicate_id)
+        stats[kind] += 1
+    return positions, used_ids, stats
+
+
+def _merge_document_store(combined: Optional[FAISS], store: FAISS, store_key: str,
+                          documents: Dict[str, dict], sparse_index: BM25Index,
+                          dedup: DedupIndex) -> FAISS:
+    """Thêm vectors (và index BM25) của một document vào combined store, ghi lại IDs
+
+    Không dùng merge_from vì FAISS sẽ chuyển (làm rỗng) index của store nguồn.
+    Chunk đã có trong combined store (kể cả ở document khác) không được thêm lại.
+    """
+    if combined is None:
+        combined = _empty_store_like(store)
+
+    ntotal = store.index.ntotal
+    ids = [store.index_to_docstore_id[i] for i in range(ntotal)]
+    docs = [store.docstore.search(id_) for id_ in ids]
+    new_docs = dict(zip(ids, docs))
+    positions, used_ids, stats = _dedup_document(
+        dedup, store_key, ids, docs,
+        lambda id_: new_docs.get(id_) or combined.docstore.search(id_))
+    if positions:
+        vectors = store.index.reconstruct_n(0, ntotal)[positions]
+        combined.add_embeddings(
+            zip([docs[i].page_content for i in positions], vectors),
+            metadatas=[docs[i].metadata for i in positions],
+            ids=[ids[i] for i in positions])
+
+    sparse_index.merge(_document_sparse_index(store_key, ids, docs),
+                       ids=[ids[i] for i in positions])
+
+    documents[store_key] = {
+        'hash': store_key.rsplit('_', 1)[-1],
+        'ids': used_ids,
+        'duplicates': stats,
+    }
+    return combined
+
+
+def load_combined_store() -> Optional[FAISS]:
+    """Load combined store đã lưu (một lần đọc, memory-mapped, chỉ đọc)"""
+    with _combined_lock:
+        if _combined_store is not None:
+            return _combined_store
+        if not os.path.exists(COMBINED_STORE_DIR):
+            return None
+        if not is_compatible_store(COMBINED_STORE_DIR):
+            # Vectors của model embedding khác: bỏ, sync sẽ gộp lại từ các store riêng
+            shutil.rmtree(COMBINED_STORE_DIR, ignore_errors=True)
+            return None
+        store = load_vector_store(COMBINED_STORE_DIR, mmap=True)
+        if store is not None:
+            documents, index_info = _load_combined_manifest()
+            apply_search_params(store.index, index_info)
+
+            sparse_index = load_sparse_index(COMBINED_STORE_DIR)
+            if sparse_index is None:
+                # Combined store tạo trước khi có BM25: tạo một lần và lưu lại
+                ids = [id_ for entry in documents.values() for id_ in entry['ids']]
+                sparse_index = build_sparse_index(
+                    ids, [store.docstore.search(id_) for id_ in ids])
+                save_sparse_index(sparse_index, COMBINED_STORE_DIR)
+
+            dedup_path = os.path.join(COMBINED_STORE_DIR, DEDUP_INDEX_FILE)
+            dedup = DedupIndex.load(dedup_path, documents)
+            if dedup is None:
+                # Combined store tạo trước khi có dedup: đăng ký các chunk đang có
+                dedup = _index_existing_chunks(store, documents)
+                dedup.save(dedup_path)
+            _publish(store, documents, index_info, sparse_index, dedup)
+
+            if not NEAR_DEDUP_ENABLED and any(
+                    entry.get('duplicates', {}).get('near') for entry in documents.values()):
+                # Store gộp cả chunk gần trùng khi còn bật: build lại để các chunk đó được index
+                return _build_combined_store(
+                    list(documents), index_info.get('requested_type', COMBINED_INDEX_TYPE),
+                    index_info.get('vector_dtype', COMBINED_VECTOR_DTYPE))
+        return store
+
+
+def _index_existing_chunks(store: FAISS, documents: Dict[str, dict]) -> DedupIndex:
+    """Tạo index dedup từ các chunk đã có trong combined store"""
+    dedup = DedupIndex()
+    for store_key, entry in documents.items():
+        for id_ in entry['ids']:
+            if id_ in dedup:
+                dedup.add_reference(id_, store_key)
+                continue
+            doc = store.docstore.search(id_)
+            if isinstance(doc, Document):
+                dedup.add(id_, doc.page_content, store_key)
+    return dedup
+
+
+def _working_copy() -> Tuple[Optional[FAISS], Dict[str, dict], dict, BM25Index, DedupIndex]:
+    """Bản sao sửa được (trong RAM) của combined store đã lưu trên disk
+
+    Trả về (store, documents, index_info, BM25, dedup); store là None nếu
+    chưa có combined store.
+    """
+    documents = json.loads(json.dumps(_combined_documents))
+    index_info = dict(_combined_index_info)
+    if _combined_store is None:
+        return None, documents, index_info, BM25Index(), DedupIndex()
+
+    store = load_vector_store(COMBINED_STORE_DIR, mmap=False)
+    if store is None:
+        raise ValueError(f"Không thể load combined store: {COMBINED_STORE_DIR}")
+    apply_search_params(store.index, index_info)
+    sparse_index = load_sparse_index(COMBINED_STORE_DIR, mmap=False) or BM25Index()
+    dedup = (DedupIndex.load(os.path.join(COMBINED_STORE_DIR, DEDUP_INDEX_FILE), documents)
+             or _index_existing_chunks(store, documents))
+    return store, documents, index_info, sparse_index, dedup
+
+
+def add_to_combined_store(store_key: str, store: Optional[FAISS] = None) -> Optional[FAISS]:
+    """Thêm một document (đã có vector store riêng) vào combined store
+
+    Sharded mode chỉ đăng ký shard mới, không đụng tới các document khác.
+    """
+    with _combined_lock:
+        _set_shards(_shards.keys() + [store_key])
+        if SEARCH_MODE == SEARCH_SHARDED:
+            return None
+        try:
+            load_combined_store()
+            if store_key in _combined_documents:
+                return _combined_store
+            if (_combined_store is not None
+                    and isinstance(_combined_store.index, RescoringIndex)
+                    and get_index_type(_combined_store.index) != INDEX_FLAT):
+                # IVF/HNSW nén chỉ giữ codes, không thêm được vector gốc - build lại
+                return _build_combined_store(
+                    list(_combined_documents) + [store_key],
+                    _combined_index_info.get('requested_type', COMBINED_INDEX_TYPE),
+                    _combined_index_info.get('vector_dtype', COMBINED_VECTOR_DTYPE))
+
+            if store is None:
+                store = load_vector_store(os.path.join(VECTOR_STORES_DIR, store_key))
+            if store is None:
+                return _combined_store
+
+            with span("combined.add", store=store_key, chunks=store.index.ntotal):
+                combined, documents, index_info, sparse_index, dedup = _working_copy()
+                combined = _merge_document_store(
+                    combined, store, store_key, documents, sparse_index, dedup)
+                _save_combined_store(combined, documents, index_info, sparse_index, dedup)
+                _publish(combined, documents, index_info, sparse_index, dedup)
+            return _combined_store
+
+        except Exception:
+            logger.exception("Không thể thêm %s vào combined store", store_key)
+            return None
+
+
+def remove_from_combined_store(store_key: str) -> Optional[FAISS]:
+    """Xóa vectors của một document khỏi combined store
+
+    Index flat xóa trực tiếp theo IDs; IVF/HNSW không giữ được thứ tự vị trí
+    khi xóa nên được build lại từ các vector store riêng (không embed lại).
+    Chunk còn được document khác dùng chung thì giữ lại.
+    """
+    with _combined_lock:
+        _set_shards([key for key in _shards.keys() if key != store_key])
+        if SEARCH_MODE == SEARCH_SHARDED:
+            return None
+        try:
+            load_combined_store()
+            if store_key not in _combined_documents or _combined_store is None:
+                return _combined_store
+
+            if not supports_remove(_combined_store.index):
+                remaining = [key for key in _combined_documents if key != store_key]
+                return _build_combined_store(
+                    remaining, _combined_index_info.get('requested_type', COMBINED_INDEX_TYPE),
+                    _combined_index_info.get('vector_dtype', COMBINED_VECTOR_DTYPE))
+
+            with span("combined.remove", store=store_key) as remove_span:
+                combined, documents, index_info, sparse_index, dedup = _working_copy()
+                entry = documents.pop(store_key)
+                orphaned = dedup.release(entry['ids'], store_key)
+                filename = store_key.rsplit('_', 1)[0]
+                for id_ in set(entry['ids']) - set(orphaned):
+                    _remove_source_file(combined.docstore.search(id_), filename)
+
+                existing_ids = set(combined.index_to_docstore_id.values())
+                ids = [id_ for id_ in orphaned if id_ in existing_ids]
+                if ids:
+                    combined.delete(ids)
+                sparse_index.remove(orphaned)
+                remove_span.set(chunks=len(ids))
+                _save_combined_store(combined, documents, index_info, sparse_index, dedup)
+                _publish(combined, documents, index_info, sparse_index, dedup)
+            return _combined_store
+
+        except Exception:
+            logger.exception("Không thể xóa %s khỏi combined store", store_key)
+            return None
+
+
+def sync_combined_store(documents: List[dict]) -> Optional[FAISS]:
+    """Đồng bộ combined store với danh sách documents hiện có
+
+    Chỉ thêm documents mới và xóa documents không còn tồn tại, không merge
+    lại toàn bộ.
+    """
+    with _combined_lock:
+        current_keys = {get_store_key(d) for d in documents if d['has_vector_store']}
+        _set_shards(current_keys)
+        if SEARCH_MODE == SEARCH_SHARDED:
+            return None
+
+        load_combined_store()
+
+        for store_key in list(_combined_documents):
+            if store_key not in current_keys:
+                remove_from_combined_store(store_key)
+
+        for store_key in sorted(current_keys):
+            if store_key not in _combined_documents:
+                add_to_combined_store(store_key)
+
+        # Corpus đã vượt ngưỡng của loại index hiện tại - build lại index phù hợp
+        if (_combined_store is not None
+                and _combined_index_info.get('requested_type', COMBINED_INDEX_TYPE) == INDEX_AUTO
+                and choose_index_type(_combined_store.index.ntotal)
+                != get_index_type(_combined_store.index)):
+            return _build_combined_store(
+                list(_combined_documents), INDEX_AUTO,
+                _combined_index_info.get('vector_dtype', COMBINED_VECTOR_DTYPE))
+
+        return _combined_store
+
+
+def _build_combined_store(store_keys: List[str], index_type: str,
+                          vector_dtype: str = COMBINED_VECTOR_DTYPE) -> Optional[FAISS]:
+    """Build lại combined store từ các vector store riêng với loại index và định dạng vectors chỉ định"""
+    with _combined_lock:
+        ids, docs, indexes, keep = [], [], [], []
+        combined_documents = {}
+        sparse_index = BM25Index()
+        dedup = DedupIndex()
+        kept_docs: Dict[str, Document] = {}
+
+        for store_key in store_keys:
+            store = load_vector_store(os.path.join(VECTOR_STORES_DIR, store_key))
+            if store is None:
+                continue
+            store_ids = [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+            store_docs = [store.docstore.search(id_) for id_ in store_ids]
+            positions, used_ids, stats = _dedup_document(
+                dedup, store_key, store_ids, store_docs, kept_docs.get)
+            kept_ids = [store_ids[i] for i in positions]
+            for i in positions:
+                kept_docs[store_ids[i]] = store_docs[i]
+            keep.extend(len(ids) + i for i in positions)
+            ids.extend(store_ids)
+            indexes.append(store.index)
+            sparse_index.merge(_document_sparse_index(store_key, store_ids, store_docs),
+                               ids=kept_ids)
+            combined_documents[store_key] = {
+                'hash': store_key.rsplit('_', 1)[-1],
+                'ids': used_ids,
+                'duplicates': stats,
+            }
+
+        vectors = collect_vectors(indexes)
+        if vectors is None or not keep:
+            shutil.rmtree(COMBINED_STORE_DIR, ignore_errors=True)
+            _publish(None, {}, {}, None, None)
+            return None
+        vectors = vectors[keep]
+        ids = [ids[i] for i in keep]
+        docs = [kept_docs[id_] for id_ in ids]
+
+        with span("combined.build", index_type=index_type, vector_dtype=vector_dtype,
+                  chunks=len(ids)):
+            index, params = build_index(vectors, index_type, vector_dtype=vector_dtype)
+            if params['vector_dtype'] != VECTOR_FLOAT32:
+                if params['index_type'] != INDEX_FLAT:
+                    # Giữ vectors gốc để chấm lại ứng viên (và để lưu vectors_full.npy)
+                    index = RescoringIndex(index, vectors)
+                # So sánh bộ nhớ/recall của float32, float16, int8 trên corpus này
+                params['quantization_report'] = quantization_report(vectors)
+            if params['index_type'] != INDEX_FLAT:
+                # Đo recall/latency so với exact search ngay khi còn vectors gốc
+                params['recall_report'] = recall_report(index, vectors)
+        params['requested_type'] = index_type
+
+        combined_store = FAISS(
+            get_embeddings(), index,
+            InMemoryDocstore({id_: doc for id_, doc in zip(ids, docs)}),
+            {i: id_ for i, id_ in enumerate(ids)})
+
+        _save_combined_store(combined_store, combined_documents, params, sparse_index, dedup)
+        _publish(combined_store, combined_documents, params, sparse_index, dedup)
+        return _combined_store
+
+
+def combine_vector_stores(documents: List[dict],
+                          index_type: str = COMBINED_INDEX_TYPE,
+                          vector_dtype: str = COMBINED_VECTOR_DTYPE) -> Optional[FAISS]:
+    """Kết hợp nhiều vector stores thành một (rebuild toàn bộ combined store)
+
+    index_type: 'auto' (chọn theo số vector), 'flat', 'ivf', 'hnsw', 'ivfpq'.
+    vector_dtype: 'float32', 'float16', 'int8' (nén vectors, chấm lại bằng float32).
+    Sharded mode không có combined store: chỉ đồng bộ danh sách shard.
+    """
+    if SEARCH_MODE == SEARCH_SHARDED:
+        return sync_combined_store(documents)
     try:
-        combined_store = None
-        total_docs = 0
-
-        for doc_info in documents:
-            if doc_info['has_vector_store']:
-                store = load_vector_store(doc_info['vector_store_path'])
-                if store:
-                    if combined_store is None:
-                        combined_store = store
-                    else:
-                        combined_store.merge_from(store)
-                    total_docs += 1
-
-        return combined_store
-
-    except Exception as e:
+        store_keys = [get_store_key(doc_info) for doc_info in documents
+                      if doc_info['has_vector_store']]
+        return _build_combined_store(store_keys, index_type, vector_dtype)
+
+    except Exception:
+        logger.exception("Không thể build combined store (%s, %s)", index_type, vector_dtype)
         return None
 
 
-def process_all_documents() -> Optional[FAISS]:
-    """Xử lý tất cả documents trong thư mục"""
+def get_combined_index_info() -> dict:
+    """Thông tin index của combined store (loại, tham số, báo cáo recall)"""
+    with _combined_lock:
+        return dict(_combined_index_info)
+
+
+def get_live_index() -> Tuple[Optional[FAISS], Optional[SparseIndex]]:
+    """(vector store, BM25) đang phục vụ truy vấn - luôn là một cặp nhất quán
+
+    Chưa có combined store thì load lần đầu (hoặc dùng store fallback, không có BM25).
+    """
+    if _live_index[0] is None:
+        store = get_vector_store()
+        if _live_index[0] is None:
+            return store, None
+    return _live_index
+
+
+def get_shards() -> ShardSet:
+    """Danh sách shard (vector store riêng của từng document) đang phục vụ truy vấn"""
+    if not _default_store_loaded:
+        ensure_vector_store_loaded()
+    return _shards
+
+
+def get_dedup_report() -> dict:
+    """Báo cáo dedup của combined store: số chunk trùng không phải lưu và dung lượng tiết kiệm (ước lượng)"""
+    with _combined_lock:
+        if _combined_dedup is None or _combined_store is None:
+            return {}
+        report = _combined_dedup.report(_combined_store.index.d)
+        # Số chunk trùng/gần trùng của từng file (không được lưu lại)
+        report['documents'] = {key.rsplit('_', 1)[0]: entry['duplicates']
+                               for key, entry in _combined_documents.items()
+                               if any(entry.get('duplicates', {}).values())}
+        return report
+
+
+def get_index_version() -> str:
+    """Phiên bản nội dung của index - đổi khi thêm/xóa/thay tài liệu hoặc đổi index"""
+    with _combined_lock:
+        if SEARCH_MODE == SEARCH_SHARDED:
+            state = [SEARCH_SHARDED, _shards.keys(), get_embedding_tag()]
+        else:
+            state = [sorted((key, info.get('hash')) for key, info in _combined_documents.items()),
+                     _combined_index_info.get('index_type'),
+                     _combined_index_info.get('vector_dtype', VECTOR_FLOAT32),
+                     get_embedding_tag()]
+    return hashlib.md5(json.dumps(state).encode('utf-8')).hexdigest()[:12]
+
+
+def delete_document(doc_info: dict) -> Optional[FAISS]:
+    """Xóa file PDF, vector store riêng và vectors trong combined store"""
+    if os.path.exists(doc_info['path']):
+        os.remove(doc_info['path'])
+
+    if os.path.exists(doc_info['vector_store_path']):
+        shutil.rmtree(doc_info['vector_store_path'])
+
+    return remove_from_combined_store(get_store_key(doc_info))
+
+
+def process_all_documents(rebuild: bool = False,
+                          workers: int = INGEST_WORKERS,
+                          progress_callback: Optional[ProgressCallback] = None,
+                          index_type: str = COMBINED_INDEX_TYPE,
+                          vector_dtype: str = COMBINED_VECTOR_DTYPE) -> Optional[FAISS]:
+    """Xử lý tất cả documents trong thư mục
+
+    Các documents chưa có vector store được xử lý song song qua pipeline
+    ingest. Mặc định chỉ cập nhật combined store theo các thay đổi;
+    rebuild=True sẽ kết hợp lại toàn bộ từ các vector store riêng.
+    """
     documents = get_available_documents()
 
     if not documents:
         return None
 
-    # Xử lý các documents chưa có vector store
-    for doc in documents:
-        if not doc['has_vector_store']:
+    # Xử lý các documents chưa có vector store; file rất lớn đi đường streaming
+    # để không giữ toàn bộ chunk của nó trong pipeline
+    # Store pickle cũ chờ migrate, không embed lại
+    discard_stale_stores(documents)
+    missing = [doc for doc in documents
+               if not doc['has_vector_store'] and not doc['legacy_format']]
+    for doc in missing:
+        if doc['size_mb'] >= STREAMING_MIN_SIZE_MB:
             process_single_document(doc['path'])
 
+    jobs = [(doc['path'], doc['vector_store_path'])
+            for doc in missing if doc['size_mb'] < STREAMING_MIN_SIZE_MB]
+    if jobs:
+        ingest_documents(
+            jobs,
+            workers=workers,
+            progress_callback=progress_callback,
+            on_document_written=None if rebuild else add_to_combined_store)
+
     # Cập nhật lại danh sách
     documents = get_available_documents()
 
-    # Kết hợp tất cả vector stores
-    return combine_vector_stores(documents)
+    if rebuild:
+        return combine_vector_stores(documents, index_type, vector_dtype)
+    return sync_combined_store(documents)
 
 
 def get_default_vector_store() -> Optional[FAISS]:
-    """Lấy vector store mặc định (ưu tiên combined, fallback single)"""
+    """Lấy vector store mặc định (combined store đã lưu, fallback single)"""
     create_directories()
 
-    # Thử load combined store trước
     documents = get_available_documents()
 
-    if len(documents) > 1:
-        # Nhiều documents - tạo combined store
+    if documents:
+        # Load combined store một lần và chỉ cập nhật phần thay đổi
         return process_all_documents()
-    elif len(documents) == 1:
-        # Một document duy nhất
-        doc = documents[0]
-        if doc['has_vector_store']:
-            return load_vector_store(doc['vector_store_path'])
-        else:
-            return process_single_document(doc['path'])
     else:
         # Không có document nào - check fallback
         fallback_path = os.path.join(VECTOR_STORES_DIR, "doan3_index")
@@ -198,5 +902,31 @@ def get_default_vector_store() -> Optional[FAISS]:
             return None
 
 
-# Khởi tạo vector store mặc định
-vector_store = get_default_vector_store()
+def migrate_legacy_stores() -> List[Tuple[str, str]]:
+    """Chuyển các vector store pickle cũ sang định dạng mới rồi cập nhật combined store"""
+    results = migrate_vector_stores(VECTOR_STORES_DIR, get_embeddings())
+    if results:
+        sync_combined_store(get_available_documents())
+    return results
+
+
+def ensure_vector_store_loaded() -> Optional[FAISS]:
+    """Load vector store mặc định đúng một lần (các thread khác chờ lần load đó)"""
+    global _default_store, _default_store_loaded
+    if not _default_store_loaded:
+        with _default_store_lock:
+            if not _default_store_loaded:
+                _default_store = get_default_vector_store()
+                _default_store_loaded = True
+    return _combined_store if _combined_store is not None else _default_store
+
+
+def get_vector_store() -> Optional[FAISS]:
+    """Vector store đang dùng để truy vấn (combined store nếu đã có)
+
+    Không còn load lúc import module: lần gọi đầu tiên sẽ load (hoặc chờ
+    warm-up thread đang load).
+    """
+    if _combined_store is not None:
+        return _combined_store
+    return ensure_vector_store_loaded()
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+load_dotenv('config.env')
+
+# Cấu hình rerank (bật bằng RERANK_ENABLED=true trong config.env)
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Cross-encoder nhỏ, đa ngôn ngữ (có tiếng Việt), chạy được trên CPU
+RERANK_MODEL_NAME = os.getenv('RERANK_MODEL', "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_DEVICE = "cpu"
+RERANK_CANDIDATES = 20        # Số ứng viên lấy từ retriever trước khi rerank
+RERANK_TOP_N = 4              # Số chunk giữ lại sau rerank
+RERANK_BATCH_SIZE = 32
+RERANK_MAX_CHARS = 1000       # Cắt bớt chunk dài (model chỉ đọc ~512 token)
+RERANK_LATENCY_BUDGET_MS = float(os.getenv('RERANK_LATENCY_BUDGET_MS', '500'))
+
+_models: Dict[Tuple[str, str], object] = {}
+_models_lock = threading.Lock()
+_loading: Dict[Tuple[str, str], threading.Thread] = {}
+_load_errors: Dict[Tuple[str, str], str] = {}
+
+# Chạy predict trong thread riêng để áp dụng được giới hạn thời gian
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+# Đặt khi predict vượt budget vẫn đang chạy: truy vấn mới bỏ qua rerank thay vì
+# xếp hàng sau nó, xóa khi predict đó xong
+_overrun = threading.Event()
+
+_stats_lock = threading.Lock()
+_stats = {'calls': 0, 'reranked': 0, 'fallback_budget': 0, 'fallback_busy': 0,
+          'fallback_not_loaded': 0, 'fallback_error': 0, 'last_latency_ms': None}
+
+
+def _load_model(model_name: str, device: str):
+    """Load cross-encoder (import sentence-transformers khi cần)"""
+    key = (model_name, device)
+    try:
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(model_name, device=device)
+    except Exception as e:
+        with _models_lock:
+            _load_errors[key] = str(e)
+            _loading.pop(key, None)
+        raise
+
+    with _models_lock:
+        _models[key] = model
+        _loading.pop(key, None)
+    return model
+
+
+def _load_in_background(model_name: str, device: str):
+    try:
+        _load_model(model_name, device)
+    except Exception:
+        # Lỗi đã được ghi vào _load_errors, truy vấn tiếp tục không rerank
+        pass
+
+
+def get_reranker(model_name: str = RERANK_MODEL_NAME, device: str = RERANK_DEVICE,
+                 wait: bool = True):
+    """Lấy cross-encoder dùng chung trong process
+
+    wait=False: nếu model chưa load thì bắt đầu load trong background và trả
+    về None ngay (để truy vấn không phải chờ load model).
+    """
+    key = (model_name, device)
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            return model
+        loading = _loading.get(key)
+        if not wait and key in _load_errors:
+            # Load lỗi rồi (thiếu thư viện/model) - không thử lại mỗi truy vấn
+            return None
+        if loading is None and not wait:
+            loading = threading.Thread(
+                target=_load_in_background, args=(model_name, device), daemon=True)
+            _loading[key] = loading
+            loading.start()
+
+    if not wait:
+        return None
+    if loading is not None:
+        loading.join()
+        with _models_lock:
+            model = _models.get(key)
+        if model is not None:
+            return model
+    return _load_model(model_name, device)
+
+
+def _count(field: str, latency_ms: Optional[float] = None):
+    with _stats_lock:
+        _stats['calls'] += 1
+        _stats[field] += 1
+        if latency_ms is not None:
+            _stats['last_latency_ms'] = round(latency_ms, 1)
+
+
+def rerank_documents(query: str, docs: List[Document], top_n: int = RERANK_TOP_N,
+                     budget_ms: float = RERANK_LATENCY_BUDGET_MS) -> List[Document]:
+    """Chấm điểm (query, chunk) bằng cross-encoder trong một batch, giữ top_n
+
+    Nếu model chưa load xong, lỗi, chấm điểm vượt budget_ms hoặc một predict
+    đã vượt budget vẫn đang chạy thì trả về top_n theo thứ tự retrieval ban
+    đầu. Các truy vấn đồng thời khác chờ lần lượt trong budget của mình.
+    """
+    if len(docs) <= 1:
+        return docs[:top_n]
+
+    model = get_reranker(wait=False)
+    if model is None:
+        _count('fallback_not_loaded')
+        return docs[:top_n]
+
+    if _overrun.is_set():
+        # Predict vượt budget trước đó chưa xong, xếp hàng sau nó chắc chắn trễ
+        _count('fallback_busy')
+        return docs[:top_n]
+
+    pairs = [(query, doc.page_content[:RERANK_MAX_CHARS]) for doc in docs]
+    start = time.perf_counter()
+    future = _executor.submit(
+        model.predict, pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+    try:
+        scores = future.result(timeout=budget_ms / 1000)
+    except FutureTimeoutError:
+        # Hủy nếu chưa chạy; predict đang chạy thì không dừng được, chỉ bỏ kết quả
+        if not future.cancel():
+            _overrun.set()
+            future.add_done_callback(lambda _: _overrun.clear())
+        _count('fallback_budget', (time.perf_counter() - start) * 1000)
+        return docs[:top_n]
+    except Exception:
+        _count('fallback_error')
+        return docs[:top_n]
+
+    _count('reranked', (time.perf_counter() - start) * 1000)
+    order = sorted(range(len(docs)), key=lambda i: float(scores[i]), reverse=True)
+    return [docs[i] for i in order[:top_n]]
+
+
+def get_rerank_stats() -> dict:
+    """Số lần rerank, số lần fallback theo lý do và latency gần nhất"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({'enabled': RERANK_ENABLED, 'model': RERANK_MODEL_NAME,
+                  'loaded': (RERANK_MODEL_NAME, RERANK_DEVICE) in _models,
+                  'load_error': _load_errors.get((RERANK_MODEL_NAME, RERANK_DEVICE)),
+                  'budget_ms': RERANK_LATENCY_BUDGET_MS})
+    return stats
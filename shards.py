@@ -0,0 +1,157 @@
+import os
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+from sparse_index import SparseIndex
+from telemetry import span
+
+load_dotenv('config.env')
+
+# combined: một index gộp mọi document; sharded: mỗi document là một shard,
+# truy vấn tìm song song trên các shard rồi gộp top-k
+SEARCH_COMBINED = "combined"
+SEARCH_SHARDED = "sharded"
+SEARCH_MODES = [SEARCH_COMBINED, SEARCH_SHARDED]
+SEARCH_MODE = os.getenv('SEARCH_MODE', SEARCH_COMBINED)
+
+# Số thread tìm kiếm song song trên các shard (FAISS nhả GIL khi search)
+SHARD_SEARCH_WORKERS = int(os.getenv('SHARD_SEARCH_WORKERS',
+                                     str(max(1, min(8, os.cpu_count() or 1)))))
+
+# loader(store_key) -> (vector store, BM25) của shard, None nếu không load được
+ShardLoader = Callable[[str], Optional[Tuple[Any, Optional[SparseIndex]]]]
+# ID chunk trong sharded mode: (store_key, docstore id)
+ShardChunkId = Tuple[str, str]
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool tìm kiếm dùng chung (tạo khi cần lần đầu)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(SHARD_SEARCH_WORKERS, thread_name_prefix="shard")
+        return _executor
+
+
+def shard_source_file(store_key: str) -> str:
+    """Tên file PDF của shard (store_key dạng <filename>_<hash>)"""
+    return store_key.rsplit('_', 1)[0]
+
+
+class ShardSet:
+    """Các vector store riêng của từng document dùng làm shard
+
+    Danh sách shard không đổi sau khi tạo: thêm/xóa document tạo ShardSet
+    mới (giữ lại các shard đã load), nên truy vấn đang chạy luôn thấy một
+    danh sách nhất quán và không shard nào khác phải load hay build lại.
+    Shard được load (memory-map) ở lần đầu có truy vấn cần tới.
+    """
+
+    def __init__(self, loader: ShardLoader, store_keys: Iterable[str] = (),
+                 loaded: Optional[Dict[str, tuple]] = None):
+        self._loader = loader
+        self._keys = sorted(set(store_keys))
+        self._loaded = {key: shard for key, shard in (loaded or {}).items() if key in self._keys}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def keys(self) -> List[str]:
+        return list(self._keys)
+
+    def source_files(self) -> List[str]:
+        return sorted({shard_source_file(key) for key in self._keys})
+
+    def with_keys(self, store_keys: Iterable[str]) -> "ShardSet":
+        """ShardSet mới với danh sách shard khác, dùng lại các shard đã load"""
+        with self._lock:
+            loaded = dict(self._loaded)
+        return ShardSet(self._loader, store_keys, loaded)
+
+    def select(self, source_files: Optional[Sequence[str]] = None) -> List[str]:
+        """Các shard của những file được chọn (None/rỗng: tất cả)"""
+        if not source_files:
+            return list(self._keys)
+        wanted = set(source_files)
+        return [key for key in self._keys if shard_source_file(key) in wanted]
+
+    def _shard(self, store_key: str) -> Optional[tuple]:
+        with self._lock:
+            if store_key in self._loaded:
+                return self._loaded[store_key]
+        shard = self._loader(store_key)
+        if shard is None:
+            return None
+        with self._lock:
+            return self._loaded.setdefault(store_key, shard)
+
+    def _search_shard(self, store_key: str, queries: List[str], vectors: np.ndarray,
+                      fetch_k: int) -> Optional[Tuple[list, list]]:
+        """Top fetch_k dense (khoảng cách, id) và BM25 (id, điểm) của từng câu hỏi trên một shard"""
+        shard = self._shard(store_key)
+        if shard is None:
+            return None
+        store, sparse_index = shard
+        ntotal = store.index.ntotal
+        if ntotal == 0:
+            return None
+        distances, positions = store.index.search(vectors, min(fetch_k, ntotal))
+        dense = [[(float(distance), (store_key, store.index_to_docstore_id[int(i)]))
+                  for distance, i in zip(row_distances, row_positions) if i != -1]
+                 for row_distances, row_positions in zip(distances, positions)]
+        sparse = [[((store_key, doc_id), score) for doc_id, score in sparse_index.search(query, fetch_k)]
+                  if sparse_index is not None else [] for query in queries]
+        return dense, sparse
+
+    def search(self, queries: List[str], vectors: np.ndarray, fetch_k: int,
+               source_files: Optional[Sequence[str]] = None
+               ) -> List[Tuple[List[ShardChunkId], List[ShardChunkId]]]:
+        """Tìm song song trên các shard đã chọn rồi gộp top fetch_k cho từng câu hỏi
+
+        Trả về (dense_ids, sparse_ids) theo thứ tự câu hỏi: dense gộp theo
+        khoảng cách (cùng model embedding nên so sánh được giữa các shard),
+        BM25 gộp bằng RRF theo thứ hạng trong từng shard vì IDF và độ dài
+        trung bình tính riêng mỗi shard nên điểm không so sánh được.
+        """
+        from hybrid_retriever import reciprocal_rank_fusion
+
+        keys = self.select(source_files)
+        if not keys or not queries:
+            return [([], []) for _ in queries]
+
+        with span("query.shard_search", shards=len(keys), queries=len(queries)):
+            if len(keys) == 1:
+                results = [self._search_shard(keys[0], queries, vectors, fetch_k)]
+            else:
+                results = list(_get_executor().map(
+                    lambda key: self._search_shard(key, queries, vectors, fetch_k), keys))
+        results = [result for result in results if result is not None]
+
+        merged = []
+        for position in range(len(queries)):
+            dense = heapq.nsmallest(
+                fetch_k, (hit for result in results for hit in result[0][position]))
+            sparse = reciprocal_rank_fusion(
+                [[chunk_id for chunk_id, _ in result[1][position]] for result in results])
+            merged.append(([chunk_id for _, chunk_id in dense],
+                           [chunk_id for chunk_id, _ in sparse[:fetch_k]]))
+        return merged
+
+    def lookup(self, chunk_id: ShardChunkId) -> Optional[Document]:
+        """Đọc chunk theo (store_key, id) từ docstore của shard"""
+        store_key, doc_id = chunk_id
+        shard = self._shard(store_key)
+        if shard is None:
+            return None
+        doc = shard[0].docstore.search(doc_id)
+        return doc if isinstance(doc, Document) else None
@@ -0,0 +1,244 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+# Tham số BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# v2: posting lists trong SQLite, đọc theo từ khi truy vấn (v1 là JSON load toàn bộ)
+SPARSE_FORMAT_VERSION = 2
+
+# Từ gồm chữ/số, giữ nguyên các mã như "85/2020/nđ-cp", "điều 3.2", "iso-9001"
+TOKEN_PATTERN = re.compile(r"\w+(?:[./\-]\w+)*")
+TOKEN_SPLIT_PATTERN = re.compile(r"[./\-]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách từ cho BM25: Unicode NFC, chữ thường, giữ dấu tiếng Việt
+
+    Mã có dấu nối (85/2020/NĐ-CP) được giữ nguyên làm một từ và tách thêm
+    từng phần, để tìm được cả mã đầy đủ lẫn từng số hiệu.
+    """
+    text = unicodedata.normalize('NFC', text).casefold()
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        tokens.append(token)
+        if TOKEN_SPLIT_PATTERN.search(token):
+            tokens.extend(part for part in TOKEN_SPLIT_PATTERN.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index BM25 theo docstore ID của chunk, nằm trong RAM
+
+    Thêm/xóa theo từng chunk nên cập nhật được dần như combined store. Chỉ
+    dùng khi tạo hoặc sửa index; truy vấn trên index đã lưu dùng
+    SQLiteBM25Index để không phải load toàn bộ posting lists.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}   # term -> {id: tf}
+        self.doc_terms: Dict[str, Dict[str, int]] = {}  # id -> {term: tf}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_lengths
+
+    def _add_terms(self, doc_id: str, term_counts: Dict[str, int], length: int):
+        if doc_id in self.doc_lengths:
+            self.remove([doc_id])
+        self.doc_terms[doc_id] = term_counts
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        for term, tf in term_counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        """Thêm (hoặc thay) các chunk theo ID"""
+        for doc_id, text in zip(ids, texts):
+            tokens = tokenize(text)
+            term_counts: Dict[str, int] = {}
+            for token in tokens:
+                term_counts[token] = term_counts.get(token, 0) + 1
+            self._add_terms(doc_id, term_counts, len(tokens))
+
+    def merge(self, other: "BM25Index", ids: Optional[Iterable[str]] = None):
+        """Thêm chunk của index khác (không tách từ lại); ids: chỉ thêm các chunk này"""
+        selected = other.doc_terms if ids is None else set(ids)
+        for doc_id, term_counts in other.doc_terms.items():
+            if doc_id not in selected:
+                continue
+            self._add_terms(doc_id, dict(term_counts), other.doc_lengths[doc_id])
+
+    def remove(self, ids: Iterable[str]):
+        """Xóa các chunk theo ID (bỏ qua ID không có)"""
+        for doc_id in ids:
+            term_counts = self.doc_terms.pop(doc_id, None)
+            if term_counts is None:
+                continue
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            for term in term_counts:
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Trả về tối đa k cặp (id, điểm BM25) theo thứ tự giảm dần"""
+        n_docs = len(self.doc_lengths)
+        if n_docs == 0 or k <= 0:
+            return []
+        avg_length = self.total_length / n_docs or 1.0
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: str):
+        """Ghi index ra file SQLite (ghi file tạm rồi đổi tên)"""
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        doc_rows = {doc_id: row for row, doc_id in enumerate(self.doc_lengths)}
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ('format_version', str(SPARSE_FORMAT_VERSION)), ('k1', str(self.k1)),
+                ('b', str(self.b)), ('total_length', str(self.total_length))])
+            conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, id TEXT NOT NULL, "
+                         "length INTEGER NOT NULL)")
+            conn.executemany("INSERT INTO docs VALUES (?, ?, ?)",
+                             ((row, doc_id, self.doc_lengths[doc_id])
+                              for doc_id, row in doc_rows.items()))
+            conn.execute("CREATE TABLE terms (term_id INTEGER PRIMARY KEY, "
+                         "term TEXT NOT NULL UNIQUE, df INTEGER NOT NULL)")
+            conn.executemany("INSERT INTO terms VALUES (?, ?, ?)",
+                             ((term_id, term, len(posting)) for term_id, (term, posting)
+                              in enumerate(self.postings.items())))
+            # Posting list của một từ nằm liền nhau trên disk (khóa chính term_id, row)
+            conn.execute("CREATE TABLE postings (term_id INTEGER NOT NULL, row INTEGER NOT NULL, "
+                         "tf INTEGER NOT NULL, PRIMARY KEY (term_id, row)) WITHOUT ROWID")
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                             ((term_id, doc_rows[doc_id], tf) for term_id, posting
+                              in enumerate(self.postings.values())
+                              for doc_id, tf in posting.items()))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """Đọc toàn bộ index vào RAM để sửa, None nếu không có hoặc khác phiên bản định dạng"""
+        conn = _connect(path)
+        if conn is None:
+            return None
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            index = cls(k1=float(meta['k1']), b=float(meta['b']))
+            doc_ids = dict(conn.execute("SELECT row, id FROM docs"))
+            terms = dict(conn.execute("SELECT term_id, term FROM terms"))
+            doc_terms: Dict[str, Dict[str, int]] = {doc_id: {} for doc_id in doc_ids.values()}
+            for term_id, row, tf in conn.execute("SELECT term_id, row, tf FROM postings"):
+                doc_terms[doc_ids[row]][terms[term_id]] = tf
+            for row, length in conn.execute("SELECT row, length FROM docs"):
+                index._add_terms(doc_ids[row], doc_terms[doc_ids[row]], length)
+        finally:
+            conn.close()
+        return index
+
+
+def _connect(path: str) -> Optional[sqlite3.Connection]:
+    """Mở file index chỉ đọc, None nếu không có hoặc khác phiên bản định dạng"""
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True,
+                               check_same_thread=False)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'format_version'").fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None or row[0] != str(SPARSE_FORMAT_VERSION):
+        conn.close()
+        return None
+    return conn
+
+
+class SQLiteBM25Index:
+    """Index BM25 đã lưu, chỉ đọc: posting lists đọc từ SQLite theo từ của câu hỏi
+
+    Chỉ giữ số chunk và tổng độ dài trong RAM; điểm BM25 được cộng dồn và
+    lấy top-k ngay trong SQLite nên truy vấn không duyệt posting lists bằng
+    Python. Kết nối mở ngay khi load để vẫn đọc được khi thư mục store bị
+    thay bằng bản mới.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._lock = threading.Lock()
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        self.k1 = float(meta['k1'])
+        self.b = float(meta['b'])
+        self.total_length = int(meta['total_length'])
+        self.n_docs = conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    @classmethod
+    def open(cls, path: str) -> Optional["SQLiteBM25Index"]:
+        """Mở index đã lưu, None nếu không có hoặc khác phiên bản định dạng"""
+        conn = _connect(path)
+        return cls(conn) if conn is not None else None
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Trả về tối đa k cặp (id, điểm BM25) theo thứ tự giảm dần"""
+        terms = list(set(tokenize(query)))
+        if self.n_docs == 0 or k <= 0 or not terms:
+            return []
+        avg_length = self.total_length / self.n_docs or 1.0
+
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT term_id, df FROM terms WHERE term IN ({', '.join('?' * len(terms))})",
+                terms).fetchall()
+            if not found:
+                return []
+            weights = [value for term_id, df in found for value in
+                       (term_id, math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5)))]
+            rows = self._conn.execute(
+                f"WITH weights(term_id, idf) AS (VALUES {', '.join(['(?, ?)'] * len(found))}) "
+                "SELECT docs.id, SUM(weights.idf * postings.tf * ? "
+                "/ (postings.tf + ? * (1 - ? + ? * docs.length / ?))) AS score "
+                "FROM weights JOIN postings ON postings.term_id = weights.term_id "
+                "JOIN docs ON docs.row = postings.row "
+                "GROUP BY postings.row ORDER BY score DESC LIMIT ?",
+                (*weights, self.k1 + 1, self.k1, self.b, self.b, avg_length, k)).fetchall()
+        return [(doc_id, score) for doc_id, score in rows]
+
+
+# Index BM25 dùng để tìm kiếm: bản trong RAM (đang sửa) hoặc bản đọc từ disk
+SparseIndex = Union[BM25Index, SQLiteBM25Index]
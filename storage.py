@@ -0,0 +1,435 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, MutableMapping, Optional, Tuple, Union
+
+import numpy as np
+try:
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.base import AddableMixin, Docstore
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+except ImportError:
+    # Fallback cho phiên bản cũ
+    from langchain.vectorstores import FAISS
+    from langchain.docstore.base import AddableMixin, Docstore
+    from langchain.docstore.in_memory import InMemoryDocstore
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+from embeddings import LEGACY_EMBEDDING_TAG
+from faiss_index import (
+    INDEX_FLAT,
+    VECTOR_DTYPES,
+    VECTOR_FLOAT32,
+    MmapFlatIndex,
+    RescoringIndex,
+    dequantize_vectors,
+    get_index_type,
+    get_vector_dtype,
+    quantize_vectors,
+    read_index_mmap,
+    unwrap_index,
+)
+from sparse_index import BM25Index, SparseIndex, SQLiteBM25Index
+
+load_dotenv('config.env')
+
+# Phiên bản định dạng lưu trữ (tăng khi đổi schema, load sẽ kiểm tra)
+# v2: thêm vector_dtype (float16/int8 + vectors_full.npy)
+STORE_FORMAT_VERSION = 2
+
+# Các file trong thư mục vector store
+VECTORS_FILE = "vectors.npy"        # float32 N x d, đọc bằng memory-map
+NORMS_FILE = "norms.npy"            # ||v||^2 tính sẵn cho tìm kiếm L2
+DOCSTORE_FILE = "docstore.sqlite"   # text + metadata của chunk, đọc lazy theo ID
+STORE_INFO_FILE = "store_info.json"
+INDEX_FILE = "index.faiss"          # Chỉ có với index IVF/HNSW
+LEGACY_PICKLE_FILE = "index.pkl"    # Định dạng cũ của FAISS.save_local
+SPARSE_INDEX_FILE = "sparse_index.sqlite"  # Inverted index BM25 của các chunk, đọc theo từ
+LEGACY_SPARSE_INDEX_FILE = "sparse_index.json"  # Định dạng cũ, load toàn bộ vào RAM
+QUANTIZER_FILE = "quantizer.npy"    # [vmin, vdiff] theo từng chiều (chỉ có với int8)
+FULL_VECTORS_FILE = "vectors_full.npy"  # float32 gốc của store nén, chỉ đọc các ứng viên khi chấm lại
+
+# Định dạng vectors khi lưu: float32 (mặc định), float16 hoặc int8
+DOCUMENT_VECTOR_DTYPE = os.getenv('DOCUMENT_VECTOR_DTYPE', VECTOR_FLOAT32)
+COMBINED_VECTOR_DTYPE = os.getenv('COMBINED_VECTOR_DTYPE', VECTOR_FLOAT32)
+
+# Các metadata phổ biến được lưu thành cột riêng, phần còn lại lưu JSON
+METADATA_COLUMNS = ['source', 'source_file', 'page', 'chunk_id', 'chunk_length']
+
+DOCSTORE_CACHE_SIZE = 1024  # Số chunk giữ lại trong cache của SQLiteDocstore
+
+
+def has_mmap_layout(path: str) -> bool:
+    """Thư mục vector store đã có định dạng mmap + SQLite chưa"""
+    return (os.path.exists(os.path.join(path, STORE_INFO_FILE))
+            and os.path.exists(os.path.join(path, DOCSTORE_FILE)))
+
+
+def is_legacy_store(path: str) -> bool:
+    """Vector store chỉ có định dạng pickle cũ (cần migrate)"""
+    return (os.path.exists(os.path.join(path, LEGACY_PICKLE_FILE))
+            and not has_mmap_layout(path))
+
+
+def _read_store_info(path: str) -> dict:
+    """Đọc store_info.json và kiểm tra phiên bản định dạng"""
+    with open(os.path.join(path, STORE_INFO_FILE), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    # Store ghi trước khi có versioning dùng cùng schema với phiên bản 1
+    version = info.get('format_version', 1)
+    if version > STORE_FORMAT_VERSION:
+        raise ValueError(
+            f"Vector store {path} dùng định dạng v{version}, "
+            f"phiên bản này chỉ đọc được tới v{STORE_FORMAT_VERSION}")
+    return info
+
+
+def _row_to_document(row: tuple) -> Document:
+    """Chuyển một dòng (text, metadata columns..., extra) thành Document"""
+    text, *columns, extra = row
+    metadata = json.loads(extra) if extra else {}
+    for key, value in zip(METADATA_COLUMNS, columns):
+        if value is not None:
+            metadata[key] = value
+    return Document(page_content=text, metadata=metadata)
+
+
+class _SQLiteConnection:
+    """Kết nối SQLite dùng chung giữa các thread (có lock)"""
+
+    def __init__(self, path: str, read_only: bool = True):
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.read_only:
+                uri = f"file:{os.path.abspath(self.path)}?mode=ro"
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore đọc chunk từ SQLite theo ID khi cần (không load toàn bộ)"""
+
+    def __init__(self, connection: _SQLiteConnection, cache_size: int = DOCSTORE_CACHE_SIZE):
+        self._connection = connection
+        self._cache: "OrderedDict[str, Document]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._connection.lock:
+            doc = self._cache.get(search)
+            if doc is not None:
+                self._cache.move_to_end(search)
+                return doc
+
+            row = self._connection.conn.execute(
+                f"SELECT text, {', '.join(METADATA_COLUMNS)}, extra FROM chunks WHERE id = ?",
+                (search,)).fetchone()
+            if row is None:
+                return f"ID {search} not found."
+
+            doc = _row_to_document(row)
+            self._cache[search] = doc
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return doc
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise ValueError("SQLiteDocstore chỉ đọc - hãy load store với mmap=False để thêm")
+
+    def delete(self, ids: List) -> None:
+        raise ValueError("SQLiteDocstore chỉ đọc - hãy load store với mmap=False để xóa")
+
+
+class SQLiteIndexMap(MutableMapping):
+    """Mapping vị trí trong index -> docstore ID, tra cứu trực tiếp trong SQLite"""
+
+    def __init__(self, connection: _SQLiteConnection, size: int):
+        self._connection = connection
+        self._size = size
+
+    def __getitem__(self, position: int) -> str:
+        with self._connection.lock:
+            row = self._connection.conn.execute(
+                "SELECT id FROM chunks WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        with self._connection.lock:
+            rows = self._connection.conn.execute(
+                "SELECT position FROM chunks ORDER BY position").fetchall()
+        return iter(row[0] for row in rows)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __setitem__(self, position: int, doc_id: str):
+        raise TypeError("SQLiteIndexMap chỉ đọc")
+
+    def __delitem__(self, position: int):
+        raise TypeError("SQLiteIndexMap chỉ đọc")
+
+
+def _write_docstore(path: str, ids: List[str], docs: List[Document]):
+    """Ghi toàn bộ chunk (text + metadata) vào file SQLite mới"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT INTO meta VALUES ('format_version', ?)",
+                     (str(STORE_FORMAT_VERSION),))
+        conn.execute(
+            "CREATE TABLE chunks ("
+            "id TEXT PRIMARY KEY, position INTEGER NOT NULL, text TEXT NOT NULL, "
+            "source TEXT, source_file TEXT, page INTEGER, chunk_id INTEGER, "
+            "chunk_length INTEGER, extra TEXT)")
+        rows = []
+        for position, (doc_id, doc) in enumerate(zip(ids, docs)):
+            metadata = dict(doc.metadata)
+            columns = [metadata.pop(key, None) for key in METADATA_COLUMNS]
+            rows.append((doc_id, position, doc.page_content, *columns,
+                         json.dumps(metadata, ensure_ascii=False) if metadata else None))
+        conn.executemany(
+            f"INSERT INTO chunks (id, position, text, {', '.join(METADATA_COLUMNS)}, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("CREATE UNIQUE INDEX idx_chunks_position ON chunks(position)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_sparse_index(ids: List[str], docs: List[Document]) -> BM25Index:
+    """Tạo index BM25 cho các chunk của một store"""
+    sparse_index = BM25Index()
+    sparse_index.add(ids, [doc.page_content for doc in docs])
+    return sparse_index
+
+
+def save_sparse_index(sparse_index: BM25Index, path: str):
+    """Lưu index BM25 vào thư mục store (xóa file JSON định dạng cũ nếu có)"""
+    sparse_index.save(os.path.join(path, SPARSE_INDEX_FILE))
+    legacy_path = os.path.join(path, LEGACY_SPARSE_INDEX_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def save_store(store: FAISS, path: str, sparse_index: Optional[BM25Index] = None,
+               vector_dtype: str = VECTOR_FLOAT32, embedding_tag: Optional[str] = None):
+    """Lưu vector store: vectors.npy (flat) hoặc index.faiss + docstore.sqlite
+
+    Không dùng pickle: text và metadata nằm trong SQLite, vectors trong file
+    numpy/FAISS, nên load không thực thi code tùy ý. Index BM25 được lưu kèm;
+    nếu không truyền sparse_index thì tạo mới từ các chunk của store.
+    vector_dtype float16/int8 (index flat): vectors.npy chứa vectors nén để
+    quét, float32 gốc nằm trong vectors_full.npy để chấm lại ứng viên. Với
+    IVF/HNSW định dạng lấy theo scalar quantizer của index.
+    embedding_tag: model tạo ra vectors (mặc định lấy từ store.embeddings).
+    """
+    import faiss
+
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"vector_dtype không hợp lệ: {vector_dtype} (chọn {', '.join(VECTOR_DTYPES)})")
+    os.makedirs(path, exist_ok=True)
+    ntotal = store.index.ntotal
+    ids = [store.index_to_docstore_id[i] for i in range(ntotal)]
+    docs = [store.docstore.search(id_) for id_ in ids]
+
+    # Index flat được tìm kiếm trực tiếp trên vectors.npy; IVF/HNSW dùng
+    # index.faiss (IVF được memory-map khi đọc)
+    index_type = get_index_type(store.index)
+    if index_type != INDEX_FLAT:
+        vector_dtype = get_vector_dtype(store.index)
+    quantized = vector_dtype != VECTOR_FLOAT32
+    # Với store nén, reconstruct_n của RescoringIndex trả về float32 gốc
+    vectors = None
+    if index_type == INDEX_FLAT or quantized:
+        vectors = (store.index.reconstruct_n(0, ntotal) if ntotal
+                   else np.zeros((0, store.index.d), dtype=np.float32))
+        vectors = vectors.astype(np.float32)
+
+    for name in (QUANTIZER_FILE, FULL_VECTORS_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    if index_type == INDEX_FLAT:
+        codes, quantizer = quantize_vectors(vectors, vector_dtype)
+        np.save(os.path.join(path, VECTORS_FILE), codes)
+        # Norm của vectors đã giải nén để khoảng cách trên codes nhất quán
+        decoded = dequantize_vectors(codes, quantizer)
+        np.save(os.path.join(path, NORMS_FILE), (decoded ** 2).sum(axis=1))
+        if quantizer is not None:
+            np.save(os.path.join(path, QUANTIZER_FILE), quantizer)
+    else:
+        faiss.write_index(unwrap_index(store.index), os.path.join(path, INDEX_FILE))
+    if quantized:
+        np.save(os.path.join(path, FULL_VECTORS_FILE), vectors)
+    _write_docstore(os.path.join(path, DOCSTORE_FILE), ids, docs)
+
+    if sparse_index is None:
+        sparse_index = build_sparse_index(ids, docs)
+    save_sparse_index(sparse_index, path)
+
+    with open(os.path.join(path, STORE_INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'format_version': STORE_FORMAT_VERSION,
+            'index_type': index_type,
+            'ntotal': ntotal,
+            'dimension': store.index.d,
+            'vector_dtype': vector_dtype,
+            # Model tạo ra vectors, để không tìm kiếm bằng vectors của model khác
+            'embedding': embedding_tag or getattr(store.embeddings, 'tag', None),
+        }, f, indent=2)
+
+
+def get_store_embedding(path: str) -> Optional[str]:
+    """Tag model embedding của store (None: store tạo trước khi có tag)"""
+    try:
+        return _read_store_info(path).get('embedding')
+    except (OSError, ValueError):
+        return None
+
+
+def load_store(path: str, embeddings, mmap: bool = True) -> FAISS:
+    """Load vector store từ định dạng mmap + SQLite
+
+    mmap=True: vectors/inverted lists được memory-map, chunk đọc lazy theo ID
+    (mở gần như tức thì, chỉ đọc). mmap=False: load toàn bộ vào RAM để có
+    thể thêm/xóa như FAISS.load_local.
+    """
+    info = _read_store_info(path)
+    ntotal = info['ntotal']
+    quantized = info.get('vector_dtype', VECTOR_FLOAT32) != VECTOR_FLOAT32
+
+    if mmap:
+        if info['index_type'] == INDEX_FLAT:
+            quantizer_path = os.path.join(path, QUANTIZER_FILE)
+            index = MmapFlatIndex(
+                np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r'),
+                np.load(os.path.join(path, NORMS_FILE), mmap_mode='r'),
+                np.load(quantizer_path) if os.path.exists(quantizer_path) else None)
+        else:
+            index = read_index_mmap(os.path.join(path, INDEX_FILE))
+        if quantized:
+            index = RescoringIndex(
+                index, np.load(os.path.join(path, FULL_VECTORS_FILE), mmap_mode='r'))
+        connection = _SQLiteConnection(os.path.join(path, DOCSTORE_FILE))
+        # Mở kết nối ngay: store vẫn đọc được khi thư mục bị thay bằng bản mới
+        connection.conn
+        return FAISS(embeddings, index, SQLiteDocstore(connection),
+                     SQLiteIndexMap(connection, ntotal))
+
+    import faiss
+    if info['index_type'] == INDEX_FLAT:
+        # Bản sửa được luôn là float32 (store nén có sẵn vectors gốc)
+        index = faiss.IndexFlatL2(info['dimension'])
+        vectors = np.load(os.path.join(path, FULL_VECTORS_FILE if quantized else VECTORS_FILE))
+        if len(vectors):
+            index.add(vectors)
+    else:
+        index = faiss.read_index(os.path.join(path, INDEX_FILE))
+        if quantized:
+            index = RescoringIndex(
+                index, np.load(os.path.join(path, FULL_VECTORS_FILE), mmap_mode='r'))
+
+    # Bulk load toàn bộ chunk theo thứ tự vị trí
+    conn = sqlite3.connect(os.path.join(path, DOCSTORE_FILE))
+    try:
+        rows = conn.execute(
+            f"SELECT id, text, {', '.join(METADATA_COLUMNS)}, extra "
+            "FROM chunks ORDER BY position").fetchall()
+    finally:
+        conn.close()
+
+    ids = [row[0] for row in rows]
+    docs = {row[0]: _row_to_document(row[1:]) for row in rows}
+    return FAISS(embeddings, index, InMemoryDocstore(docs),
+                 {i: id_ for i, id_ in enumerate(ids)})
+
+
+def load_sparse_index(path: str, mmap: bool = True) -> Optional[SparseIndex]:
+    """Đọc index BM25 lưu cùng store, None nếu chưa có (store cũ cần tạo lại)
+
+    mmap=True: posting lists đọc từ SQLite khi truy vấn (chỉ đọc).
+    mmap=False: load toàn bộ vào RAM để thêm/xóa chunk.
+    """
+    sparse_path = os.path.join(path, SPARSE_INDEX_FILE)
+    if mmap:
+        return SQLiteBM25Index.open(sparse_path)
+    return BM25Index.load(sparse_path)
+
+
+def load_legacy_store(path: str, embeddings) -> FAISS:
+    """Load vector store định dạng pickle cũ (index.pkl)
+
+    Unpickle có thể thực thi code tùy ý - chỉ dùng cho store do chính hệ
+    thống tạo ra, ví dụ khi migrate.
+    """
+    try:
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except TypeError:
+        # Các bản langchain cũ không có tham số allow_dangerous_deserialization
+        return FAISS.load_local(path, embeddings)
+
+
+def migrate_store(path: str, embeddings, keep_pickle: bool = False) -> int:
+    """Chuyển một vector store pickle sang định dạng hiện tại, trả về số chunk"""
+    store = load_legacy_store(path, embeddings)
+    tmp_dir = f"{path.rstrip(os.sep)}.migrate"
+    if os.path.exists(tmp_dir):
+        import shutil
+        shutil.rmtree(tmp_dir)
+    # Vectors trong pickle cũ do model mặc định tạo ra, không phải model đang cấu hình
+    save_store(store, tmp_dir, embedding_tag=LEGACY_EMBEDDING_TAG)
+
+    # Chuyển các file mới vào thư mục gốc (file store_info.json sau cùng)
+    names = sorted(os.listdir(tmp_dir), key=lambda name: name == STORE_INFO_FILE)
+    for name in names:
+        os.replace(os.path.join(tmp_dir, name), os.path.join(path, name))
+    os.rmdir(tmp_dir)
+
+    if not keep_pickle:
+        os.remove(os.path.join(path, LEGACY_PICKLE_FILE))
+        if get_index_type(store.index) == INDEX_FLAT and os.path.exists(os.path.join(path, INDEX_FILE)):
+            os.remove(os.path.join(path, INDEX_FILE))
+    return store.index.ntotal
+
+
+def migrate_vector_stores(root: str, embeddings, keep_pickle: bool = False,
+                          dry_run: bool = False) -> List[Tuple[str, str]]:
+    """Migrate mọi vector store pickle trong thư mục root, trả về (tên, kết quả)"""
+    results = []
+    if not os.path.isdir(root):
+        return results
+
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or not is_legacy_store(path):
+            continue
+        if dry_run:
+            results.append((name, "cần migrate"))
+            continue
+        try:
+            count = migrate_store(path, embeddings, keep_pickle=keep_pickle)
+            results.append((name, f"OK ({count} chunks)"))
+        except Exception as e:
+            results.append((name, f"Lỗi: {e}"))
+    return results
@@ -0,0 +1,206 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# Số lần đo gần nhất của mỗi giai đoạn dùng để tính p50/p95
+ROLLING_WINDOW = 500
+RECENT_SPANS = 200        # Số span gần nhất giữ lại để xem chi tiết
+RECENT_ERRORS = 50
+# Bucket (giây) của histogram Prometheus
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "rag"
+
+_lock = threading.Lock()
+_windows: Dict[str, Deque[float]] = {}
+_histograms: Dict[str, dict] = {}         # stage -> {'buckets', 'count', 'sum', 'errors'}
+_items: Dict[str, Dict[str, float]] = {}  # stage -> {'chunks': tổng, 'tokens': tổng, ...}
+_recent_spans: Deque[dict] = deque(maxlen=RECENT_SPANS)
+_recent_errors: Deque[dict] = deque(maxlen=RECENT_ERRORS)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_rss_mb() -> Optional[float]:
+    """Bộ nhớ resident hiện tại của process (MB), None nếu không đo được"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def new_trace_id() -> str:
+    """ID ngắn để gom các span của cùng một truy vấn/job"""
+    return uuid.uuid4().hex[:12]
+
+
+def record(stage: str, seconds: float, error: Optional[BaseException] = None,
+           trace_id: Optional[str] = None, **attrs):
+    """Ghi một lần đo của giai đoạn stage
+
+    attrs dạng số (chunks, tokens, ...) được cộng dồn thành counter; các
+    attrs khác chỉ lưu trong danh sách span gần nhất.
+    """
+    rss_mb = get_rss_mb()
+    with _lock:
+        _windows.setdefault(stage, deque(maxlen=ROLLING_WINDOW)).append(seconds)
+        histogram = _histograms.setdefault(
+            stage, {'buckets': [0] * len(HISTOGRAM_BUCKETS), 'count': 0, 'sum': 0.0, 'errors': 0})
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+        items = _items.setdefault(stage, {})
+        for key, value in attrs.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                items[key] = items.get(key, 0) + value
+
+        span = {'stage': stage, 'trace_id': trace_id, 'ms': round(seconds * 1000, 3),
+                'time': time.time(), 'rss_mb': round(rss_mb, 1) if rss_mb is not None else None,
+                **attrs}
+        if error is not None:
+            histogram['errors'] += 1
+            span['error'] = f"{type(error).__name__}: {error}"
+            _recent_errors.append({
+                'stage': stage, 'trace_id': trace_id, 'time': span['time'],
+                'error': span['error'],
+                'traceback': "".join(traceback.format_exception(
+                    type(error), error, error.__traceback__, limit=5)),
+            })
+        _recent_spans.append(span)
+
+
+class Span:
+    """Span đang chạy: set() để thêm thông tin (số chunk, token...) trước khi kết thúc"""
+
+    def __init__(self, stage: str, trace_id: Optional[str], attrs: dict):
+        self.stage = stage
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+@contextmanager
+def span(stage: str, trace_id: Optional[str] = None, **attrs) -> Iterator[Span]:
+    """Đo thời gian một giai đoạn; exception được ghi nhận rồi raise tiếp"""
+    current = Span(stage, trace_id, attrs)
+    try:
+        yield current
+    except Exception as e:
+        record(stage, current.elapsed(), error=e, trace_id=trace_id, **current.attrs)
+        raise
+    record(stage, current.elapsed(), trace_id=trace_id, **current.attrs)
+
+
+def get_stage_stats() -> Dict[str, dict]:
+    """p50/p95 (ms) trên ROLLING_WINDOW lần đo gần nhất, số lần chạy, lỗi và tổng items"""
+    with _lock:
+        windows = {stage: np.array(values) for stage, values in _windows.items()}
+        histograms = {stage: dict(h) for stage, h in _histograms.items()}
+        items = {stage: dict(values) for stage, values in _items.items()}
+    stats = {}
+    for stage in sorted(windows):
+        values = windows[stage] * 1000
+        stats[stage] = {
+            'count': histograms[stage]['count'],
+            'errors': histograms[stage]['errors'],
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p95_ms': round(float(np.percentile(values, 95)), 3),
+            'last_ms': round(float(values[-1]), 3),
+            'items': items.get(stage, {}),
+        }
+    return stats
+
+
+def get_recent_spans(limit: int = 50, trace_id: Optional[str] = None) -> List[dict]:
+    """Các span gần nhất (mới nhất trước), lọc theo trace_id nếu có"""
+    with _lock:
+        spans = [s for s in reversed(_recent_spans)
+                 if trace_id is None or s['trace_id'] == trace_id]
+    return spans[:limit]
+
+
+def get_recent_errors(limit: int = 20) -> List[dict]:
+    """Các lỗi gần nhất (mới nhất trước), kèm traceback rút gọn"""
+    with _lock:
+        return list(reversed(_recent_errors))[:limit]
+
+
+def get_last_error(stage: str) -> Optional[str]:
+    """Lỗi gần nhất của một giai đoạn (để hiển thị cho người dùng)"""
+    with _lock:
+        for entry in reversed(_recent_errors):
+            if entry['stage'] == stage:
+                return entry['error']
+    return None
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def export_prometheus() -> str:
+    """Xuất metrics theo định dạng text của Prometheus (exposition format 0.0.4)"""
+    with _lock:
+        histograms = {stage: dict(h, buckets=list(h['buckets'])) for stage, h in _histograms.items()}
+        items = {stage: dict(values) for stage, values in _items.items()}
+
+    name = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [f"# HELP {name} Thời gian từng giai đoạn ingest/truy vấn",
+             f"# TYPE {name} histogram"]
+    for stage, histogram in sorted(histograms.items()):
+        label = f'stage="{_label(stage)}"'
+        for bound, count in zip(HISTOGRAM_BUCKETS, histogram['buckets']):
+            lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+        lines.append(f"{name}_sum{{{label}}} {histogram['sum']:.6f}")
+        lines.append(f"{name}_count{{{label}}} {histogram['count']}")
+
+    name = f"{METRIC_PREFIX}_stage_errors_total"
+    lines += [f"# HELP {name} Số lần giai đoạn bị lỗi", f"# TYPE {name} counter"]
+    for stage, histogram in sorted(histograms.items()):
+        lines.append(f'{name}{{stage="{_label(stage)}"}} {histogram["errors"]}')
+
+    name = f"{METRIC_PREFIX}_stage_items_total"
+    lines += [f"# HELP {name} Tổng số chunk/token/... đã xử lý theo giai đoạn",
+              f"# TYPE {name} counter"]
+    for stage, values in sorted(items.items()):
+        for item, total in sorted(values.items()):
+            lines.append(f'{name}{{stage="{_label(stage)}",item="{_label(item)}"}} {total:g}')
+
+    rss_mb = get_rss_mb()
+    if rss_mb is not None:
+        name = f"{METRIC_PREFIX}_process_resident_memory_bytes"
+        lines += [f"# HELP {name} Bộ nhớ resident của process", f"# TYPE {name} gauge",
+                  f"{name} {int(rss_mb * 1024 * 1024)}"]
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Xóa toàn bộ số liệu đã ghi"""
+    with _lock:
+        _windows.clear()
+        _histograms.clear()
+        _items.clear()
+        _recent_spans.clear()
+        _recent_errors.clear()
@@ -0,0 +1,101 @@
+from langchain.schema import Document
+
+import answer_cache
+from answer_cache import AnswerCache, normalize_query
+
+
+def _cache(tmp_path, **kwargs) -> AnswerCache:
+    return AnswerCache(str(tmp_path / "answer_cache.sqlite"), **kwargs)
+
+
+def test_scope_separates_entries_without_invalidating(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("Câu hỏi?", "gemini", "v1", "tất cả", [Document(page_content="a")])
+    cache.store("Câu hỏi?", "gemini", "v1", "chỉ a.pdf", [], source_files=["a.pdf"])
+
+    # Đổi phạm vi qua lại không xóa câu trả lời của phạm vi khác
+    assert cache.lookup("câu hỏi", "gemini", "v1", source_files=["a.pdf"])['answer'] == "chỉ a.pdf"
+    assert cache.lookup("câu hỏi", "gemini", "v1", source_files=["b.pdf"]) is None
+    assert cache.lookup("câu hỏi", "gemini", "v1")['answer'] == "tất cả"
+    assert cache.stats()['size'] == 2
+
+
+def test_similar_match_stays_within_scope(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("câu hỏi", "gemini", "v1", "a", [], query_embedding=[1.0, 0.0],
+                source_files=["a.pdf"])
+
+    assert cache.lookup("khác", "gemini", "v1", [1.0, 0.01], source_files=["a.pdf"]) is not None
+    assert cache.lookup("khác", "gemini", "v1", [1.0, 0.01]) is None
+
+
+def test_normalize_query():
+    assert normalize_query("  Thủ tục  CẤP phép?? ") == "thủ tục cấp phép"
+    # Dạng dựng sẵn và dạng tổ hợp của cùng một chữ có dấu là một câu hỏi
+    assert normalize_query("Ho\u00e0") == normalize_query("Hoa\u0300")
+
+
+def test_new_index_version_invalidates_answers(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("câu hỏi", "gemini", "v1", "cũ", [], query_embedding=[1.0, 0.0])
+    assert cache.lookup("câu hỏi", "gemini", "v1")['answer'] == "cũ"
+
+    assert cache.lookup("câu hỏi", "gemini", "v2", [1.0, 0.0]) is None
+    assert cache.stats()['size'] == 0
+    # Quay lại phiên bản cũ cũng không còn câu trả lời
+    assert cache.lookup("câu hỏi", "gemini", "v1") is None
+
+
+def test_model_is_part_of_the_key(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("câu hỏi", "gemini", "v1", "a", [], query_embedding=[1.0, 0.0])
+    assert cache.lookup("câu hỏi", "gpt", "v1", [1.0, 0.0]) is None
+
+
+def test_expired_answers_are_not_returned(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, ttl=60)
+    now = 1_000_000.0
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now)
+    cache.store("câu hỏi", "gemini", "v1", "a", [])
+
+    now += 59
+    assert cache.lookup("câu hỏi", "gemini", "v1") is not None
+    now += 2
+    assert cache.lookup("câu hỏi", "gemini", "v1") is None
+    assert cache.stats()['size'] == 0
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, max_entries=2)
+    clock = iter(range(1, 100))
+    monkeypatch.setattr(answer_cache.time, "time", lambda: float(next(clock)))
+    cache.store("một", "gemini", "v1", "1", [])
+    cache.store("hai", "gemini", "v1", "2", [])
+    cache.lookup("một", "gemini", "v1")
+    cache.store("ba", "gemini", "v1", "3", [])
+
+    assert cache.stats()['size'] == 2
+    assert cache.lookup("hai", "gemini", "v1") is None
+    assert cache.lookup("một", "gemini", "v1") is not None
+    assert cache.lookup("ba", "gemini", "v1") is not None
+
+
+def test_similarity_threshold(tmp_path):
+    cache = _cache(tmp_path, similarity_threshold=0.95)
+    cache.store("câu hỏi", "gemini", "v1", "a", [], query_embedding=[1.0, 0.0])
+
+    assert cache.lookup("khác", "gemini", "v1", [1.0, 0.5]) is None
+    hit = cache.lookup("khác", "gemini", "v1", [1.0, 0.1])
+    assert hit['answer'] == "a" and hit['match'].startswith("similar")
+
+
+def test_answers_survive_reopen(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("câu hỏi", "gemini", "v1", "a", [Document(page_content="x", metadata={'page': 1})],
+                query_embedding=[1.0, 0.0])
+    cache._conn.close()
+
+    reopened = _cache(tmp_path)
+    hit = reopened.lookup("câu hỏi khác", "gemini", "v1", [1.0, 0.0])
+    assert hit['answer'] == "a"
+    assert hit['source_documents'][0].metadata == {'page': 1}
@@ -0,0 +1,86 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from langchain.schema import Document
+
+import api_server
+from llm_rag import EVENT_DONE, EVENT_SOURCES, EVENT_TOKEN
+
+
+class FakeStream:
+    """stream_answer giả: chờ retrieval_s trước nguồn, llm_s trước mỗi token"""
+
+    def __init__(self, retrieval_s: float = 0.0, llm_s: float = 0.0):
+        self.retrieval_s = retrieval_s
+        self.llm_s = llm_s
+        self.closed = threading.Event()
+
+    def __call__(self, chain, question, model_type, use_cache, source_files):
+        try:
+            time.sleep(self.retrieval_s)
+            yield EVENT_SOURCES, [Document(page_content="nguồn", metadata={'page': 1})]
+            for token in ("xin ", "chào"):
+                time.sleep(self.llm_s)
+                yield EVENT_TOKEN, token
+            yield EVENT_DONE, {'total_s': 0.1, 'cached': None, 'trace_id': 't'}
+        finally:
+            self.closed.set()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(api_server, 'get_qa_chain', lambda model_type: object())
+    service = api_server.QueryService(retrieval_workers=1, llm_concurrency=1,
+                                      max_pending=4, timeout_s=5)
+    yield service
+    service.shutdown()
+
+
+async def _ask(service, timeout_s):
+    assert service.try_acquire()
+    return await service.answer("câu hỏi", "fake", timeout_s=timeout_s)
+
+
+async def _wait_for(condition, timeout_s: float = 2.0):
+    deadline = time.monotonic() + timeout_s
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def test_answer_releases_slot(monkeypatch, service):
+    monkeypatch.setattr(api_server, 'stream_answer', FakeStream())
+    result = asyncio.run(_ask(service, 1))
+    assert result['answer'] == "xin chào"
+    assert result['sources'][0]['page'] == 1
+    assert service.pending == 0
+
+
+def test_retrieval_timeout_holds_slot_until_thread_finishes(monkeypatch, service):
+    stream = FakeStream(retrieval_s=0.3)
+    monkeypatch.setattr(api_server, 'stream_answer', stream)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await _ask(service, 0.05)
+        # Thread retrieval vẫn chạy: chỗ chưa được trả
+        assert service.pending == 1
+        await _wait_for(lambda: service.pending == 0)
+        assert service.pending == 0
+        assert stream.closed.wait(1)
+
+    asyncio.run(scenario())
+
+
+def test_llm_timeout_holds_slot_until_generation_stops(monkeypatch, service):
+    monkeypatch.setattr(api_server, 'stream_answer', FakeStream(llm_s=0.3))
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await _ask(service, 0.1)
+        assert service.pending == 1
+        await _wait_for(lambda: service.pending == 0)
+        assert service.pending == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from batch_qa import read_completed, read_questions
+
+
+def _write(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return str(path)
+
+
+def test_read_questions_keeps_falsy_ids(tmp_path):
+    path = _write(tmp_path / "q.jsonl", [
+        json.dumps({'id': 0, 'question': 'a'}),
+        json.dumps({'id': 1, 'question': 'b'}),
+        json.dumps({'id': '', 'question': 'c'}),
+        json.dumps({'question': '  '}),
+    ])
+    assert [q['id'] for q in read_questions(path)] == ['0', '1', '3']
+
+
+def test_read_questions_csv(tmp_path):
+    path = _write(tmp_path / "q.csv", ["id,question", "x,Câu một", ",Câu hai"])
+    assert read_questions(path) == [{'id': 'x', 'question': 'Câu một'},
+                                    {'id': '2', 'question': 'Câu hai'}]
+
+
+def test_read_questions_rejects_duplicate_ids(tmp_path):
+    path = _write(tmp_path / "q.jsonl", [
+        json.dumps({'id': 0, 'question': 'a'}),
+        json.dumps({'question': 'b'}),
+        json.dumps({'id': '2', 'question': 'c'}),
+    ])
+    with pytest.raises(ValueError, match="'2'"):
+        read_questions(path)
+
+
+def test_read_completed_skips_errors_and_partial_line(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    path.write_text(json.dumps({'id': '1', 'answer': 'x'}) + "\n"
+                    + json.dumps({'id': '2', 'error': 'timeout'}) + "\n"
+                    + '{"id": "3", "ans', encoding='utf-8')
+    assert read_completed(str(path)) == {'1'}
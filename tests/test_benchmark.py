@@ -0,0 +1,67 @@
+import os
+
+import pypdf
+from langchain.schema import Document
+
+import benchmark
+
+
+def _results(**metrics):
+    return {'config': {'seed': 1}, 'runs': {'20': metrics}}
+
+
+def test_synthetic_pdf_is_reproducible(tmp_path):
+    first, second, other = (str(tmp_path / name) for name in ("a.pdf", "b.pdf", "c.pdf"))
+    benchmark.write_synthetic_pdf(first, 3, seed=7)
+    benchmark.write_synthetic_pdf(second, 3, seed=7)
+    benchmark.write_synthetic_pdf(other, 3, seed=8)
+
+    with open(first, 'rb') as f, open(second, 'rb') as g, open(other, 'rb') as h:
+        content = f.read()
+        assert content == g.read() and content != h.read()
+    reader = pypdf.PdfReader(first)
+    assert len(reader.pages) == 3
+    words = reader.pages[0].extract_text().split()
+    assert len(words) >= benchmark.LINES_PER_PAGE * benchmark.WORDS_PER_LINE
+    assert set(word.rstrip('.') for word in words) <= set(benchmark.VOCABULARY)
+
+
+def test_make_corpus_splits_pages(tmp_path):
+    paths = benchmark.make_corpus(str(tmp_path / "corpus"), 30)
+    assert [os.path.basename(path) for path in paths] == [
+        "synthetic_000_1p.pdf", "synthetic_001_5p.pdf", "synthetic_002_20p.pdf",
+        "synthetic_003_4p.pdf"]
+    assert sum(len(pypdf.PdfReader(path).pages) for path in paths) == 30
+
+
+def test_make_queries_is_deterministic():
+    chunks = [Document(page_content=" ".join(f"w{i}_{j}" for j in range(20))) for i in range(5)]
+    queries = benchmark.make_queries(chunks, 10, seed=3)
+    assert queries == benchmark.make_queries(chunks, 10, seed=3)
+    assert all(len(query.split()) == 8 for query in queries)
+    assert all(any(query in chunk.page_content for chunk in chunks) for query in queries)
+
+
+def test_compare_to_baseline_flags_regressions():
+    baseline = _results(query_p50_ms=10.0, build_s=1.0, recall_at_k=0.95)
+    assert benchmark.compare_to_baseline(
+        _results(query_p50_ms=11.9, build_s=0.5, recall_at_k=0.94), baseline) == []
+
+    regressions = benchmark.compare_to_baseline(
+        _results(query_p50_ms=12.5, build_s=1.1, recall_at_k=0.92), baseline)
+    assert regressions == ["20: query_p50_ms 10.0 → 12.5", "20: recall_at_k 0.95 → 0.92"]
+
+
+def test_compare_to_baseline_ignores_noise():
+    # Chênh lệch tuyệt đối nhỏ hơn min_delta không tính dù vượt tỷ lệ
+    baseline = _results(query_p50_ms=0.5, build_s=0.01)
+    assert benchmark.compare_to_baseline(_results(query_p50_ms=1.2, build_s=0.05), baseline) == []
+
+    # Throughput của giai đoạn chạy quá ngắn không được so
+    baseline = _results(pages_per_s=1000.0, parse_s=0.02)
+    assert benchmark.compare_to_baseline(_results(pages_per_s=100.0, parse_s=0.1), baseline) == []
+    assert benchmark.compare_to_baseline(_results(pages_per_s=100.0, parse_s=1.0), baseline) == [
+        "20: pages_per_s 1000.0 → 100.0"]
+
+    # Kích thước hoặc metric không có trong baseline thì bỏ qua
+    assert benchmark.compare_to_baseline(_results(load_s=9.0), {'runs': {'400': {'load_s': 1.0}}}) == []
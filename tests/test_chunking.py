@@ -0,0 +1,80 @@
+from langchain.schema import Document
+
+import chunking
+from chunking import MIN_CHUNK_CHARS, enhance_chunks, load_and_split
+
+
+def _write_pdf(path, pages):
+    """Ghi PDF tối giản: mỗi trang là các dòng text Helvetica"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                   " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)),
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, lines in enumerate(pages):
+        stream = "BT /F1 10 Tf 20 800 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n").encode()
+    path.write_bytes(out)
+
+
+def _pages(n_pages, lines=60):
+    return [[f"Trang {p} dong {i} quy dinh ve giay phep xay dung va kien truc." for i in range(lines)]
+            for p in range(n_pages)]
+
+
+def test_enhance_chunks_drops_short_chunks_and_keeps_ids():
+    docs = [Document(page_content="x" * MIN_CHUNK_CHARS),
+            Document(page_content="  ngắn  "),
+            Document(page_content="y" * 100, metadata={'page': 2})]
+    enhanced = enhance_chunks(docs, "a.pdf")
+
+    assert [doc.metadata['chunk_id'] for doc in enhanced] == [0, 2]
+    assert enhanced[1].metadata == {'page': 2, 'source_file': "a.pdf",
+                                    'chunk_id': 2, 'chunk_length': 100}
+
+
+def test_load_and_split(tmp_path):
+    pdf_path = tmp_path / "luat.pdf"
+    _write_pdf(pdf_path, _pages(2))
+    chunks = load_and_split(str(pdf_path))
+
+    assert len(chunks) > 2
+    assert all(len(doc.page_content) <= chunking.CHUNK_SIZE for doc in chunks)
+    assert {doc.metadata['page'] for doc in chunks} == {0, 1}
+    assert {doc.metadata['source_file'] for doc in chunks} == {"luat.pdf"}
+    assert [doc.metadata['chunk_id'] for doc in chunks] == list(range(len(chunks)))
+
+
+def test_iter_chunks_matches_load_and_split(tmp_path):
+    pdf_path = tmp_path / "luat.pdf"
+    pages = _pages(3)
+    pages[1] = ["ngan"]  # Trang gần như rỗng: chunk bị bỏ nhưng vẫn giữ số thứ tự
+    _write_pdf(pdf_path, pages)
+
+    streamed = list(chunking.iter_chunks(str(pdf_path)))
+    loaded = load_and_split(str(pdf_path))
+    assert [(doc.page_content, doc.metadata) for doc in streamed] == \
+        [(doc.page_content, doc.metadata) for doc in loaded]
+
+
+def test_iter_chunk_batches(monkeypatch):
+    chunks = [Document(page_content=str(i)) for i in range(7)]
+    monkeypatch.setattr(chunking, "iter_chunks", lambda pdf_path: iter(chunks))
+
+    batches = list(chunking.iter_chunk_batches("a.pdf", 3))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [doc for batch in batches for doc in batch] == chunks
+
+    monkeypatch.setattr(chunking, "iter_chunks", lambda pdf_path: iter([]))
+    assert list(chunking.iter_chunk_batches("a.pdf", 3)) == []
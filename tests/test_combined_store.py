@@ -0,0 +1,108 @@
+import os
+
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+import pre_doc
+import storage
+from embeddings import CachedQueryEmbeddings
+from shards import SEARCH_COMBINED, ShardSet
+
+SHARED = "Điều 1. Phạm vi điều chỉnh của văn bản này áp dụng cho mọi tổ chức."
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    """Thư mục vector store tạm và combined store chưa load"""
+    vector_stores = str(tmp_path / "vector_stores")
+    os.makedirs(vector_stores)
+    embeddings = CachedQueryEmbeddings(DeterministicFakeEmbedding(size=16),
+                                       tag=pre_doc.get_embedding_tag())
+    monkeypatch.setattr(pre_doc, "VECTOR_STORES_DIR", vector_stores)
+    monkeypatch.setattr(pre_doc, "COMBINED_STORE_DIR", os.path.join(vector_stores, "_combined"))
+    monkeypatch.setattr(pre_doc, "SEARCH_MODE", SEARCH_COMBINED)
+    monkeypatch.setattr(pre_doc, "get_embeddings", lambda: embeddings)
+    _reset(monkeypatch)
+    return vector_stores
+
+
+def _reset(monkeypatch):
+    """Như khởi động lại process: combined store phải đọc lại từ disk"""
+    monkeypatch.setattr(pre_doc, "_combined_store", None)
+    monkeypatch.setattr(pre_doc, "_combined_documents", {})
+    monkeypatch.setattr(pre_doc, "_combined_index_info", {})
+    monkeypatch.setattr(pre_doc, "_combined_dedup", None)
+    monkeypatch.setattr(pre_doc, "_live_index", (None, None))
+    monkeypatch.setattr(pre_doc, "_shards", ShardSet(pre_doc._load_shard))
+
+
+def _document_store(store_dir, filename, texts):
+    """Vector store riêng của một document, trả về store_key"""
+    store = FAISS.from_texts(
+        texts, pre_doc.get_embeddings(),
+        metadatas=[{'source_file': filename, 'chunk_id': i} for i in range(len(texts))])
+    store_key = f"{filename}_{len(texts):08x}"
+    storage.save_store(store, os.path.join(store_dir, store_key))
+    return store_key
+
+
+def _texts(combined):
+    return sorted(combined.docstore.search(combined.index_to_docstore_id[i]).page_content
+                  for i in range(combined.index.ntotal))
+
+
+def test_add_documents_incrementally(store_dir, monkeypatch):
+    a = _document_store(store_dir, "a.pdf", ["giấy phép xây dựng nhà ở", SHARED])
+    b = _document_store(store_dir, "b.pdf", ["chứng chỉ hành nghề kiến trúc", SHARED, "quy hoạch"])
+
+    pre_doc.add_to_combined_store(a)
+    version = pre_doc.get_index_version()
+    combined = pre_doc.add_to_combined_store(b)
+    assert pre_doc.get_index_version() != version
+    # Chunk giống hệt ở hai document chỉ lưu một lần
+    assert combined.index.ntotal == 4
+    assert _texts(combined).count(SHARED) == 1
+
+    _reset(monkeypatch)
+    loaded = pre_doc.load_combined_store()
+    assert isinstance(loaded.index, storage.MmapFlatIndex)
+    assert _texts(loaded) == _texts(combined)
+    assert sorted(pre_doc._combined_documents) == [a, b]
+    assert pre_doc._combined_documents[b]['duplicates'] == {'exact': 1, 'near': 0}
+
+    store, sparse_index = pre_doc.get_live_index()
+    doc_id = sparse_index.search("chứng chỉ hành nghề", 1)[0][0]
+    assert store.docstore.search(doc_id).metadata['source_file'] == "b.pdf"
+    # Thêm lại document đã có thì không đổi gì
+    assert pre_doc.add_to_combined_store(b).index.ntotal == 4
+
+
+def test_remove_keeps_shared_chunks(store_dir, monkeypatch):
+    a = _document_store(store_dir, "a.pdf", ["giấy phép xây dựng nhà ở", SHARED])
+    b = _document_store(store_dir, "b.pdf", ["chứng chỉ hành nghề kiến trúc", SHARED])
+    pre_doc.add_to_combined_store(a)
+    pre_doc.add_to_combined_store(b)
+
+    combined = pre_doc.remove_from_combined_store(a)
+    assert _texts(combined) == sorted(["chứng chỉ hành nghề kiến trúc", SHARED])
+    _, sparse_index = pre_doc.get_live_index()
+    assert sparse_index.search("giấy phép", 5) == []
+    shared_id = sparse_index.search("phạm vi điều chỉnh", 1)[0][0]
+    assert combined.docstore.search(shared_id).metadata['source_file'] == "b.pdf"
+
+    _reset(monkeypatch)
+    assert list(pre_doc._load_combined_manifest()[0]) == [b]
+    assert pre_doc.load_combined_store().index.ntotal == 2
+
+
+def test_sync_adds_and_removes(store_dir):
+    a = _document_store(store_dir, "a.pdf", ["giấy phép xây dựng nhà ở"])
+    b = _document_store(store_dir, "b.pdf", ["chứng chỉ hành nghề", "quy hoạch đô thị"])
+    documents = [{'vector_store_path': os.path.join(store_dir, key), 'has_vector_store': True}
+                 for key in (a, b)]
+
+    assert pre_doc.sync_combined_store(documents).index.ntotal == 3
+    assert pre_doc.sync_combined_store(documents[1:]).index.ntotal == 2
+    assert list(pre_doc._combined_documents) == [b]
+    assert pre_doc._shards.keys() == [b]
@@ -0,0 +1,75 @@
+import pytest
+from langchain.schema import Document
+
+import context_builder
+from context_builder import build_context, drop_near_duplicates, merge_adjacent_chunks, pack_documents
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    """Đếm token theo số ký tự để kết quả không phụ thuộc việc có tiktoken hay không"""
+    monkeypatch.setattr(context_builder, "_encoder", False)
+    monkeypatch.setattr(context_builder, "CHARS_PER_TOKEN", 1.0)
+
+
+def _chunk(text, chunk_id, page=0, source_file="a.pdf"):
+    return Document(page_content=text, metadata={'source_file': source_file, 'page': page,
+                                                 'chunk_id': chunk_id})
+
+
+def test_merges_adjacent_chunks_and_removes_overlap():
+    docs = [_chunk("quy định chung về phạm vi", 2),
+            _chunk("khác trang", 3, page=1),
+            _chunk("điều một quy định chung", 1)]
+    merged = merge_adjacent_chunks(docs)
+
+    assert [doc.page_content for doc in merged] == [
+        "điều một quy định chung về phạm vi", "khác trang"]
+    assert merged[0].metadata['chunk_ids'] == [1, 2]
+    assert merged[0].metadata['chunk_id'] == 1
+    # Document gốc không bị sửa
+    assert docs[0].page_content == "quy định chung về phạm vi"
+
+    # Không có phần trùng: nối bằng xuống dòng
+    merged = merge_adjacent_chunks([_chunk("phần một", 1), _chunk("phần hai", 2)])
+    assert merged[0].page_content == "phần một\nphần hai"
+
+
+def test_non_adjacent_and_repeated_chunks():
+    docs = [_chunk("chunk năm", 5), _chunk("chunk một", 1), _chunk("chunk năm", 5),
+            Document(page_content="không có chunk_id")]
+    merged = merge_adjacent_chunks(docs)
+    assert [doc.page_content for doc in merged] == ["chunk năm", "chunk một", "không có chunk_id"]
+
+
+def test_drop_near_duplicates_keeps_higher_ranked():
+    text = "thủ tục cấp giấy phép xây dựng nhà ở riêng lẻ tại đô thị"
+    docs = [_chunk(text, 1), _chunk(text.upper(), 1, source_file="b.pdf"),
+            _chunk("tại đô thị", 9), _chunk("hồ sơ gồm đơn đề nghị", 4)]
+    kept = drop_near_duplicates(docs)
+    assert [doc.metadata['chunk_id'] for doc in kept] == [1, 4]
+
+
+def test_pack_documents_skips_and_truncates():
+    docs = [Document(page_content="a" * 6), Document(page_content="b" * 6),
+            Document(page_content="c" * 3)]
+    packed, used = pack_documents(docs, 10)
+    assert [doc.page_content for doc in packed] == ["a" * 6, "c" * 3]
+    assert used == 9
+
+    packed, used = pack_documents([Document(page_content="x" * 20)], 5)
+    assert packed[0].page_content == "x" * 5 and packed[0].metadata['truncated']
+    assert used == 5
+
+
+def test_build_context_stats():
+    docs = [_chunk("một hai ba bốn năm", 1), _chunk("sáu bảy tám chín mười", 2),
+            _chunk("một hai ba bốn năm", 1, source_file="b.pdf"),
+            _chunk("x" * 50, 7)]
+    packed, stats = build_context(docs, "gemini", budget=40)
+    assert [doc.metadata['source_file'] for doc in packed] == ["a.pdf"]
+    assert stats == {'retrieved_chunks': 4, 'merged_chunks': 1, 'duplicates_dropped': 1,
+                     'dropped_for_budget': 1, 'context_chunks': 1,
+                     'context_tokens': len(packed[0].page_content), 'budget_tokens': 40}
+    assert context_builder.get_context_budget("openai") == context_builder.CONTEXT_TOKEN_BUDGETS["openai"]
+    assert context_builder.get_context_budget("khác") == context_builder.DEFAULT_CONTEXT_TOKEN_BUDGET
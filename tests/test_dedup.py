@@ -0,0 +1,52 @@
+from dedup import DedupIndex, content_hash, estimate_similarity, minhash_signature
+
+TEXT = ("Điều 3. Mức phạt tiền đối với hành vi vi phạm quy định về an toàn lao động "
+        "là từ 5.000.000 đồng đến 10.000.000 đồng đối với cá nhân vi phạm lần đầu, "
+        "và từ 10.000.000 đồng đến 20.000.000 đồng đối với tổ chức vi phạm")
+REVISED = TEXT.replace("20.000.000", "40.000.000")
+
+
+def test_content_hash_ignores_case_and_whitespace():
+    assert content_hash("Điều  3\nMức phạt") == content_hash("điều 3 mức PHẠT")
+
+
+def test_minhash_estimates_similarity():
+    assert estimate_similarity(minhash_signature(TEXT), minhash_signature(TEXT)) == 1.0
+    assert estimate_similarity(minhash_signature(TEXT),
+                               minhash_signature("một đoạn văn hoàn toàn khác hẳn")) < 0.2
+
+
+def test_exact_duplicate_found():
+    index = DedupIndex(near=False)
+    index.add("a", TEXT, "doc1")
+    assert index.find_duplicate(TEXT.upper()) == ("a", 'exact')
+
+
+def test_near_duplicate_kept_unless_enabled():
+    index = DedupIndex(near=False)
+    index.add("a", TEXT, "doc1")
+    assert index.find_duplicate(REVISED) == (None, '')
+
+    near = DedupIndex(threshold=0.5, near=True)
+    near.add("a", TEXT, "doc1")
+    assert near.find_duplicate(REVISED) == ("a", 'near')
+
+
+def test_release_returns_orphaned_ids():
+    index = DedupIndex(near=False)
+    index.add("a", TEXT, "doc1")
+    index.add_reference("a", "doc2")
+    assert index.release(["a"], "doc1") == []
+    assert index.release(["a"], "doc2") == ["a"]
+    assert "a" not in index and index.find_duplicate(TEXT) == (None, '')
+
+
+def test_save_load_rebuilds_references(tmp_path):
+    index = DedupIndex(near=False)
+    index.add("a", TEXT, "doc1")
+    path = str(tmp_path / "dedup_index.npz")
+    index.save(path)
+
+    loaded = DedupIndex.load(path, {"doc1": {'ids': ["a"]}, "doc2": {'ids': ["a"]}})
+    assert loaded.find_duplicate(TEXT) == ("a", 'exact')
+    assert loaded.report()['shared_chunks'] == 1
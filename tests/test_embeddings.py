@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import List
+
+import pytest
+from langchain.schema.embeddings import Embeddings
+
+import embeddings
+from embeddings import CachedQueryEmbeddings, embed_queries
+
+
+class AsymmetricEmbeddings(Embeddings):
+    """Model giả có encoder câu hỏi khác encoder chunk, đếm số lần gọi"""
+
+    def __init__(self):
+        self.query_calls = 0
+        self.document_calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.document_calls += 1
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.query_calls += 1
+        return [float(len(text)), 1.0]
+
+
+def test_embed_queries_uses_query_encoder():
+    base = AsymmetricEmbeddings()
+    assert embed_queries(base, ["ab", "c"]) == [[2.0, 1.0], [1.0, 1.0]]
+    assert base.document_calls == 0
+
+
+def test_cached_embed_queries_checks_cache_per_query():
+    base = AsymmetricEmbeddings()
+    cached = CachedQueryEmbeddings(base, max_size=10)
+    cached.embed_query("ab")
+
+    vectors = cached.embed_queries(["ab", "xyz", "xyz"])
+    assert vectors == [[2.0, 1.0], [3.0, 1.0], [3.0, 1.0]]
+    assert base.query_calls == 2  # "ab" lấy từ cache, "xyz" chỉ embed một lần
+    assert cached.embed_query("xyz") == [3.0, 1.0] and base.query_calls == 2
+    assert cached.cache_info()['hits'] == 2
+
+
+def test_cache_evicts_least_recently_used():
+    cached = CachedQueryEmbeddings(AsymmetricEmbeddings(), max_size=2)
+    cached.embed_queries(["a", "bb", "ccc"])
+    assert cached.cache_info()['size'] == 2
+    cached.embed_query("a")
+    assert cached.cache_info()['misses'] == 4
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registry rỗng với backend giả đếm số lần load model"""
+    loads = []
+
+    def factory(model_name, device):
+        loads.append((model_name, device))
+        time.sleep(0.05)  # Load chậm để các thread gọi cùng lúc
+        return AsymmetricEmbeddings()
+
+    monkeypatch.setattr(embeddings, "_registry", {})
+    monkeypatch.setattr(embeddings, "_registry_stats", {})
+    monkeypatch.setitem(embeddings._embedding_backends, "fake", factory)
+    return loads
+
+
+def test_get_embeddings_loads_each_model_once(registry):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        embeddings.get_embeddings("m", "cpu", backend="fake"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert registry == [("m", "cpu")]
+    assert all(result is results[0] for result in results)
+    assert embeddings.get_embeddings("m", "cuda", backend="fake") is not results[0]
+    assert registry == [("m", "cpu"), ("m", "cuda")]
+
+
+def test_loaded_models_report(registry):
+    embeddings.get_embeddings("m", "cpu", backend="fake").embed_query("a")
+    info, = embeddings.get_loaded_models()
+    assert info['model_name'] == "m" and info['backend'] == "fake"
+    assert info['tag'] == embeddings.get_embedding_tag("m", "fake")
+    assert info['load_time_s'] >= 0.05
+    assert info['query_cache']['misses'] == 1
+
+
+def test_unknown_backend(registry):
+    with pytest.raises(ValueError, match="không được hỗ trợ"):
+        embeddings.get_embeddings("m", "cpu", backend="khác")
+    assert registry == []
@@ -0,0 +1,71 @@
+import faiss
+import numpy as np
+import pytest
+
+import faiss_index
+from faiss_index import (
+    INDEX_FLAT,
+    INDEX_HNSW,
+    INDEX_IVF,
+    INDEX_IVF_PQ,
+    apply_search_params,
+    build_index,
+    choose_index_type,
+    get_index_type,
+    recall_report,
+    supports_remove,
+)
+
+
+def _vectors(n, d=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+
+
+def test_choose_index_type():
+    assert choose_index_type(10) == INDEX_FLAT
+    assert choose_index_type(faiss_index.FLAT_MAX_VECTORS) == INDEX_IVF
+    assert choose_index_type(faiss_index.IVF_MAX_VECTORS) == INDEX_IVF_PQ
+
+
+def test_small_corpus_falls_back_to_flat():
+    index, params = build_index(_vectors(20), INDEX_IVF)
+    assert get_index_type(index) == INDEX_FLAT and supports_remove(index)
+    assert params['fallback_from'] == INDEX_IVF and params['ntotal'] == 20
+
+    _, params = build_index(_vectors(2000), INDEX_IVF_PQ)
+    assert params['index_type'] == INDEX_FLAT and params['fallback_from'] == INDEX_IVF_PQ
+
+
+def test_build_ivf_with_params():
+    vectors = _vectors(2000)
+    index, params = build_index(vectors, INDEX_IVF, nprobe=4)
+    assert params['index_type'] == INDEX_IVF and 'fallback_from' not in params
+    assert params['nlist'] == faiss_index._default_nlist(2000) and params['nprobe'] == 4
+    assert not supports_remove(index)
+
+    apply_search_params(index, {'nprobe': params['nlist']})
+    assert faiss.extract_index_ivf(index).nprobe == params['nlist']
+    # Quét mọi cụm thì kết quả giống exact search
+    assert recall_report(index, vectors, k=5, n_queries=50)['recall_at_k'] == 1.0
+
+
+def test_build_hnsw():
+    vectors = _vectors(500)
+    index, params = build_index(vectors, INDEX_HNSW, ef_search=32)
+    assert params['index_type'] == INDEX_HNSW and params['ef_search'] == 32
+    apply_search_params(index, {'ef_search': 128})
+    assert index.hnsw.efSearch == 128
+    assert recall_report(index, vectors, k=5, n_queries=50)['recall_at_k'] >= 0.9
+
+
+def test_default_pq_m_divides_dimension():
+    for dimension in (384, 768, 100, 7):
+        m = faiss_index._default_pq_m(dimension)
+        assert dimension % m == 0
+
+
+@pytest.mark.parametrize("n_vectors", [10, 5000])
+def test_default_nlist_has_enough_training_points(n_vectors):
+    nlist = faiss_index._default_nlist(n_vectors)
+    assert nlist >= 1
+    assert nlist == 1 or n_vectors // nlist >= faiss_index.MIN_POINTS_PER_CENTROID
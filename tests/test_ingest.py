@@ -0,0 +1,92 @@
+import os
+
+import pytest
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import ingest
+import storage
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Embedding giả ghi lại kích thước từng batch"""
+
+    batches: list = []
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    fake = CountingEmbeddings(size=8, batches=[])
+    monkeypatch.setattr(ingest, "get_embeddings", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """load_and_split giả: số chunk theo tên file, 'hong.pdf' lỗi, 'rong.pdf' không có chunk"""
+    def load_and_split(pdf_path):
+        name = os.path.basename(pdf_path)
+        if name == "hong.pdf":
+            raise ValueError("PDF hỏng")
+        count = 0 if name == "rong.pdf" else int(name.split('.')[0])
+        return [Document(page_content=f"{name} chunk {i}",
+                         metadata={'source_file': name, 'chunk_id': i}) for i in range(count)]
+    monkeypatch.setattr(ingest, "load_and_split", load_and_split)
+
+
+def test_ingest_batches_across_documents(tmp_path, embeddings, parsed):
+    jobs = [(f"{n}.pdf", str(tmp_path / f"{n}.pdf_store")) for n in (3, 4, 2)]
+    progress, written = [], []
+    stats = ingest.ingest_documents(
+        jobs, workers=1, batch_size=4,
+        progress_callback=lambda *event: progress.append(event),
+        on_document_written=lambda key, store: written.append((key, store.index.ntotal)))
+
+    assert stats['chunks'] == 9 and stats['failed'] == {}
+    assert sorted(stats['written']) == ["2.pdf", "3.pdf", "4.pdf"]
+    # Chunk của nhiều file được gom thành batch cố định
+    assert embeddings.batches == [4, 4, 1]
+    assert sorted(written) == [("2.pdf_store", 2), ("3.pdf_store", 3), ("4.pdf_store", 4)]
+
+    store = storage.load_store(jobs[1][1], embeddings)
+    assert store.index.ntotal == 4
+    assert store.docstore.search(store.index_to_docstore_id[3]).page_content == "4.pdf chunk 3"
+
+    assert (ingest.STAGE_PARSE, 3, 3) in progress
+    assert (ingest.STAGE_EMBED, 9, 9) in progress
+    assert progress[-1] == (ingest.STAGE_WRITE, 3, 3)
+
+
+def test_ingest_reports_failures(tmp_path, embeddings, parsed):
+    jobs = [("hong.pdf", str(tmp_path / "a")), ("rong.pdf", str(tmp_path / "b")),
+            ("2.pdf", str(tmp_path / "c"))]
+    stats = ingest.ingest_documents(jobs, workers=1)
+
+    assert stats['written'] == ["2.pdf"]
+    assert stats['failed'] == {"hong.pdf": "parse: PDF hỏng",
+                               "rong.pdf": "parse: không có nội dung"}
+    assert not os.path.exists(tmp_path / "a") and not os.path.exists(tmp_path / "b")
+
+
+def test_write_failure_does_not_stop_other_documents(tmp_path, embeddings, parsed, monkeypatch):
+    original = ingest._write_document
+
+    def write_document(item, embeddings):
+        if item['pdf_path'] == "3.pdf":
+            raise OSError("hết dung lượng")
+        return original(item, embeddings)
+
+    monkeypatch.setattr(ingest, "_write_document", write_document)
+    stats = ingest.ingest_documents(
+        [("3.pdf", str(tmp_path / "a")), ("2.pdf", str(tmp_path / "b"))], workers=1)
+    assert stats['written'] == ["2.pdf"]
+    assert stats['failed'] == {"3.pdf": "write: hết dung lượng"}
+
+
+def test_no_jobs(embeddings):
+    assert ingest.ingest_documents([])['documents'] == 0
+    assert embeddings.batches == []
@@ -0,0 +1,98 @@
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    """Hàng đợi trong thư mục tạm, đồng hồ chỉnh tay được"""
+    monkeypatch.setattr(jobs, "VECTOR_STORES_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "JOBS_DB_PATH", str(tmp_path / "jobs.sqlite"))
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    return now
+
+
+def _job(job_id):
+    return next(job for job in jobs.list_jobs() if job['id'] == job_id)
+
+
+def test_enqueue_skips_identical_queued_job(clock):
+    first = jobs.enqueue(jobs.JOB_DELETE, {'path': "a.pdf"})
+    assert jobs.enqueue(jobs.JOB_DELETE, {'path': "a.pdf"}) == first
+    assert jobs.enqueue(jobs.JOB_DELETE, {'path': "b.pdf"}) != first
+
+    assert jobs.claim_next()['id'] == first
+    # Job giống hệt đang chạy thì vẫn thêm được lần sau
+    assert jobs.enqueue(jobs.JOB_DELETE, {'path': "a.pdf"}) != first
+
+
+def test_failed_job_retries_with_backoff(clock, monkeypatch):
+    calls = []
+
+    def flaky(job):
+        calls.append(job['attempts'])
+        if len(calls) < 3:
+            raise RuntimeError(f"lỗi {len(calls)}")
+        return "xong"
+
+    monkeypatch.setitem(jobs._HANDLERS, "flaky", flaky)
+    job_id = jobs.enqueue("flaky", {}, max_attempts=3)
+
+    jobs.run_job(jobs.claim_next())
+    job = _job(job_id)
+    assert job['status'] == jobs.STATUS_QUEUED and job['error'] == "lỗi 1"
+    assert job['available_at'] == clock[0] + jobs.RETRY_BACKOFF_S
+    assert jobs.claim_next() is None
+
+    clock[0] += jobs.RETRY_BACKOFF_S
+    jobs.run_job(jobs.claim_next())
+    assert _job(job_id)['available_at'] == clock[0] + 2 * jobs.RETRY_BACKOFF_S
+
+    clock[0] += 2 * jobs.RETRY_BACKOFF_S
+    jobs.run_job(jobs.claim_next())
+    job = _job(job_id)
+    assert calls == [1, 2, 3]
+    assert job['status'] == jobs.STATUS_DONE and job['message'] == "xong" and job['error'] is None
+
+
+def test_job_fails_after_max_attempts_and_can_be_retried(clock, monkeypatch):
+    monkeypatch.setitem(jobs._HANDLERS, "broken", lambda job: 1 / 0)
+    job_id = jobs.enqueue("broken", {}, max_attempts=2)
+
+    jobs.run_job(jobs.claim_next())
+    clock[0] += jobs.RETRY_BACKOFF_S
+    jobs.run_job(jobs.claim_next())
+    job = _job(job_id)
+    assert job['status'] == jobs.STATUS_FAILED and job['attempts'] == 2
+    assert job['error'] == "division by zero"
+    assert not jobs.has_active_jobs()
+
+    jobs.retry_job(job_id)
+    job = jobs.claim_next()
+    assert job['id'] == job_id and job['attempts'] == 1
+
+
+def test_interrupted_job_is_requeued(clock):
+    job_id = jobs.enqueue(jobs.JOB_REINDEX, {})
+    jobs.claim_next()
+
+    jobs._requeue_interrupted()
+    job = _job(job_id)
+    assert job['status'] == jobs.STATUS_QUEUED and job['attempts'] == 1
+    assert job['error'].startswith("Bị gián đoạn")
+
+
+def test_progress_reporter_maps_stages(clock):
+    job_id = jobs.enqueue(jobs.JOB_INGEST, {'paths': []})
+    reporter = jobs._ProgressReporter(job_id)
+    reporter(jobs.STAGE_EMBED, 1, 2)
+    job = _job(job_id)
+    assert job['progress'] == pytest.approx(1.5 / 3)
+    assert job['message'] == f"{jobs.STAGE_EMBED}: 1/2"
+
+    # Trong PROGRESS_INTERVAL_S chỉ ghi khi giai đoạn xong
+    reporter(jobs.STAGE_EMBED, 2, 3)
+    assert _job(job_id)['message'] == f"{jobs.STAGE_EMBED}: 1/2"
+    reporter(jobs.STAGE_WRITE, 4, 4)
+    assert _job(job_id)['progress'] == pytest.approx(1.0)
@@ -0,0 +1,131 @@
+from typing import List
+
+import pytest
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.chains import RetrievalQA
+from langchain.schema import BaseRetriever, Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.llms.fake import FakeStreamingListLLM
+
+import llm_rag
+from answer_cache import AnswerCache
+
+DOCS = [Document(page_content="Giấy phép xây dựng được cấp trong 20 ngày.",
+                 metadata={'source_file': "a.pdf", 'page': 0, 'chunk_id': 0})]
+
+
+class FakeRetriever(BaseRetriever):
+    calls: List[str] = []
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.calls.append(query)
+        return list(DOCS)
+
+
+@pytest.fixture
+def qa_chain(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_rag, "get_embeddings", lambda: DeterministicFakeEmbedding(size=8))
+    monkeypatch.setattr(llm_rag, "get_index_version", lambda: "v1")
+    monkeypatch.setattr(llm_rag, "_answer_cache", AnswerCache(str(tmp_path / "cache.sqlite")))
+    return RetrievalQA.from_chain_type(
+        llm=FakeStreamingListLLM(responses=["Trong 20 ngày."] * 5),
+        chain_type="stuff", retriever=FakeRetriever(calls=[]), return_source_documents=True)
+
+
+def test_stream_answer_events(qa_chain):
+    events = list(llm_rag.stream_answer(qa_chain, "Bao lâu thì có giấy phép?", "fake"))
+
+    assert events[0] == (llm_rag.EVENT_SOURCES, DOCS)
+    tokens = [payload for event, payload in events if event == llm_rag.EVENT_TOKEN]
+    assert len(tokens) > 1 and "".join(tokens) == "Trong 20 ngày."
+    event, done = events[-1]
+    assert event == llm_rag.EVENT_DONE and done['cached'] is None
+    assert done['retrieval_s'] <= done['first_token_s'] <= done['total_s']
+    assert done['context']['context_chunks'] == 1 and done['context']['prompt_tokens'] > 0
+    assert llm_rag.get_answer_cache().stats()['size'] == 1
+
+
+def test_cached_answer_skips_retrieval(qa_chain):
+    first = llm_rag.answer_query(qa_chain, "Bao lâu thì có giấy phép?", "fake")
+    second = llm_rag.answer_query(qa_chain, "bao lâu thì có giấy phép", "fake")
+
+    assert second['result'] == first['result'] == "Trong 20 ngày."
+    assert second['cached'] == "exact" and first['cached'] is None
+    assert [doc.page_content for doc in second['source_documents']] == [DOCS[0].page_content]
+    assert qa_chain.retriever.calls == ["Bao lâu thì có giấy phép?"]
+
+    third = llm_rag.answer_query(qa_chain, "bao lâu thì có giấy phép", "fake", use_cache=False)
+    assert third['cached'] is None and len(qa_chain.retriever.calls) == 2
+
+
+def test_empty_llm_response(qa_chain):
+    qa_chain.combine_documents_chain.llm_chain.llm = FakeStreamingListLLM(responses=[""])
+    result = llm_rag.answer_query(qa_chain, "câu hỏi", "fake", use_cache=False)
+    assert result['result'] == 'Không tìm thấy thông tin phù hợp.'
+
+
+def test_llm_error_propagates(qa_chain):
+    class BrokenLLM(FakeStreamingListLLM):
+        def stream(self, *args, **kwargs):
+            raise RuntimeError("mất kết nối")
+            yield
+
+    qa_chain.combine_documents_chain.llm_chain.llm = BrokenLLM(responses=[""])
+    stream = llm_rag.stream_answer(qa_chain, "câu hỏi", "fake")
+    assert next(stream)[0] == llm_rag.EVENT_SOURCES
+    with pytest.raises(RuntimeError):
+        next(stream)
+    assert llm_rag.get_answer_cache().stats()['size'] == 0
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Pool chain rỗng, backend giả đếm số lần tạo LLM client"""
+    created = []
+    version = ["v1"]
+
+    def factory():
+        created.append(object())
+        return created[-1], "fake-model"
+
+    monkeypatch.setattr(llm_rag, "_chain_pool", {})
+    monkeypatch.setitem(llm_rag._llm_backends, "test", factory)
+    monkeypatch.setattr(llm_rag, "get_index_version", lambda: version[0])
+    monkeypatch.setattr(llm_rag, "create_qa_chain",
+                        lambda model_type, llm=None: {'llm': llm, 'version': version[0]})
+    return created, version
+
+
+def test_chain_reused_across_calls(pool):
+    created, _ = pool
+    chain = llm_rag.get_qa_chain("test")
+    assert llm_rag.get_qa_chain("test") is chain
+    assert len(created) == 1
+    assert llm_rag.get_chain_pool_info() == [
+        {'provider': "test", 'model': "fake-model", 'index_version': "v1"}]
+
+
+def test_new_index_version_rebuilds_chain_with_same_llm(pool):
+    created, version = pool
+    chain = llm_rag.get_qa_chain("test")
+    version[0] = "v2"
+    rebuilt = llm_rag.get_qa_chain("test")
+
+    assert rebuilt is not chain and rebuilt['version'] == "v2"
+    assert rebuilt['llm'] is chain['llm'] and len(created) == 1
+
+
+def test_register_backend_replaces_pooled_chain(pool):
+    created, _ = pool
+    llm_rag.get_qa_chain("test")
+    replacement = object()
+    llm_rag.register_llm_backend("test", lambda: (replacement, "other"))
+
+    assert llm_rag.get_qa_chain("test")['llm'] is replacement
+    assert llm_rag.get_chain_pool_info()[0]['model'] == "other"
+
+
+def test_unknown_provider(pool):
+    with pytest.raises(ValueError, match="không được hỗ trợ"):
+        llm_rag.get_qa_chain("khác")
@@ -0,0 +1,64 @@
+import os
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+import storage
+from embeddings import LEGACY_EMBEDDING_TAG
+
+TEXTS = ["giấy phép xây dựng", "chứng chỉ hành nghề", "quy hoạch đô thị"]
+
+
+def _legacy_store(root, name):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    store = FAISS.from_texts(TEXTS, embeddings, metadatas=[{'chunk_id': i} for i in range(3)])
+    path = os.path.join(root, name)
+    store.save_local(path)
+    return path, embeddings, store
+
+
+def test_migrate_store(tmp_path):
+    path, embeddings, store = _legacy_store(str(tmp_path), "a.pdf_1234")
+    assert storage.is_legacy_store(path)
+
+    assert storage.migrate_store(path, embeddings) == len(TEXTS)
+    assert not storage.is_legacy_store(path) and storage.has_mmap_layout(path)
+    assert not os.path.exists(os.path.join(path, storage.LEGACY_PICKLE_FILE))
+    assert not os.path.exists(os.path.join(path, storage.INDEX_FILE))
+    assert not os.path.exists(f"{path}.migrate")
+    # Vectors trong pickle cũ do model mặc định tạo ra
+    assert storage.get_store_embedding(path) == LEGACY_EMBEDDING_TAG
+
+    loaded = storage.load_store(path, embeddings)
+    assert [d.page_content for d in loaded.similarity_search(TEXTS[1], k=3)] == \
+        [d.page_content for d in store.similarity_search(TEXTS[1], k=3)]
+    assert loaded.similarity_search(TEXTS[2], k=1)[0].metadata == {'chunk_id': 2}
+
+
+def test_keep_pickle(tmp_path):
+    path, embeddings, _ = _legacy_store(str(tmp_path), "a.pdf_1234")
+    storage.migrate_store(path, embeddings, keep_pickle=True)
+    assert os.path.exists(os.path.join(path, storage.LEGACY_PICKLE_FILE))
+    assert storage.has_mmap_layout(path) and not storage.is_legacy_store(path)
+
+
+def test_migrate_vector_stores(tmp_path):
+    root = str(tmp_path)
+    _, embeddings, _ = _legacy_store(root, "a.pdf_1111")
+    _legacy_store(root, "b.pdf_2222")
+    broken = os.path.join(root, "c.pdf_3333")
+    os.makedirs(broken)
+    with open(os.path.join(broken, storage.LEGACY_PICKLE_FILE), 'wb') as f:
+        f.write(b"not a pickle")
+
+    assert storage.migrate_vector_stores(root, None, dry_run=True) == [
+        ("a.pdf_1111", "cần migrate"), ("b.pdf_2222", "cần migrate"),
+        ("c.pdf_3333", "cần migrate")]
+
+    results = dict(storage.migrate_vector_stores(root, embeddings))
+    assert results["a.pdf_1111"] == results["b.pdf_2222"] == "OK (3 chunks)"
+    assert results["c.pdf_3333"].startswith("Lỗi")
+    # Lần chạy sau chỉ còn store bị hỏng
+    assert [name for name, _ in storage.migrate_vector_stores(root, None, dry_run=True)] == \
+        ["c.pdf_3333"]
+    assert storage.migrate_vector_stores(str(tmp_path / "missing"), embeddings) == []
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import pytest
+
+import embeddings
+import onnx_embeddings
+from onnx_embeddings import OnnxEmbeddings
+
+
+class FakeTokenizer:
+    """Mỗi từ là một token; id = độ dài từ"""
+
+    def __call__(self, texts, padding, truncation, max_length, return_tensors):
+        tokens = [[len(word) for word in text.split()][:max_length] for text in texts]
+        width = max(len(ids) for ids in tokens)
+        return {
+            'input_ids': np.array([ids + [0] * (width - len(ids)) for ids in tokens]),
+            'attention_mask': np.array([[1] * len(ids) + [0] * (width - len(ids)) for ids in tokens]),
+        }
+
+
+class FakeSession:
+    """Hidden state của token = [id, 1]; ghi lại kích thước từng batch"""
+
+    def __init__(self):
+        self.batches = []
+
+    def run(self, outputs, inputs):
+        ids = inputs['input_ids'].astype(np.float32)
+        self.batches.append(ids.shape[0])
+        assert (inputs['token_type_ids'] == 0).all()
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+
+def _model(batch_size=2, max_seq_length=256):
+    # Không cần onnxruntime: thay session và tokenizer bằng bản giả
+    model = OnnxEmbeddings.__new__(OnnxEmbeddings)
+    model.session = FakeSession()
+    model.input_names = {'input_ids', 'attention_mask', 'token_type_ids'}
+    model.tokenizer = FakeTokenizer()
+    model.batch_size = batch_size
+    model.max_seq_length = max_seq_length
+    model._tokenizer_lock = threading.Lock()
+    return model
+
+
+def _expected(word_lengths):
+    pooled = np.array([np.mean(word_lengths), 1.0])
+    return pooled / np.linalg.norm(pooled)
+
+
+def test_mean_pooling_ignores_padding():
+    model = _model()
+    vector = model.embed_query("abc d")
+    assert np.allclose(vector, _expected([3, 1]))
+    # Câu ngắn trong batch có padding vẫn ra cùng vector
+    vectors = model.embed_documents(["abc d", "abcdefgh ab abc"])
+    assert np.allclose(vectors[0], vector)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+
+
+def test_embed_documents_batches_by_length_and_keeps_order():
+    model = _model(batch_size=2)
+    texts = ["aaaa aaaa aaaa", "a", "aa aa", "aaa aaa aaa aaa"]
+    vectors = model.embed_documents(texts)
+    assert model.session.batches == [2, 2]
+    for text, vector in zip(texts, vectors):
+        assert np.allclose(vector, _expected([len(word) for word in text.split()]))
+    assert model.embed_documents([]) == []
+    assert model.embed_queries(["a", "aa"]) == model.embed_documents(["a", "aa"])
+
+
+def test_truncates_to_max_seq_length():
+    model = _model(max_seq_length=2)
+    assert np.allclose(model.embed_query("a aaa aaaaaaaa"), _expected([1, 3]))
+
+
+def test_hub_name():
+    assert onnx_embeddings._hub_name("all-MiniLM-L6-v2") == "sentence-transformers/all-MiniLM-L6-v2"
+    assert onnx_embeddings._hub_name("intfloat/e5-small") == "intfloat/e5-small"
+
+
+def test_exported_model_is_reused(tmp_path):
+    (tmp_path / onnx_embeddings.ONNX_INT8_MODEL_FILE).write_bytes(b"")
+    # File đã có thì không import torch/transformers để export lại
+    assert onnx_embeddings.export_onnx_model("m", str(tmp_path)) == \
+        str(tmp_path / onnx_embeddings.ONNX_INT8_MODEL_FILE)
+
+
+def test_missing_dependency_message(monkeypatch):
+    def export_onnx_model(model_name, output_dir, quantize):
+        raise ModuleNotFoundError("No module named 'onnxruntime'", name="onnxruntime")
+
+    monkeypatch.setattr(onnx_embeddings, "export_onnx_model", export_onnx_model)
+    with pytest.raises(ImportError, match="thiếu thư viện onnxruntime.*requirements-onnx.txt"):
+        embeddings._create_onnx("m", "cpu")
+
+
+@pytest.mark.parametrize("backend, quantize, version, tag", [
+    (embeddings.EMBEDDING_BACKEND_SENTENCE_TRANSFORMERS, True, "", "m"),
+    (embeddings.EMBEDDING_BACKEND_ONNX, True, "", "m+int8"),
+    (embeddings.EMBEDDING_BACKEND_ONNX, False, "", "m+onnx"),
+    (embeddings.EMBEDDING_BACKEND_ONNX, True, "2", "m+int8@2"),
+])
+def test_embedding_tag(monkeypatch, backend, quantize, version, tag):
+    monkeypatch.setattr(embeddings, "ONNX_QUANTIZE", quantize)
+    monkeypatch.setattr(embeddings, "EMBEDDING_MODEL_VERSION", version)
+    assert embeddings.get_embedding_tag("m", backend) == tag
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import pre_doc
+
+
+@pytest.fixture
+def hashed(tmp_path, monkeypatch):
+    """Thư mục tài liệu/manifest tạm; trả về danh sách file đã bị hash"""
+    monkeypatch.setattr(pre_doc, "DOCUMENTS_DIR", str(tmp_path / "documents"))
+    monkeypatch.setattr(pre_doc, "VECTOR_STORES_DIR", str(tmp_path / "vector_stores"))
+    monkeypatch.setattr(pre_doc, "MANIFEST_PATH",
+                        str(tmp_path / "vector_stores" / "documents_manifest.json"))
+    calls = []
+    original = pre_doc.get_file_hash
+
+    def get_file_hash(file_path):
+        calls.append(os.path.basename(file_path))
+        return original(file_path)
+
+    monkeypatch.setattr(pre_doc, "get_file_hash", get_file_hash)
+    pre_doc.create_directories()
+    return calls
+
+
+def _write(name, content: bytes, mtime_ns=None):
+    path = os.path.join(pre_doc.DOCUMENTS_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_file_hash_reads_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(pre_doc, "HASH_CHUNK_SIZE", 3)
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"0123456789")
+    assert pre_doc.get_file_hash(str(path)) == hashlib.md5(b"0123456789").hexdigest()[:8]
+
+
+def test_unchanged_files_are_not_rehashed(hashed):
+    _write("a.pdf", b"aaaa")
+    _write("b.pdf", b"bbbb")
+    documents = pre_doc.get_available_documents()
+    assert sorted(hashed) == ["a.pdf", "b.pdf"]
+    assert [doc['hash'] for doc in documents] == [
+        hashlib.md5(b"aaaa").hexdigest()[:8], hashlib.md5(b"bbbb").hexdigest()[:8]]
+
+    hashed.clear()
+    assert pre_doc.get_available_documents() == documents
+    assert pre_doc.get_cached_file_hash(documents[0]['path']) == documents[0]['hash']
+    assert hashed == []
+
+
+def test_changed_size_or_mtime_is_rehashed(hashed):
+    path = _write("a.pdf", b"aaaa", mtime_ns=1_000_000_000)
+    old_hash = pre_doc.get_cached_file_hash(path)
+
+    hashed.clear()
+    _write("a.pdf", b"cccc", mtime_ns=2_000_000_000)  # Cùng size, khác mtime
+    assert pre_doc.get_cached_file_hash(path) != old_hash
+    _write("a.pdf", b"cccccc", mtime_ns=2_000_000_000)  # Cùng mtime, khác size
+    pre_doc.get_cached_file_hash(path)
+    assert hashed == ["a.pdf", "a.pdf"]
+
+
+def test_deleted_files_leave_the_manifest(hashed):
+    _write("a.pdf", b"aaaa")
+    b_path = _write("b.pdf", b"bbbb")
+    pre_doc.get_available_documents()
+
+    os.remove(b_path)
+    assert [doc['filename'] for doc in pre_doc.get_available_documents()] == ["a.pdf"]
+    with open(pre_doc.MANIFEST_PATH, encoding='utf-8') as f:
+        assert list(json.load(f)) == [os.path.normpath(os.path.join(pre_doc.DOCUMENTS_DIR, "a.pdf"))]
+
+
+def test_corrupt_manifest_is_rebuilt(hashed):
+    path = _write("a.pdf", b"aaaa")
+    with open(pre_doc.MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        f.write("{hỏng")
+    assert pre_doc._load_manifest() == {}
+    assert pre_doc.get_cached_file_hash(path) == hashlib.md5(b"aaaa").hexdigest()[:8]
+    assert pre_doc._load_manifest()[os.path.normpath(path)]['size'] == 4
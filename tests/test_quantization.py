@@ -0,0 +1,115 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+import storage
+from faiss_index import (
+    VECTOR_FLOAT16,
+    VECTOR_FLOAT32,
+    VECTOR_INT8,
+    MmapFlatIndex,
+    RescoringIndex,
+    build_index,
+    dequantize_vectors,
+    get_vector_dtype,
+    quantization_report,
+    quantize_vectors,
+)
+
+
+def _vectors(n, d=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+
+
+@pytest.mark.parametrize("vector_dtype, dtype, tolerance", [
+    (VECTOR_FLOAT32, np.float32, 0.0),
+    (VECTOR_FLOAT16, np.float16, 1e-2),
+    (VECTOR_INT8, np.uint8, None),
+])
+def test_quantize_round_trip(vector_dtype, dtype, tolerance):
+    vectors = _vectors(100)
+    codes, quantizer = quantize_vectors(vectors, vector_dtype)
+    assert codes.dtype == dtype
+    decoded = dequantize_vectors(codes, quantizer)
+    assert decoded.dtype == np.float32
+    if tolerance is None:
+        # int8: sai số tối đa nửa bước lượng tử của từng chiều
+        tolerance = quantizer[1] / 255 / 2 + 1e-6
+    assert (np.abs(decoded - vectors) <= tolerance).all()
+
+
+def test_int8_constant_dimension_and_empty():
+    vectors = np.ones((4, 3), dtype=np.float32)
+    codes, quantizer = quantize_vectors(vectors, VECTOR_INT8)
+    assert np.allclose(dequantize_vectors(codes, quantizer), vectors)
+
+    codes, quantizer = quantize_vectors(np.zeros((0, 3), dtype=np.float32), VECTOR_INT8)
+    assert codes.shape == (0, 3) and quantizer.shape == (2, 3)
+
+
+def test_rescoring_restores_exact_distances():
+    vectors = _vectors(300)
+    queries = _vectors(10, seed=1)
+    exact = faiss.IndexFlatL2(16)
+    exact.add(vectors)
+    expected_distances, expected_ids = exact.search(queries, 5)
+
+    codes, quantizer = quantize_vectors(vectors, VECTOR_INT8)
+    rescored = RescoringIndex(MmapFlatIndex(codes, quantizer=quantizer), vectors)
+    distances, ids = rescored.search(queries, 5)
+    assert np.allclose(distances, expected_distances, atol=1e-3)
+    assert (ids == expected_ids).mean() >= 0.9
+    assert np.array_equal(rescored.reconstruct_n(0, 3), vectors[:3])
+    with pytest.raises(RuntimeError):
+        rescored.add(vectors[:1])
+
+
+def test_quantization_report():
+    report = quantization_report(_vectors(500), k=5, n_queries=20)
+    assert report[VECTOR_FLOAT32]['recall_at_k'] == 1.0
+    assert report[VECTOR_FLOAT16]['memory_mb'] == pytest.approx(report[VECTOR_FLOAT32]['memory_mb'] / 2, abs=1e-3)
+    assert report[VECTOR_INT8]['rescored_recall_at_k'] >= report[VECTOR_INT8]['recall_at_k']
+
+
+def test_sq_index_dtype():
+    index, params = build_index(_vectors(2000), "ivf", vector_dtype=VECTOR_FLOAT16)
+    assert get_vector_dtype(index) == VECTOR_FLOAT16 and params['vector_dtype'] == VECTOR_FLOAT16
+    index, _ = build_index(_vectors(500), "hnsw", vector_dtype=VECTOR_INT8)
+    assert get_vector_dtype(index) == VECTOR_INT8
+    index, params = build_index(_vectors(20000), "ivfpq", vector_dtype=VECTOR_INT8)
+    assert params['vector_dtype'] == VECTOR_FLOAT32
+
+
+@pytest.mark.parametrize("vector_dtype", [VECTOR_FLOAT16, VECTOR_INT8])
+def test_quantized_store_round_trip(tmp_path, vector_dtype):
+    texts = [f"chunk {i} về giấy phép" for i in range(40)]
+    store = FAISS.from_texts(texts, DeterministicFakeEmbedding(size=16))
+    path = str(tmp_path / "store")
+    storage.save_store(store, path, vector_dtype=vector_dtype)
+    assert os.path.exists(os.path.join(path, storage.FULL_VECTORS_FILE))
+    assert os.path.exists(os.path.join(path, storage.QUANTIZER_FILE)) == (vector_dtype == VECTOR_INT8)
+
+    loaded = storage.load_store(path, store.embeddings)
+    assert isinstance(loaded.index, RescoringIndex)
+    query = store.embeddings.embed_query("chunk 3")
+    assert [d.page_content for d in loaded.similarity_search_by_vector(query, k=4)] == \
+        [d.page_content for d in store.similarity_search_by_vector(query, k=4)]
+
+    # Bản sửa được là float32 gốc; lưu lại float32 thì bỏ các file của bản nén
+    editable = storage.load_store(path, store.embeddings, mmap=False)
+    assert np.array_equal(editable.index.reconstruct_n(0, 40), store.index.reconstruct_n(0, 40))
+    editable.add_documents([Document(page_content="chunk mới")])
+    storage.save_store(editable, path)
+    assert not os.path.exists(os.path.join(path, storage.FULL_VECTORS_FILE))
+    assert storage.load_store(path, store.embeddings).index.ntotal == 41
+
+
+def test_invalid_vector_dtype(tmp_path):
+    store = FAISS.from_texts(["a"], DeterministicFakeEmbedding(size=4))
+    with pytest.raises(ValueError):
+        storage.save_store(store, str(tmp_path / "store"), vector_dtype="int4")
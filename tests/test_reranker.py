@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.schema import Document
+
+import reranker
+
+
+class SlowModel:
+    """Cross-encoder giả: điểm tăng theo vị trí, chờ delay giây mỗi lần predict"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def predict(self, pairs, **kwargs):
+        time.sleep(self.delay)
+        return list(range(len(pairs)))
+
+
+@pytest.fixture
+def model(monkeypatch):
+    def install(delay: float):
+        monkeypatch.setitem(reranker._models,
+                            (reranker.RERANK_MODEL_NAME, reranker.RERANK_DEVICE), SlowModel(delay))
+        monkeypatch.setattr(reranker, '_stats', dict(reranker._stats, calls=0, reranked=0,
+                                                     fallback_budget=0, fallback_busy=0))
+    yield install
+    # Chờ predict còn chạy xong để không ảnh hưởng test sau
+    reranker._executor.submit(lambda: None).result()
+    reranker._overrun.clear()
+
+
+DOCS = [Document(page_content=str(i)) for i in range(5)]
+
+
+def _contents(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_rerank_orders_by_score(model):
+    model(0.0)
+    assert _contents(reranker.rerank_documents("q", DOCS, 3, 1000)) == ['4', '3', '2']
+
+
+def test_overrun_skips_until_predict_finishes(model):
+    model(0.3)
+    assert _contents(reranker.rerank_documents("q", DOCS, 3, 50)) == ['0', '1', '2']
+    assert _contents(reranker.rerank_documents("q", DOCS, 3, 1000)) == ['0', '1', '2']
+    stats = reranker.get_rerank_stats()
+    assert (stats['fallback_budget'], stats['fallback_busy']) == (1, 1)
+
+    reranker._executor.submit(lambda: None).result()
+    assert _contents(reranker.rerank_documents("q", DOCS, 3, 1000)) == ['4', '3', '2']
+
+
+def test_concurrent_calls_within_budget_all_rerank(model):
+    model(0.05)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: reranker.rerank_documents("q", DOCS, 3, 2000), range(4)))
+    assert all(_contents(docs) == ['4', '3', '2'] for docs in results)
+    stats = reranker.get_rerank_stats()
+    assert (stats['reranked'], stats['fallback_busy']) == (4, 0)
@@ -0,0 +1,92 @@
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+from shards import ShardSet, shard_source_file
+from sparse_index import BM25Index
+
+
+class FakeStore:
+    """Vector store tối thiểu mà ShardSet dùng: index, index_to_docstore_id, docstore"""
+
+    def __init__(self, vectors, texts):
+        self.index = faiss.IndexFlatL2(len(vectors[0]))
+        self.index.add(np.asarray(vectors, dtype=np.float32))
+        ids = [f"id{i}" for i in range(len(texts))]
+        self.index_to_docstore_id = dict(enumerate(ids))
+        self.docstore = InMemoryDocstore({doc_id: Document(page_content=text)
+                                          for doc_id, text in zip(ids, texts)})
+
+
+def _shard(vectors, texts):
+    store = FakeStore(vectors, texts)
+    sparse_index = BM25Index()
+    sparse_index.add(store.index_to_docstore_id.values(), texts)
+    return store, sparse_index
+
+
+SHARDS = {
+    # Shard a: từ "phép" hiếm nên cả hai chunk có điểm BM25 cao
+    'a.pdf_111': _shard([[0.0, 0.0], [5.0, 5.0], [6.0, 6.0]],
+                        ["giấy phép", "cấp phép mới", "khác hẳn"]),
+    # Shard lớn: "phép" xuất hiện nhiều nên điểm BM25 thấp hơn ở mọi hạng
+    'b.pdf_222': _shard([[1.0, 0.0], [0.1, 0.0], [9.0, 9.0]],
+                        ["phép phép", "phép", "phép nữa"]),
+}
+
+
+def _shard_set(loads=None):
+    def loader(key):
+        if loads is not None:
+            loads.append(key)
+        return SHARDS.get(key)
+    return ShardSet(loader, list(SHARDS) + ['missing.pdf_333'])
+
+
+def test_shard_source_file_and_select():
+    assert shard_source_file("bao_cao_2024.pdf_abcd") == "bao_cao_2024.pdf"
+    shards = _shard_set()
+    assert shards.source_files() == ['a.pdf', 'b.pdf', 'missing.pdf']
+    assert shards.select(['b.pdf']) == ['b.pdf_222']
+    assert shards.select() == shards.keys()
+    assert shards.select(['none.pdf']) == []
+
+
+def test_dense_hits_merged_by_distance():
+    shards = _shard_set()
+    (dense, _), = shards.search(["x"], np.array([[0.0, 0.0]], dtype=np.float32), 3)
+    assert dense == [('a.pdf_111', 'id0'), ('b.pdf_222', 'id1'), ('b.pdf_222', 'id0')]
+
+
+def test_sparse_hits_fused_by_rank_not_score():
+    shards = _shard_set()
+    (_, sparse), = shards.search(["phép"], np.zeros((1, 2), dtype=np.float32), 4)
+
+    best_b = SHARDS['b.pdf_222'][1].search("phép", 1)[0][1]
+    assert min(score for _, score in SHARDS['a.pdf_111'][1].search("phép", 2)) > best_b
+    # Gộp theo điểm sẽ lấy hai chunk của a; RRF đưa hạng 1 của mỗi shard lên trước
+    assert {key for key, _ in sparse[:2]} == {'a.pdf_111', 'b.pdf_222'}
+    assert len(sparse) == 4
+
+
+def test_search_limited_to_selected_files():
+    loads = []
+    shards = _shard_set(loads)
+    (dense, sparse), = shards.search(["phép"], np.zeros((1, 2), dtype=np.float32), 5,
+                                     source_files=['a.pdf'])
+    assert loads == ['a.pdf_111']
+    assert {key for key, _ in dense + sparse} == {'a.pdf_111'}
+    assert shards.lookup(('a.pdf_111', 'id0')).page_content == "giấy phép"
+
+
+def test_with_keys_reuses_loaded_shards():
+    loads = []
+    shards = _shard_set(loads)
+    shards.search(["phép"], np.zeros((1, 2), dtype=np.float32), 2)
+    assert sorted(loads) == ['a.pdf_111', 'b.pdf_222', 'missing.pdf_333']
+
+    loads.clear()
+    smaller = shards.with_keys(['b.pdf_222'])
+    smaller.search(["phép"], np.zeros((1, 2), dtype=np.float32), 2)
+    assert loads == [] and len(smaller) == 1
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+from hybrid_retriever import reciprocal_rank_fusion
+from sparse_index import BM25Index, SQLiteBM25Index, tokenize
+
+DOCS = {
+    'a': "Nghị định 85/2020/NĐ-CP quy định chi tiết Luật Kiến trúc",
+    'b': "Điều 3 quy định về chứng chỉ hành nghề kiến trúc",
+    'c': "Thông tư hướng dẫn thủ tục cấp giấy phép xây dựng",
+    'd': "Giấy phép xây dựng được cấp trong 20 ngày, giấy phép tạm thời 10 ngày",
+}
+
+
+def _index() -> BM25Index:
+    index = BM25Index()
+    index.add(DOCS.keys(), DOCS.values())
+    return index
+
+
+def test_tokenize_keeps_codes_and_their_parts():
+    tokens = tokenize("Theo NĐ 85/2020/NĐ-CP, Điều 3.2")
+    assert tokens == ["theo", "nđ", "85/2020/nđ-cp", "85", "2020", "nđ", "cp",
+                      "điều", "3.2", "3", "2"]
+    # Cùng một chữ có dấu ở dạng tổ hợp vẫn ra cùng một từ
+    assert tokenize("HO\u00c0") == tokenize("hoa\u0300")
+
+
+def test_search_ranks_matching_chunks():
+    index = _index()
+    assert index.search("85/2020/NĐ-CP", 2)[0][0] == 'a'
+    ids = [doc_id for doc_id, _ in index.search("giấy phép xây dựng", 4)]
+    assert ids == ['d', 'c']
+    assert index.search("không có từ này", 4) == []
+    assert index.search("kiến trúc", 0) == []
+
+
+def test_remove_and_replace():
+    index = _index()
+    index.remove(['d', 'missing'])
+    assert len(index) == 3 and 'd' not in index
+    assert [doc_id for doc_id, _ in index.search("giấy phép", 4)] == ['c']
+
+    index.add(['c'], ["chứng chỉ"])
+    assert index.search("giấy phép", 4) == []
+    assert index.total_length == sum(index.doc_lengths.values())
+
+
+def test_merge_selected_ids():
+    index = BM25Index()
+    index.merge(_index(), ids=['a', 'b'])
+
+    expected = BM25Index()
+    expected.add(['a', 'b'], [DOCS['a'], DOCS['b']])
+    assert index.postings == expected.postings
+    assert index.total_length == expected.total_length
+    assert index.search("giấy phép", 4) == []
+
+
+def test_saved_index_scores_like_memory(tmp_path):
+    index = _index()
+    path = str(tmp_path / "sparse_index.sqlite")
+    index.save(path)
+    saved = SQLiteBM25Index.open(path)
+
+    assert len(saved) == len(index)
+    for query in ["giấy phép xây dựng", "85/2020/NĐ-CP kiến trúc", "quy định", "ngày"]:
+        expected = dict(index.search(query, 10))
+        found = dict(saved.search(query, 10))
+        assert found.keys() == expected.keys()
+        for doc_id, score in expected.items():
+            assert found[doc_id] == pytest.approx(score)
+    assert saved.search("giấy phép", 1) == index.search("giấy phép", 1)
+    assert saved.search("không có", 5) == []
+
+
+def test_load_round_trip(tmp_path):
+    index = _index()
+    path = str(tmp_path / "sparse_index.sqlite")
+    index.save(path)
+    loaded = BM25Index.load(path)
+
+    assert loaded.postings == index.postings
+    assert loaded.doc_lengths == index.doc_lengths
+    assert loaded.total_length == index.total_length
+
+
+def test_open_rejects_missing_or_other_format(tmp_path):
+    assert SQLiteBM25Index.open(str(tmp_path / "missing.sqlite")) is None
+
+    path = tmp_path / "old.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO meta VALUES ('format_version', '1')")
+    conn.commit()
+    conn.close()
+    assert SQLiteBM25Index.open(str(path)) is None
+    assert BM25Index.load(str(path)) is None
+
+    (tmp_path / "sparse_index.json").write_text("{}")
+    assert SQLiteBM25Index.open(str(tmp_path / "sparse_index.json")) is None
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], rrf_k=60)
+    assert [doc_id for doc_id, _ in fused] == ['a', 'c', 'b']
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+
+    weighted = reciprocal_rank_fusion([['a'], ['b']], weights=[1.0, 2.0])
+    assert [doc_id for doc_id, _ in weighted] == ['b', 'a']
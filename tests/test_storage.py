@@ -0,0 +1,127 @@
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+import faiss_index
+import storage
+from faiss_index import MmapFlatIndex
+from sparse_index import SQLiteBM25Index
+
+TEXTS = [f"Điều {i}: quy định về giấy phép loại {i % 3}" for i in range(12)]
+
+
+@pytest.fixture
+def store():
+    metadatas = [{'source_file': "a.pdf", 'page': i // 4, 'chunk_id': i, 'ghi_chu': f"mục {i}"}
+                 for i in range(len(TEXTS))]
+    return FAISS.from_texts(TEXTS, DeterministicFakeEmbedding(size=16), metadatas=metadatas)
+
+
+def _ids(store):
+    return [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+
+
+def test_mmap_store_round_trip(store, tmp_path):
+    path = str(tmp_path / "a.pdf_1234")
+    storage.save_store(store, path, embedding_tag="fake")
+    assert storage.has_mmap_layout(path) and not storage.is_legacy_store(path)
+    assert storage.get_store_embedding(path) == "fake"
+
+    loaded = storage.load_store(path, store.embeddings)
+    assert isinstance(loaded.index, MmapFlatIndex)
+    assert [loaded.index_to_docstore_id[i] for i in range(len(TEXTS))] == _ids(store)
+    doc = loaded.docstore.search(_ids(store)[5])
+    assert doc.page_content == TEXTS[5]
+    assert doc.metadata == {'source_file': "a.pdf", 'page': 1, 'chunk_id': 5, 'ghi_chu': "mục 5"}
+
+    query = TEXTS[7]
+    assert [d.page_content for d in loaded.similarity_search(query, k=3)] == \
+        [d.page_content for d in store.similarity_search(query, k=3)]
+    assert len(storage.load_sparse_index(path)) == len(TEXTS)
+
+
+def test_mmap_store_is_read_only(store, tmp_path):
+    path = str(tmp_path / "store")
+    storage.save_store(store, path)
+    loaded = storage.load_store(path, store.embeddings)
+    with pytest.raises(RuntimeError):
+        loaded.add_texts(["mới"])
+    with pytest.raises(ValueError):
+        loaded.docstore.add({'x': Document(page_content="mới")})
+    with pytest.raises(TypeError):
+        loaded.index_to_docstore_id[0] = 'x'
+
+
+def test_editable_load(store, tmp_path):
+    path = str(tmp_path / "store")
+    storage.save_store(store, path)
+    editable = storage.load_store(path, store.embeddings, mmap=False)
+    assert isinstance(editable.index, faiss.IndexFlatL2)
+    editable.add_texts(["chunk mới"])
+    editable.delete([_ids(store)[0]])
+    assert editable.index.ntotal == len(TEXTS)
+    assert storage.load_sparse_index(path, mmap=False).search("giấy phép", 1)
+
+
+def test_ivf_store_round_trip(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((400, 8)).astype(np.float32)
+    index, _ = faiss_index.build_index(vectors, faiss_index.INDEX_IVF)
+    docs = {str(i): Document(page_content=f"chunk {i}") for i in range(len(vectors))}
+    store = FAISS(DeterministicFakeEmbedding(size=8), index,
+                  storage.InMemoryDocstore(docs), {i: str(i) for i in range(len(vectors))})
+    path = str(tmp_path / "ivf")
+    storage.save_store(store, path)
+
+    loaded = storage.load_store(path, store.embeddings)
+    assert faiss_index.get_index_type(loaded.index) == faiss_index.INDEX_IVF
+    _, expected = index.search(vectors[:5], 3)
+    _, found = loaded.index.search(vectors[:5], 3)
+    assert (found == expected).all()
+
+
+def test_newer_format_is_rejected(store, tmp_path):
+    path = str(tmp_path / "store")
+    storage.save_store(store, path)
+    info_path = os.path.join(path, storage.STORE_INFO_FILE)
+    with open(info_path, encoding='utf-8') as f:
+        info = json.load(f)
+    info['format_version'] = storage.STORE_FORMAT_VERSION + 1
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    with pytest.raises(ValueError):
+        storage.load_store(path, store.embeddings)
+    assert storage.get_store_embedding(path) is None
+
+
+def test_mmap_flat_index_matches_faiss(monkeypatch):
+    monkeypatch.setattr(faiss_index, "MMAP_SEARCH_BLOCK", 7)  # Nhiều block, block cuối lẻ
+    vectors = np.random.default_rng(1).standard_normal((50, 8)).astype(np.float32)
+    queries = np.random.default_rng(2).standard_normal((4, 8)).astype(np.float32)
+    exact = faiss.IndexFlatL2(8)
+    exact.add(vectors)
+
+    distances, ids = MmapFlatIndex(vectors, (vectors ** 2).sum(axis=1)).search(queries, 5)
+    expected_distances, expected_ids = exact.search(queries, 5)
+    assert (ids == expected_ids).all()
+    assert np.allclose(distances, expected_distances, atol=1e-4)
+
+    # k lớn hơn số vector: phần thiếu là -1 như FAISS
+    _, ids = MmapFlatIndex(vectors[:3]).search(queries, 5)
+    assert (ids[:, 3:] == -1).all() and (np.sort(ids[:, :3]) == [0, 1, 2]).all()
+
+
+def test_saved_sparse_index_replaces_legacy_json(store, tmp_path):
+    path = str(tmp_path / "store")
+    os.makedirs(path)
+    legacy = os.path.join(path, storage.LEGACY_SPARSE_INDEX_FILE)
+    with open(legacy, 'w') as f:
+        f.write("{}")
+    storage.save_store(store, path)
+    assert not os.path.exists(legacy)
+    assert isinstance(storage.load_sparse_index(path), SQLiteBM25Index)
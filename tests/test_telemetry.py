@@ -0,0 +1,69 @@
+import pytest
+
+import telemetry
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    telemetry.reset()
+    yield
+    telemetry.reset()
+
+
+def test_stage_stats_and_item_counters():
+    for ms in range(1, 101):
+        telemetry.record("query.retrieve", ms / 1000, chunks=2, mode="hybrid", cached=True)
+    stats = telemetry.get_stage_stats()["query.retrieve"]
+
+    assert stats['count'] == 100 and stats['errors'] == 0
+    assert stats['p50_ms'] == pytest.approx(50.5)
+    assert stats['p95_ms'] == pytest.approx(95.05)
+    assert stats['last_ms'] == pytest.approx(100)
+    # Chỉ attrs dạng số (không phải bool) được cộng dồn
+    assert stats['items'] == {'chunks': 200}
+    assert telemetry.get_recent_spans(1)[0]['mode'] == "hybrid"
+
+
+def test_rolling_window(monkeypatch):
+    monkeypatch.setattr(telemetry, "ROLLING_WINDOW", 3)
+    for seconds in (10.0, 10.0, 0.001, 0.001, 0.001):
+        telemetry.record("stage", seconds)
+    stats = telemetry.get_stage_stats()["stage"]
+    assert stats['count'] == 5 and stats['p95_ms'] == pytest.approx(1.0)
+
+
+def test_span_records_errors_and_reraises():
+    trace_id = telemetry.new_trace_id()
+    with telemetry.span("ingest.embed", trace_id=trace_id) as current:
+        current.set(chunks=5)
+    with pytest.raises(ValueError):
+        with telemetry.span("ingest.document", trace_id=trace_id, file="a.pdf"):
+            raise ValueError("PDF hỏng")
+
+    assert telemetry.get_stage_stats()["ingest.document"]['errors'] == 1
+    assert telemetry.get_last_error("ingest.document") == "ValueError: PDF hỏng"
+    assert telemetry.get_last_error("ingest.embed") is None
+    error = telemetry.get_recent_errors()[0]
+    assert error['trace_id'] == trace_id and "PDF hỏng" in error['traceback']
+
+    spans = telemetry.get_recent_spans(trace_id=trace_id)
+    assert [s['stage'] for s in spans] == ["ingest.document", "ingest.embed"]
+    assert spans[1]['chunks'] == 5
+    assert telemetry.get_recent_spans(trace_id="khác") == []
+
+
+def test_export_prometheus():
+    telemetry.record("query.llm", 0.02, tokens=120)
+    telemetry.record("query.llm", 3.0, error=RuntimeError("timeout"))
+    telemetry.record('la"bel', 0.5)
+    text = telemetry.export_prometheus()
+
+    name = "rag_stage_duration_seconds"
+    assert f'{name}_bucket{{stage="query.llm",le="0.025"}} 1' in text
+    assert f'{name}_bucket{{stage="query.llm",le="5.0"}} 2' in text
+    assert f'{name}_bucket{{stage="query.llm",le="+Inf"}} 2' in text
+    assert f'{name}_sum{{stage="query.llm"}} 3.020000' in text
+    assert 'rag_stage_errors_total{stage="query.llm"} 1' in text
+    assert 'rag_stage_items_total{stage="query.llm",item="tokens"} 120' in text
+    assert 'stage="la\\"bel"' in text
+    assert text.endswith("\n")
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+import embeddings
+import llm_rag
+import pre_doc
+import reranker
+import warmup
+
+
+@pytest.fixture
+def steps(monkeypatch):
+    """Warm-up với trạng thái mới và các bước load giả (ghi lại thứ tự)"""
+    calls = []
+    release = threading.Event()
+
+    def ensure_vector_store_loaded():
+        release.wait(5)
+        calls.append(warmup.STARTUP_VECTOR_STORE)
+
+    def initialize_default_chain():
+        calls.append(warmup.STARTUP_QA_CHAIN)
+        raise ValueError("Không có API key")
+
+    monkeypatch.setattr(warmup, "_timings", {})
+    monkeypatch.setattr(warmup, "_errors", {})
+    monkeypatch.setattr(warmup, "_thread", None)
+    monkeypatch.setattr(warmup, "_done", threading.Event())
+    monkeypatch.setattr(embeddings, "get_embeddings",
+                        lambda: calls.append(warmup.STARTUP_EMBEDDINGS))
+    monkeypatch.setattr(pre_doc, "ensure_vector_store_loaded", ensure_vector_store_loaded)
+    monkeypatch.setattr(llm_rag, "initialize_default_chain", initialize_default_chain)
+    monkeypatch.setattr(reranker, "RERANK_ENABLED", False)
+    return calls, release
+
+
+def test_warmup_runs_stages_once_in_background(steps):
+    calls, release = steps
+    assert warmup.start_warmup()
+    assert not warmup.start_warmup()
+    # UI không bị chặn trong lúc index đang load
+    assert not warmup.wait_until_warm(0.05) and not warmup.is_warm()
+
+    release.set()
+    assert warmup.wait_until_warm(5)
+    assert calls == [warmup.STARTUP_EMBEDDINGS, warmup.STARTUP_VECTOR_STORE,
+                     warmup.STARTUP_QA_CHAIN]
+
+
+def test_errors_do_not_stop_warmup(steps, monkeypatch):
+    calls, release = steps
+    release.set()
+    monkeypatch.setattr(reranker, "RERANK_ENABLED", True)
+    monkeypatch.setattr(reranker, "get_reranker", lambda: calls.append(warmup.STARTUP_RERANKER))
+    warmup.start_warmup()
+    warmup.wait_until_warm(5)
+
+    startup = warmup.get_startup_timings()
+    assert startup['done']
+    assert startup['errors'] == {warmup.STARTUP_QA_CHAIN: "Không có API key"}
+    assert set(startup['timings']) == {warmup.STARTUP_EMBEDDINGS, warmup.STARTUP_VECTOR_STORE,
+                                       warmup.STARTUP_QA_CHAIN, warmup.STARTUP_RERANKER}
+    assert calls[-1] == warmup.STARTUP_RERANKER
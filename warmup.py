@@ -0,0 +1,83 @@
+import time
+import threading
+from typing import Dict, Optional
+
+# Các giai đoạn khởi động (theo thứ tự chạy)
+STARTUP_IMPORTS = "imports"          # Import các module của app
+STARTUP_EMBEDDINGS = "embeddings"    # Load model embedding
+STARTUP_VECTOR_STORE = "vector_store"  # Hash tài liệu + load/cập nhật index
+STARTUP_QA_CHAIN = "qa_chain"        # Tạo LLM client + QA chain mặc định
+STARTUP_RERANKER = "reranker"        # Load cross-encoder (chỉ khi bật rerank)
+
+_timings: Dict[str, float] = {}
+_errors: Dict[str, str] = {}
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_done = threading.Event()
+
+
+def record_timing(stage: str, seconds: float):
+    """Ghi lại thời gian của một giai đoạn khởi động"""
+    with _lock:
+        _timings[stage] = round(seconds, 3)
+
+
+def _timed(stage: str, func):
+    """Chạy func, ghi thời gian và lỗi (nếu có) của giai đoạn"""
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        with _lock:
+            _errors[stage] = str(e)
+    finally:
+        record_timing(stage, time.perf_counter() - start)
+
+
+def _warmup():
+    """Load các thành phần nặng theo thứ tự, mỗi thứ đúng một lần"""
+    # Import trong thread để không chặn lần render đầu tiên
+    from embeddings import get_embeddings
+    from pre_doc import ensure_vector_store_loaded
+    from llm_rag import initialize_default_chain
+    from reranker import RERANK_ENABLED, get_reranker
+
+    try:
+        _timed(STARTUP_EMBEDDINGS, get_embeddings)
+        _timed(STARTUP_VECTOR_STORE, ensure_vector_store_loaded)
+        _timed(STARTUP_QA_CHAIN, initialize_default_chain)
+        if RERANK_ENABLED:
+            _timed(STARTUP_RERANKER, get_reranker)
+    finally:
+        _done.set()
+
+
+def start_warmup() -> bool:
+    """Chạy warm-up trong background thread (chỉ lần gọi đầu tiên có tác dụng)
+
+    Trả về True nếu lần gọi này khởi động thread. UI dùng được ngay; các
+    hàm cần model/index sẽ tự load hoặc chờ phần warm-up đang chạy.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return False
+        _thread = threading.Thread(target=_warmup, name="warmup", daemon=True)
+        _thread.start()
+        return True
+
+
+def is_warm() -> bool:
+    """Warm-up đã chạy xong chưa"""
+    return _done.is_set()
+
+
+def wait_until_warm(timeout: Optional[float] = None) -> bool:
+    """Chờ warm-up xong, trả về False nếu hết timeout"""
+    return _done.wait(timeout)
+
+
+def get_startup_timings() -> dict:
+    """Thời gian từng giai đoạn khởi động và lỗi (nếu có)"""
+    with _lock:
+        return {'timings': dict(_timings), 'errors': dict(_errors), 'done': _done.is_set()}